@@ -0,0 +1,233 @@
+"""
+Benchmark of the sync and stats paths of pocketstats on synthetic archives.
+
+Uses FakePocket, a stand-in for pocket.Pocket that serves a deterministic archive, and runs every
+benchmark on a fresh SQLite database in a temporary directory. Results are written to a JSON file,
+so runs of different versions can be compared.
+"""
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import tempfile
+import time
+import tracemalloc
+
+import click
+
+import pocketstats
+import pocketstats_core
+
+TAGS = ['python', 'news', 'longread', 'science', 'recipes', 'travel', 'work', 'music']
+WORDS = ['pocket', 'stats', 'reading', 'backlog', 'article', 'python', 'database', 'archive', 'habits', 'time']
+
+# Start of the synthetic archive; items are added one per START_INTERVAL seconds from here
+START_TIME = 1388534400  # 2014-01-01
+START_INTERVAL = 3600
+
+
+class FakePocket(object):
+    """
+    Stand-in for pocket.Pocket with a deterministic, synthetic archive of nr_items items.
+    Supports the parameters of get() that pocketstats uses: state, since, count, offset and sort
+    """
+
+    def __init__(self, nr_items, seed=42):
+        self.random = random.Random(seed)
+        self.items = {}
+        # item_id => 'since' value at which the item was last changed
+        self.changed_at = {}
+        self.since = START_TIME + nr_items * START_INTERVAL
+        self.next_id = 1
+        for _ in range(nr_items):
+            self._add_item(self.since - 1)
+
+    def _add_item(self, time_added):
+        item_id = str(self.next_id)
+        self.next_id += 1
+        title = ' '.join(self.random.choice(WORDS) for _ in range(6)).capitalize()
+        item = {
+            'item_id': item_id,
+            'resolved_id': item_id,
+            'given_url': 'https://example.com/given/' + item_id,
+            'resolved_url': 'https://example.com/articles/' + item_id,
+            'given_title': title,
+            'resolved_title': title,
+            'favorite': '0',
+            'status': '0',
+            'excerpt': ' '.join(self.random.choice(WORDS) for _ in range(30)),
+            'is_article': '1',
+            'has_image': str(self.random.randint(0, 1)),
+            'has_video': '0',
+            'word_count': str(self.random.randint(50, 8000)),
+            'time_added': str(time_added),
+            'time_updated': str(time_added),
+            'time_favorited': '0',
+            'time_read': '0',
+            'authors': {'1': {'author_id': '1', 'item_id': item_id, 'name': 'Author ' + str(self.random.randint(1, 50))}},
+            'images': {'1': {'image_id': '1', 'item_id': item_id, 'src': 'https://example.com/img/' + item_id + '.jpg'}},
+        }
+        if self.random.random() < 0.3:
+            item['tags'] = dict((tag, {'item_id': item_id, 'tag': tag}) for tag in self.random.sample(TAGS, 2))
+        self.items[item_id] = item
+        self.changed_at[item_id] = self.since
+
+    def advance(self, read_ratio=0.05, delete_ratio=0.01, favourite_ratio=0.01, add_ratio=0.02, seconds=86400):
+        """
+        Move the clock forward and change a fraction of the archive: read and favourite items that are
+        still in the list, delete some and add new ones. The changes are returned by get(since=...)
+        """
+        self.since += seconds
+        now = str(self.since)
+        live = [item_id for item_id in sorted(self.items, key=int) if self.items[item_id]['status'] != '2']
+        unread = [item_id for item_id in live if self.items[item_id]['status'] == '0']
+        for item_id in self.random.sample(unread, int(len(self.items) * read_ratio)):
+            item = self.items[item_id]
+            item['status'] = '1'
+            item['time_read'] = now
+            item['time_updated'] = now
+            self.changed_at[item_id] = self.since
+        for item_id in self.random.sample(live, int(len(self.items) * favourite_ratio)):
+            item = self.items[item_id]
+            item['favorite'] = '1'
+            item['time_favorited'] = now
+            item['time_updated'] = now
+            self.changed_at[item_id] = self.since
+        for item_id in self.random.sample(live, int(len(self.items) * delete_ratio)):
+            # Pocket only returns the bare minimum for deleted items
+            self.items[item_id] = {'item_id': item_id, 'status': '2'}
+            self.changed_at[item_id] = self.since
+        for _ in range(int(len(self.items) * add_ratio)):
+            self._add_item(now)
+
+    def get(self, state=None, favorite=None, tag=None, contentType=None, sort=None, detailType=None,
+            search=None, domain=None, since=None, count=None, offset=None):
+        item_ids = sorted(self.items, key=int)
+        if sort == 'newest':
+            item_ids.reverse()
+        # Like the real API, unread by default, and deleted items only show up as changes since a time
+        statuses = {'unread': ['0'], 'archive': ['1'], 'all': ['0', '1']}[state or 'unread']
+        if since:
+            statuses = statuses + ['2']
+            item_ids = [item_id for item_id in item_ids if self.changed_at[item_id] > int(since)]
+        item_ids = [item_id for item_id in item_ids if self.items[item_id]['status'] in statuses]
+        if offset:
+            item_ids = item_ids[offset:]
+        if count:
+            item_ids = item_ids[:count]
+        item_list = dict((item_id, self.items[item_id]) for item_id in item_ids)
+        for sort_id, item_id in enumerate(item_ids):
+            if 'resolved_id' in item_list[item_id]:
+                # Like the real API, the position of the item in the response
+                item_list[item_id] = dict(item_list[item_id], sort_id=sort_id)
+        # Like the real API, see pocketstats_core.get_item_list
+        response = {'status': 1, 'complete': 1, 'error': None, 'since': self.since, 'list': item_list or []}
+        return response, {}
+
+
+@contextlib.contextmanager
+def measure(results, size, name):
+    """
+    Record wall time and peak (Python) memory of the block in results
+    """
+    tracemalloc.start()
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        yield
+    duration = time.time() - start
+    peak_memory = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    results.append({'size': size, 'benchmark': name, 'seconds': round(duration, 4), 'peak_memory': peak_memory})
+    click.echo('{:>7} {:<18} {:>9.3f}s {:>8.1f} MiB'.format(size, name, duration, peak_memory / 1024.0 / 1024.0))
+
+
+def run_benchmarks(size, logger, bulk=False, seed=42, ratios=None):
+    """
+    Run all benchmarks for an archive of size items on a fresh database; returns the list of results
+    """
+    results = []
+    fake_pocket = FakePocket(size, seed=seed)
+    workdir = tempfile.mkdtemp(prefix='pocketstats-benchmark-')
+    db_filename = os.path.join(workdir, 'pocketstats.db')
+    previous_url = pocketstats_core.DATABASE_URL
+    pocketstats_core.DATABASE_URL = 'sqlite:///' + db_filename
+    try:
+        pocketstats_core._create_tables()
+
+        with measure(results, size, 'full import'):
+            session = pocketstats_core.get_db_connection()
+            pocketstats_core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+            session.close()
+
+        fake_pocket.advance(**(ratios or {}))
+        with measure(results, size, 'incremental sync'):
+            session = pocketstats_core.get_db_connection()
+            pocketstats_core.updatestats_since_last(logger, session, pocketstats_core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+            session.close()
+
+        with measure(results, size, 'showstats'):
+            pocketstats.showstats.callback()
+
+        with measure(results, size, 'showreadlist'):
+            pocketstats.showreadlist.callback(5, 'uniform', None)
+
+        # Move everything from the WAL into the database file; showstats leaves its session open, so closing
+        # the connections doesn't always do that
+        with pocketstats_core.get_db_engine().connect() as connection:
+            connection.execute('PRAGMA wal_checkpoint(TRUNCATE)')
+        pocketstats_core.get_db_engine().dispose()
+        results.append({'size': size, 'benchmark': 'db size', 'bytes': os.path.getsize(db_filename)})
+        click.echo('{:>7} {:<18} {:>9.1f} MiB'.format(size, 'db size', os.path.getsize(db_filename) / 1024.0 / 1024.0))
+    finally:
+        pocketstats_core.DATABASE_URL = previous_url
+        shutil.rmtree(workdir)
+    return results
+
+
+def get_version():
+    try:
+        return subprocess.check_output(['git', 'describe', '--always', '--dirty'], cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+@click.command()
+@click.option('--sizes', default='1000,10000,100000', help='Comma separated list of archive sizes')
+@click.option('--output', default='benchmark_results.json', help='JSON file to write the results to')
+@click.option('--bulk', is_flag=True, help='Use the bulk write path for the syncs')
+@click.option('--seed', default=42, help='Seed for generating the archives')
+@click.option('--read-ratio', default=0.05, help='Fraction of the archive read in the incremental sync')
+@click.option('--delete-ratio', default=0.01, help='Fraction of the archive deleted in the incremental sync')
+@click.option('--favourite-ratio', default=0.01, help='Fraction of the archive favourited in the incremental sync')
+@click.option('--add-ratio', default=0.02, help='Fraction of the archive size added in the incremental sync')
+def benchmark(sizes, output, bulk, seed, read_ratio, delete_ratio, favourite_ratio, add_ratio):
+    """
+    Benchmark full import, incremental sync, showstats and showreadlist on synthetic archives
+    """
+    ratios = {'read_ratio': read_ratio, 'delete_ratio': delete_ratio, 'favourite_ratio': favourite_ratio, 'add_ratio': add_ratio}
+    logger = pocketstats.get_logger()
+    results = []
+    for size in [int(size) for size in sizes.split(',')]:
+        results.extend(run_benchmarks(size, logger, bulk=bulk, seed=seed, ratios=ratios))
+
+    data = {
+        'version': get_version(),
+        'time': datetime.datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'bulk': bulk,
+        'seed': seed,
+        'ratios': ratios,
+        'results': results,
+    }
+    with open(output, 'w') as outfile:
+        json.dump(data, outfile, indent=2)
+    click.echo('Results written to ' + output)
+
+
+if __name__ == '__main__':
+    benchmark()
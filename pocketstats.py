@@ -1,28 +1,23 @@
+import atexit
 import datetime
 import json
 import logging
+import logging.handlers
+import os
+import queue
+import signal
 import sys
-from time import mktime
+import threading
 
 import click
-import pocket
-from pocket import Pocket
-from sqlalchemy import (Column, DateTime, Integer, String, Text, create_engine,
-                        desc, extract, func)
-#from sqlalchemy.engine.reflection import Inspector
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
-from utilkit import datetimeutil, printutil, stringutil
 
 import __main__ as main
 
-Base = declarative_base()
-
 try:
     import settings
 except ImportError:
-    print('Copy settings_example.py to settings.py and set the configuration to your own preferences')
-    sys.exit(1)
+    # Only the commands that talk to the Pocket API need it, see pocketstats_core.get_pocket_instance
+    settings = None
 
 # Debugging can be overridden in settings.py
 try:
@@ -30,419 +25,188 @@ try:
 except AttributeError:
     DEBUG = False
 
+# Totals as of the last update, for rendering stats without touching the database; can be overridden in settings.py
+try:
+    SNAPSHOT_FILENAME = settings.SNAPSHOT_FILENAME
+except AttributeError:
+    SNAPSHOT_FILENAME = 'pocketstats_snapshot.json'
 
-def debug_print(string):
-    if DEBUG:
-        print(string)
-
-
-def get_logger():
-    """
-    Create logging handler
-    """
-    ## Create logger
-    logger = logging.getLogger('pocketstats')
-    logger.setLevel(logging.DEBUG)
-    # create file handler which logs even debug messages
-    fh = logging.FileHandler('pocketstats.log')
-    fh.setLevel(logging.DEBUG)
-    # create formatter and add it to the handlers
-    formatter = logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    fh.setFormatter(formatter)
-    # add the handlers to the logger
-    logger.addHandler(fh)
-    return logger
-
-
-class Article(Base):
-    """
-    An item in the Pocket archive; can also be an Image or Video
-    """
-    __tablename__ = 'article'
-
-    id = Column(Integer, primary_key=True)
-    sort_id = Column(Integer)
-    item_id = Column(Integer)
-    resolved_id = Column(Integer)
-    given_url = Column(String)
-    resolved_url = Column(String)
-    given_title = Column(String)
-    resolved_title = Column(String)
-
-    # 0 or 1 - 1 If the item is favorited
-    favorite = Column(Integer)
-
-    # 0, 1, 2 - 1 if the item is archived - 2 if the item should be deleted
-    status = Column(Integer)
-    firstseen_status = Column(Integer)
-
-    excerpt = Column(Text)
-
-    # 0 or 1 - 1 if the item is an article
-    is_article = Column(Integer)
-
-    # 0, 1, or 2 - 1 if the item has images in it - 2 if the item is an image
-    has_image = Column(Integer)
-
-    # 0, 1, or 2 - 1 if the item has videos in it - 2 if the item is a video
-    has_video = Column(Integer)
-
-    # How many words are in the article
-    word_count = Column(Integer)
-
-    # JSON objects
-    tags = Column(Text)
-    authors = Column(Text)
-    images = Column(Text)
-    videos = Column(Text)
-
-    # First import of this item
-    firstseen_time = Column(DateTime)
-    # time_updated at time of the first import
-    firstseen_time_updated = Column(DateTime)
-    #local_updated = Column(DateTime)
-
-    time_updated = Column(DateTime)
-    time_favorited = Column(DateTime)
-    time_read = Column(DateTime)
-
-    def get_tags(self):
-        result = []
-        for tag in json.loads(self.tags):
-            result.append(tag)
-        return result
-
-    def __str__(self):
-        #return u'[' + str(self.item_id) + '] ' + self.resolved_title + ' - ' + self.resolved_url
-        return u'[' + str(self.item_id) + '] ' + str(self.resolved_url)
-
-
-    def __unicode__(self):
-        return self.__str__()
-
-
-class Report(Base):
-    """
-    Changes since the last report; e.g., how many added, read, deleted, favourited
-    """
-    __tablename__ = 'report'
-
-    id = Column(Integer, primary_key=True)
-    # Local DateTime of request
-    time_updated = Column(DateTime)
-    # DateTime stamp that Pocket reported for this request
-    time_since = Column(DateTime)
-    time_since_unix = Column(Integer)
-    # Stats
-    total_response = Column(Integer)
-    nr_added = Column(Integer)
-    nr_read = Column(Integer)
-    nr_deleted = Column(Integer)
-    nr_favourited = Column(Integer)
-    # Has updates according to change in time_updated
-    nr_updated = Column(Integer)
-    # Response metadata
-    status = Column(Integer)
-    complete = Column(Integer)
-    error = Column(Text)
-    # json summary of the changed articles (added, read, deleted, fav'd, updated)
-    changed_articles = Column(Text)
-
-
-    @property
-    def net_result(self):
-        return self.nr_added - self.nr_read - self.nr_deleted
-
-
-    def pretty_print(self):
-        """
-        Return a pretty overview of the report, usable for printing as import result
-        """
-        data = [['update at', datetimeutil.datetime_to_string(self.time_updated)], ['total in response', str(self.total_response)], ['updated', str(self.nr_updated)], ['added', str(self.nr_added)], ['read', str(self.nr_read)], ['favourited', str(self.nr_favourited)], ['deleted', str(self.nr_deleted)], ['net result', str(self.net_result)]]
-        result = ''
-        col_width = max(len(word) for row in data for word in row) + 2  # padding
-        for row in data:
-            result += u''.join(word.ljust(col_width) for word in row) + '\n'
-        return result
-
-
-    def print_changed_articles(self, session):
-        """
-        Return a pretty overview of the articles that were added/read/etc
-        """
-        changed_articles = json.loads(self.changed_articles)
-        result = u''
-        for changetype in changed_articles:
-            idlist = changed_articles[changetype]
-            result += u'\n== ' + changetype + ' ======\n'
-            for item_id in idlist:
-                this_item = get_existing_item(session, item_id)
-                result += u'' + str(this_item) + '\n'
-        return result
-
-
-    def __str__(self):
-        return u'Update at ' + datetimeutil.datetime_to_string(self.time_updated) + '; total in response: ' + str(self.total_response) + ', nr_updated: ' + str(self.nr_updated) + ', nr_added: ' + str(self.nr_added) + ', nr_read: ' + str(self.nr_read) + ', nr_favourited: ' + str(self.nr_favourited) + ', nr_deleted: ' + str(self.nr_deleted)
-
+# State of the daemon, for monitoring it; can be overridden in settings.py
+try:
+    HEARTBEAT_FILENAME = settings.HEARTBEAT_FILENAME
+except AttributeError:
+    HEARTBEAT_FILENAME = 'pocketstats_heartbeat.json'
 
-    def __unicode__(self):
-        return self.__str__()
+# Seconds between the updates of the daemon: halved after an update with changes, down to the minimum,
+# and doubled after an update without changes or an error, up to the maximum; can be overridden in settings.py
+try:
+    DAEMON_MIN_INTERVAL = settings.DAEMON_MIN_INTERVAL
+except AttributeError:
+    DAEMON_MIN_INTERVAL = 5 * 60
+try:
+    DAEMON_MAX_INTERVAL = settings.DAEMON_MAX_INTERVAL
+except AttributeError:
+    DAEMON_MAX_INTERVAL = 4 * 3600
 
+# cProfile dump of `updatestats --profile`
+PROFILE_FILENAME = 'pocketstats.prof'
 
-    def __repr__(self):
-        return self.__str__()
+# Logging: level, file, and 'text' or 'json' (one JSON object per line); can be overridden in settings.py
+try:
+    LOG_LEVEL = settings.LOG_LEVEL
+except AttributeError:
+    LOG_LEVEL = 'DEBUG' if DEBUG else 'INFO'
+try:
+    LOG_FILENAME = settings.LOG_FILENAME
+except AttributeError:
+    LOG_FILENAME = 'pocketstats.log'
+try:
+    LOG_FORMAT = settings.LOG_FORMAT
+except AttributeError:
+    LOG_FORMAT = 'text'
 
 
-def get_pocket_instance():
+class JsonFormatter(logging.Formatter):
     """
-    Connect to Pocket API
+    Formats a log record as a JSON object on one line; a traceback is part of the message, as the
+    QueueHandler formats it before queueing
     """
-    consumer_key = settings.consumer_key
-    access_token = settings.access_token
 
-    pocket_instance = pocket.Pocket(consumer_key, access_token)
-    return pocket_instance
+    def format(self, record):
+        data = {
+            'time': self.formatTime(record),
+            'name': record.name,
+            'level': record.levelname,
+            'message': record.getMessage(),
+        }
+        return json.dumps(data)
 
 
-def get_db_connection(get_engine=False):
+def get_logger():
     """
-    Create a SQLAlchemy session
+    Create logging handler, once: the logger puts the records on a queue, and a background thread writes them
+    to LOG_FILENAME, so logging doesn't slow down the sync
     """
-    #engine = create_engine('sqlite:///:memory:', echo=True)
-    # Relative path:
-    engine = create_engine('sqlite:///pocketstats.db')
-    Session = sessionmaker(bind=engine)
-    if get_engine:
-        return Session(), engine
+    logger = logging.getLogger('pocketstats')
+    if logger.handlers:
+        return logger
+    logger.setLevel(LOG_LEVEL)
+    fh = logging.FileHandler(LOG_FILENAME)
+    if LOG_FORMAT == 'json':
+        fh.setFormatter(JsonFormatter())
     else:
-        return Session()
-
+        fh.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    log_queue = queue.Queue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, fh)
+    listener.start()
+    # Write out what is still on the queue when exiting
+    atexit.register(listener.stop)
+    return logger
 
-def _create_tables():
-    session, engine = get_db_connection(get_engine=True)
 
-    #inspector = Inspector.from_engine(engine)
-    #for table_name in inspector.get_table_names():
-    #    print table_name
-    if (not engine.dialect.has_table(engine.connect(), "Article")) or (not engine.dialect.has_table(engine.connect(), "Report")):
-        # TODO: If Article and Report don't exist yet, create:
-        Base.metadata.create_all(engine)
+def write_json_file(filename, data):
+    # Write to a temporary file first, so readers never see a half written file
+    temp_filename = filename + '.tmp'
+    with open(temp_filename, 'w') as json_file:
+        json.dump(data, json_file)
+    os.replace(temp_filename, filename)
 
 
-def get_last_update():
+def write_snapshot(totals, last_sync):
     """
-    Return the timestamp of the last update from Pocket.
-    This will be used to filter the request of updates.
+    Save the totals (see pocketstats_core.get_rollup_totals) and the time of the last sync to the snapshot file
     """
-    session = get_db_connection()
-    try:
-        time_since_unix, report_id = session.query(Report.time_since_unix, Report.id).order_by(desc(Report.time_since))[0]
-        #return mktime(time_since.timetuple())
-        return time_since_unix
-    except IndexError:
-        return None
+    snapshot = dict(totals)
+    snapshot['last_sync'] = last_sync.strftime('%Y-%m-%d %H:%M:%S')
+    write_json_file(SNAPSHOT_FILENAME, snapshot)
 
 
-def get_existing_item(session, item_id):
+def read_snapshot():
     """
-    Returns the item with item_id if already in DB, otherwise None
+    Returns the snapshot written by the last update as dict, or None if there is none (yet)
     """
     try:
-        return session.query(Article).filter(Article.item_id == item_id)[0]
-    except IndexError:
+        with open(SNAPSHOT_FILENAME) as snapshot_file:
+            return json.load(snapshot_file)
+    except (IOError, ValueError):
         return None
 
 
-def get_random_unread(session, number=5):
+def save_snapshot(session):
     """
-    Get a (small) list of random items that have not been read yet
+    Write the snapshot file from the current state of the database
     """
-    #select.order_by(func.random()).limit(number)
-    return session.query(Article.resolved_title, Article.resolved_url, Article.firstseen_time_updated).filter(Article.status == 0).order_by(func.random()).limit(number)[0:number]
+    import pocketstats_core as core
+    last_report = session.query(core.Report.time_updated).order_by(core.Report.id.desc()).first()
+    write_snapshot(core.get_rollup_totals(session), last_report[0] if last_report else datetime.datetime.now())
 
 
-def get_count(q):
+def get_totals(fresh=False):
     """
-    Fast count for column, avoiding a subquery
+    Returns the totals and time of the last sync from the snapshot, or from the database when there's no
+    snapshot or fresh numbers are requested
     """
-    count_q = q.statement.with_only_columns([func.count()]).order_by(None)
-    count = q.session.execute(count_q).scalar()
-    return count
-
+    if not fresh:
+        snapshot = read_snapshot()
+        if snapshot:
+            return snapshot
+    import pocketstats_core as core
+    session = core.get_db_connection()
+    snapshot = core.get_rollup_totals(session)
+    last_report = session.query(core.Report.time_updated).order_by(core.Report.id.desc()).first()
+    snapshot['last_sync'] = last_report[0].strftime('%Y-%m-%d %H:%M:%S') if last_report else None
+    return snapshot
 
-def nr_total(session):
-    return get_count(session.query(Article.id))
 
-
-def nr_unread(session):
-    return get_count(session.query(Article).filter(Article.status == 0))
-
-
-def nr_read(session):
-    return get_count(session.query(Article).filter(Article.status == 1))
-
-
-def nr_deleted(session):
-    return get_count(session.query(Article).filter(Article.status == 2))
+def get_next_interval(interval, nr_changes, retry_after=None):
+    """
+    Returns the seconds the daemon waits until its next update, after an update with nr_changes items
+    that took place interval seconds after the one before. retry_after is the number of seconds the Pocket
+    API asked to wait, when rate limited
+    """
+    if retry_after is not None:
+        return max(min(interval * 2, DAEMON_MAX_INTERVAL), retry_after)
+    if nr_changes:
+        return max(interval // 2, DAEMON_MIN_INTERVAL)
+    return min(interval * 2, DAEMON_MAX_INTERVAL)
 
 
-def nr_favourited(session):
-    return get_count(session.query(Article).filter(Article.favorite == 1))
+def get_forecast_summary(forecast):
+    """
+    One line summary of a forecast from pocketstats_core.get_backlog_forecast
+    """
+    if forecast['rate'] is None:
+        return 'Not enough updates yet to forecast the backlog'
+    if forecast['completion'] is None:
+        return 'At {:+.1f} items per day, the {} unread items will not be read'.format(forecast['rate'], forecast['unread'])
+    return 'At {:+.1f} items per day, the {} unread items are read by {}'.format(forecast['rate'], forecast['unread'], forecast['completion'].strftime('%Y-%m-%d'))
 
 
-def get_read_progressbar(session):
+def get_read_progressbar(items_total, items_read):
+    from utilkit import printutil
     COLUMNS = 40
-    items_total = nr_total(session)
-    items_read = nr_read(session)
     return str(items_read) + '/' + str(items_total) + '  ' + printutil.progress_bar(items_total, items_read, COLUMNS, '.', '#', True)
 
 
-def updatestats_since_last(logger, session, last_time):
+def get_selected_accounts(engine, account_name, all_accounts):
     """
-    Get the changes since last time from the Pocket API
+    Returns the accounts from settings.py that updatestats and daemon update: only the one named account_name,
+    all of them, or else the first. Exits when there is no such account, or the database needs migrating first
     """
-    pocket_instance = get_pocket_instance()
-    if last_time:
-        items = pocket_instance.get(since=last_time, state='all', detailType='complete')
-    else:
-        if DEBUG:
-            # When debugging, limit to 20 items
-            items = pocket_instance.get(count=20, state='all', detailType='complete')
-        else:
-            items = pocket_instance.get(state='all', detailType='complete')
-    debug_print('Number of items in reponse: ' + str(len(items[0]['list'])))
-    logger.debug('Number of items in response: ' + str(len(items[0]['list'])))
-
-    now = datetime.datetime.now()
-    report = Report(time_updated=now)
-    nr_added = 0
-    nr_read = 0
-    nr_deleted = 0
-    nr_favourited = 0
-    nr_updated = 0
-    changed_articles = {'added': [], 'read': [], 'deleted': [], 'favourited': [], 'updated': []}
-    report.time_since = datetimeutil.unix_to_python(items[0]['since'])
-    report.time_since_unix = items[0]['since']
-    report.status = items[0]['status']
-    report.complete = items[0]['complete']
-    report.error = items[0]['error']
-    report.total_response = len(items[0]['list'])
-
-    for item_id in items[0]['list']:
-        item = items[0]['list'][item_id]
-        existing_item = get_existing_item(session, item_id)
-        if not existing_item:
-            #article = Article(sort_id=item['sort_id'], item_id=item['item_id'])
-            article = Article(item_id=item['item_id'])
-            logger.debug('Existing item NOT found for ' + item_id)
-        else:
-            article = existing_item
-            logger.debug('Existing item found for ' + item_id)
-
-        if existing_item:
-            previous_status = existing_item.status
-        # 0, 1, 2 - 1 if the item is archived - 2 if the item should be deleted
-        article.status = item['status']
-        try:
-            if article.status == '0' and not existing_item:
-                nr_added += 1
-                changed_articles['added'].append(item['item_id'])
-            elif article.status == '1' and not existing_item:
-                nr_added += 1
-                nr_read += 1
-                changed_articles['added'].append(item['item_id'])
-                changed_articles['read'].append(item['item_id'])
-            elif article.status == '1':
-                nr_read += 1
-                changed_articles['read'].append(item['item_id'])
-            elif article.status == '2' and not existing_item:
-                nr_added += 1
-                nr_deleted += 1
-                changed_articles['added'].append(item['item_id'])
-                changed_articles['deleted'].append(item['item_id'])
-            elif article.status == '2':
-                nr_deleted += 1
-                changed_articles['deleted'].append(item['item_id'])
-        except KeyError:
-            logger.info('No resolved_id found')
-
-        #if not existing_item and not 'resolved_id' in item:
-        if 'resolved_id' not in item:
-            # Item was added and immediately deleted, or at least before we saw it
-            logger.debug(stringutil.safe_unicode(item['status']) + ' ' + stringutil.safe_unicode(item['item_id']) + ' deleted')
-
-            article.item_id = item['item_id']
-            article.firstseen_status = item['status']
-            article.firstseen_time = now
-            try:
-                article.firstseen_time_updated = datetimeutil.unix_to_python(item['time_updated'])
-            except KeyError:
-                pass
-
-            # If item didn't exist yet, add it (otherwise it's updated automagically)
-            session.add(article)
-            # Skip the rest of the loop
-            continue
-
-        logger.debug(stringutil.safe_unicode(item['status']) + ' ' + stringutil.safe_unicode(item['item_id']) + ' ' + stringutil.safe_unicode(item['resolved_id']) + ' ' + datetimeutil.unix_to_string(item['time_added']) + ' ' + datetimeutil.unix_to_string(item['time_updated']) + ' ' + stringutil.safe_unicode(item['resolved_url']))
-        article.resolved_id = item['resolved_id']
-        article.sort_id = item['sort_id']
-        article.given_url = item['given_url']
-        article.resolved_url = item['resolved_url']
-        article.given_title = item['given_title']
-        article.resolved_title = item['resolved_title']
-        if existing_item and existing_item.favorite == 0 and item['favorite'] == '1':
-            nr_favourited += 1
-            changed_articles['favourited'].append(item['item_id'])
-        elif not existing_item and item['favorite'] == '1':
-            nr_favourited += 1
-            changed_articles['favourited'].append(item['item_id'])
-        article.favorite = item['favorite']
-
-        article.excerpt = item['excerpt']
-        article.is_article = item['is_article']
-        article.has_image = item['has_image']
-        article.has_video = item['has_video']
-        article.word_count = item['word_count']
-        if 'tags' in item:
-            article.tags = json.dumps(item['tags'])
-        if 'authors' in item:
-            article.authors = json.dumps(item['authors'])
-        if 'images' in item:
-            article.images = json.dumps(item['images'])
-        if 'videos' in item:
-            article.videos = json.dumps(item['videos'])
-        if existing_item and existing_item.time_updated != datetimeutil.unix_to_python(item['time_updated']):
-            nr_updated += 1
-            changed_articles['updated'].append(item['item_id'])
-        article.time_updated = datetimeutil.unix_to_python(item['time_updated'])
-        article.time_favorited = datetimeutil.unix_to_python(item['time_favorited'])
-        article.time_read = datetimeutil.unix_to_python(item['time_read'])
-        if not existing_item:
-            article.firstseen_status = item['status']
-            article.firstseen_time = now
-            article.firstseen_time_updated = datetimeutil.unix_to_python(item['time_updated'])
-
-            # If item didn't exist yet, add it (otherwise it's updated automagically)
-            session.add(article)
-
-    report.nr_added = nr_added
-    report.nr_read = nr_read
-    report.nr_favourited = nr_favourited
-    report.nr_deleted = nr_deleted
-    report.nr_updated = nr_updated
-    report.changed_articles = json.dumps(changed_articles)
-    #debug_print(report.changed_articles)
-    session.add(report)
-
-    # Check what's pending
-    #logger.debug('About to commit to DB:')
-    #logger.debug(session.new)
-
-    # Save to DB
-    session.commit()
-
-    return report
+    import pocketstats_core as core
+    if core.get_schema_version(engine) < core.SCHEMA_VERSION:
+        print('The database is out of date, run `python pocketstats.py migrate` first')
+        sys.exit(1)
+    accounts = core.get_accounts()
+    if account_name:
+        accounts = [account for account in accounts if account['name'] == account_name]
+        if not accounts:
+            print('No account named ' + account_name + ' in settings.py')
+            sys.exit(1)
+    if all_accounts:
+        return accounts
+    return accounts[:1]
 
 
 ## Main program
@@ -455,53 +219,193 @@ def cli():
 
 
 @cli.command()
-def updatestats():
+@click.option('--bulk', is_flag=True, help='Write the articles with bulk upserts instead of through the ORM; faster on large responses')
+@click.option('--profile', is_flag=True, help='Write a cProfile dump of the update to ' + PROFILE_FILENAME)
+@click.option('--account', 'account_name', default=None, help='Name of the account to update, from the accounts in settings.py; the first by default')
+@click.option('--all', 'all_accounts', is_flag=True, help='Update all accounts from settings.py, fetching their changes at the same time')
+def updatestats(bulk, profile, account_name, all_accounts):
     """
     Get the changes since last time from the Pocket API
     """
-    logger = get_logger()
-    session = get_db_connection()
+    import cProfile
+    from utilkit import datetimeutil
+    import pocketstats_core as core
 
-    last_time = get_last_update()
-    debug_print('Previous update: ' + datetimeutil.unix_to_string(last_time))
-
-    previously_unread = nr_unread(session)
-
-    report = updatestats_since_last(logger, session, last_time)
-
-    debug_print(report.pretty_print())
+    logger = get_logger()
+    session, engine = core.get_db_connection(get_engine=True)
+    accounts = get_selected_accounts(engine, account_name, all_accounts)
+
+    if profile:
+        profiler = cProfile.Profile()
+        profiler.enable()
+    if all_accounts:
+        reports = core.updatestats_accounts(logger, session, accounts, bulk=bulk)
+    else:
+        account_id = core.get_account_id(session, accounts[0]['name'])
+        last_time = core.get_last_update(session, account_id)
+        if last_time:
+            core.debug_print('Previous update: ' + datetimeutil.unix_to_string(last_time))
+        report = core.updatestats_since_last(logger, session, last_time, bulk=bulk, pocket_instance=core.get_pocket_instance(accounts[0]), account_id=account_id)
+    if profile:
+        profiler.disable()
+        profiler.dump_stats(PROFILE_FILENAME)
+        core.debug_print('Profile written to ' + PROFILE_FILENAME)
+
+    totals = core.get_rollup_totals(session)
+    if all_accounts:
+        if reports:
+            write_snapshot(totals, max(report.time_updated for report in reports))
+        for report in reports:
+            core.debug_print(report.pretty_print())
+            logger.info(report)
+        core.debug_print('\n' + get_read_progressbar(totals['total'], totals['read']))
+        return
+    write_snapshot(totals, report.time_updated)
+
+    core.debug_print(report.pretty_print())
 
     if report.net_result > 0:
-        debug_print('More items added than read or deleted')
+        core.debug_print('More items added than read or deleted')
     elif report.net_result == 0:
-        debug_print('Stagnating')
+        core.debug_print('Stagnating')
     else:
-        # Calculate number of days it will take to finish the backlog at this rate
-        #timedelta
-        #days = last_time
-        debug_print('Slowly but surely reading away your backlog')
-
-        last_datetime = datetimeutil.unix_to_python(last_time)
-        days = datetime.datetime.now() - last_datetime
-        hours = days.total_seconds()//3600.0
-        items_read = report.net_result * -1
-        items_per_hour = float(items_read) / hours
-        total_unread = nr_unread(session)
-        debug_print('\nHours: {}, days: {}, items per hour: {} \n'.format(hours, days, items_per_hour))
-        debug_print('\nAt this rate of ' + str(items_read) + ' per ' + str(hours) + ' hours it takes ' + str(round(float(total_unread) / (items_per_hour * 24.0), 1)) + ' days to read the ' + str(total_unread) + ' remaining items')
-
-    debug_print('\n' + get_read_progressbar(session))
-
-    debug_print(report.print_changed_articles(session))
+        core.debug_print('Slowly but surely reading away your backlog')
+    # Based on all reports instead of only this one, see forecast
+    core.debug_print('\n' + get_forecast_summary(core.get_backlog_forecast(session)))
+
+    core.debug_print('\n' + get_read_progressbar(totals['total'], totals['read']))
+
+    core.debug_print(report.print_changed_articles(session))
     logger.info(report)
 
 
+@cli.command()
+@click.option('--bulk', is_flag=True, help='Write the articles with bulk upserts instead of through the ORM')
+@click.option('--account', 'account_name', default=None, help='Name of the account to update, from the accounts in settings.py; the first by default')
+@click.option('--all', 'all_accounts', is_flag=True, help='Update all accounts from settings.py')
+def daemon(bulk, account_name, all_accounts):
+    """
+    Keep getting the changes from the Pocket API, more often when there are changes. Stops on SIGTERM,
+    and keeps its state in the heartbeat file
+    """
+    import pocket
+    import pocketstats_core as core
+
+    logger = get_logger()
+    session, engine = core.get_db_connection(get_engine=True)
+    accounts = get_selected_accounts(engine, account_name, all_accounts)
+    # The Pocket clients and the time of the last update are kept around between the updates
+    pocket_instances = dict((account['name'], core.get_pocket_instance(account)) for account in accounts)
+    account_id = core.get_account_id(session, accounts[0]['name'])
+    last_time = core.get_last_update(session, account_id)
+    session.close()
+
+    stopping = threading.Event()
+
+    def stop(signum, frame):
+        logger.info('Received signal ' + str(signum) + ', stopping after the current update')
+        stopping.set()
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+
+    heartbeat = {'pid': os.getpid(), 'state': 'starting', 'last_sync': None, 'last_changes': None, 'nr_syncs': 0, 'nr_errors': 0, 'interval': DAEMON_MIN_INTERVAL, 'next_sync': None}
+
+    def beat(state):
+        heartbeat['state'] = state
+        heartbeat['time'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        write_json_file(HEARTBEAT_FILENAME, heartbeat)
+
+    interval = DAEMON_MIN_INTERVAL
+    while not stopping.is_set():
+        beat('syncing')
+        session = core.get_db_connection()
+        state = 'waiting'
+        try:
+            if all_accounts:
+                reports = core.updatestats_accounts(logger, session, accounts, bulk=bulk, pocket_instances=pocket_instances)
+            else:
+                reports = [core.updatestats_since_last(logger, session, last_time, bulk=bulk, pocket_instance=pocket_instances[accounts[0]['name']], account_id=account_id)]
+                last_time = reports[0].time_since_unix
+            nr_changes = sum(report.total_response for report in reports)
+            interval = get_next_interval(interval, nr_changes)
+            if reports:
+                write_snapshot(core.get_rollup_totals(session), max(report.time_updated for report in reports))
+            heartbeat['last_sync'] = datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            heartbeat['last_changes'] = nr_changes
+            heartbeat['nr_syncs'] += 1
+            logger.info('Daemon update with ' + str(nr_changes) + ' changes, next in ' + str(interval) + ' seconds')
+        except pocket.RateLimitException as e:
+            session.rollback()
+            # Seconds until the rate limit of the user or the consumer key resets; updatestats_accounts tells for
+            # the accounts that were rate limited
+            retry_after = getattr(e, 'retry_after', None)
+            if retry_after is None:
+                retry_after = max(core.get_rate_limit_reset(pocket_instance) for pocket_instance in pocket_instances.values())
+            interval = get_next_interval(interval, 0, retry_after)
+            heartbeat['nr_errors'] += 1
+            state = 'rate limited'
+            logger.warning('Rate limited by the Pocket API, next update in ' + str(interval) + ' seconds')
+        except Exception:
+            session.rollback()
+            interval = get_next_interval(interval, 0)
+            heartbeat['nr_errors'] += 1
+            state = 'error'
+            logger.exception('Daemon update failed, next in ' + str(interval) + ' seconds')
+        finally:
+            session.close()
+        heartbeat['interval'] = interval
+        heartbeat['next_sync'] = (datetime.datetime.now() + datetime.timedelta(seconds=interval)).strftime('%Y-%m-%d %H:%M:%S')
+        beat(state)
+        stopping.wait(interval)
+
+    heartbeat['next_sync'] = None
+    beat('stopped')
+    core.get_db_engine().dispose()
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', default=8000, help='Port to listen on')
+def serve(host, port):
+    """
+    Serve the stats as JSON on /stats.json and as Prometheus metrics on /metrics
+    """
+    import pocketstats_server
+
+    print('Serving the stats on http://' + host + ':' + str(port) + '/stats.json and /metrics')
+    try:
+        pocketstats_server.serve(host, port, get_logger())
+    except KeyboardInterrupt:
+        pass
+
+
 @cli.command()
 def createdb():
     """
     Create the database
     """
-    _create_tables()
+    import pocketstats_core as core
+    core._create_tables()
+
+
+@cli.command()
+@click.option('--quiet', is_flag=True, help='Only print something when migrations were applied, e.g. for cron')
+def migrate(quiet):
+    """
+    Upgrade an existing database to the latest schema
+    """
+    import pocketstats_core as core
+    logger = get_logger()
+    database_filename = core.get_database_filename()
+    size_before = os.path.getsize(database_filename) if database_filename and os.path.exists(database_filename) else None
+    applied = core.migrate_db(core.get_db_engine(), logger)
+    for version, description in applied:
+        print('Migrated to version ' + str(version) + ': ' + description)
+    if not applied:
+        if not quiet:
+            print('Database is up to date (version ' + str(core.SCHEMA_VERSION) + ')')
+    elif size_before is not None:
+        print('Database size: {:.1f} MiB, was {:.1f} MiB'.format(os.path.getsize(database_filename) / 1024.0 / 1024.0, size_before / 1024.0 / 1024.0))
 
 
 @cli.command()
@@ -510,6 +414,9 @@ def gettoken(consumer_key):
     """
     Get access token
     """
+    import pocket
+    from pocket import Pocket
+
     # URL to redirect user to, to authorize your app
     redirect_uri = 'https://github.com/aquatix/pocketstats'
     try:
@@ -536,21 +443,24 @@ def showstats():
     """
     Show statistics about the collection
     """
+    from sqlalchemy import func
+    from utilkit import printutil
+    import pocketstats_core as core
+    from pocketstats_core import DailyStats, date_part
+
     # Size of progress-bar
     COLUMNS = 40
     result = []
 
-    session = get_db_connection()
-    #session.query(Article).
-    #items = session.query(extract('year', Article.time_read).label('year')).distinct().subquery()
-    #items = session.query(extract('year', Article.time_read).label('year'), func.count(Article.id)).distinct().order_by('year')
+    session = core.get_db_connection()
 
     # Numbers
-    items_total = nr_total(session)
-    items_read = nr_read(session)
-    items_unread = nr_unread(session)
-    items_favourited = nr_favourited(session)
-    items_deleted = nr_deleted(session)
+    totals = core.get_rollup_totals(session)
+    items_total = totals['total']
+    items_read = totals['read']
+    items_unread = totals['unread']
+    items_favourited = totals['favourited']
+    items_deleted = totals['deleted']
 
     result.append(['Total items', str(items_total)])
     result.append(['Total read', str(items_read)])
@@ -567,64 +477,358 @@ def showstats():
 
     # Read articles per yer
     result.append(['year', 'amount of articles read'])
-    items = session.query(extract('year', Article.time_read).label('year'), func.count(Article.id)).group_by('year')
+    items = session.query(date_part('year', DailyStats.day).label('year'), func.sum(DailyStats.read)).group_by('year').order_by('year')
     for item in items:
-        if item[0] is None:
+        if item[0] == core.UNKNOWN_DAY.year:
             result.append(['unknown', str(item[1])])
-        elif item[0] == 1970:
-            result.append(['unread', str(item[1])])
         else:
             result.append([str(item[0]), str(item[1])])
 
     result.append([])
     print(printutil.to_smart_columns(result))
 
-    # List of number of items read, per date
-    items_read = session.query(func.date(Article.time_read).label('thedate'), func.count(Article.id)).group_by('thedate')
-    # firstseen_time_updated comes as close to 'time added' as we can get from the Pocket API
-    items_added = session.query(func.date(Article.firstseen_time_updated).label('thedate'), func.count(Article.id)).group_by('thedate')
-    #for item in items_added:
-    #    print item
-    # TODO: plot added-vs-read graph
-    items_added_per_month = session.query(extract('year', Article.firstseen_time_updated).label('year'), extract('month', Article.firstseen_time_updated).label('month'), func.count(Article.id)).group_by('year', 'month')
-    items_read_per_month = session.query(extract('year', Article.time_read).label('year'), extract('month', Article.time_read).label('month'), func.count(Article.id)).group_by('year', 'month')
+    # Added vs read per hour, day, week or quarter too, and as CSV for plotting: see timeline
+    known_days = session.query(DailyStats).filter(DailyStats.day != core.UNKNOWN_DAY)
+    items_added_per_month = known_days.with_entities(date_part('year', DailyStats.day).label('year'), date_part('month', DailyStats.day).label('month'), func.sum(DailyStats.added)).group_by('year', 'month')
+    items_read_per_month = known_days.with_entities(date_part('year', DailyStats.day).label('year'), date_part('month', DailyStats.day).label('month'), func.sum(DailyStats.read)).group_by('year', 'month')
     read_vs_added = printutil.x_vs_y(items_read_per_month, items_added_per_month, filter_none=True)
     #for item in read_vs_added:
     #    result.append(item)
     print(read_vs_added)
 
-    # Tags
-    # TODO: loop over Articles, get amount of articles/tag
+    # Tags: see showtags
+    # Reading per hour and weekday, and time to read: see analyze
 
-    # Finally, print the stats
-    #print(printutil.to_smart_columns(result))
-    return
 
-    items = session.query(extract('year', Article.time_read).label('year')).distinct()
-    for item in items:
-        print(item)
+def import_analytics():
+    try:
+        import pocketstats_analytics
+    except ImportError:
+        print('This needs NumPy: pip install numpy')
+        sys.exit(1)
+    return pocketstats_analytics
 
-    per_date = session.query(func.count(Article.id), extract('date', Article.time_read).label('h')).group_by('h')
-    for item in per_date:
-        print(item)
-    per_hour = session.query(extract('hour', Article.time_read).label('h')).group_by('h')
-    for item in per_hour:
-        print(item)
+
+@cli.command()
+@click.option('--output', default='pocketstats_articles.npz', help='File to write to; .parquet for Parquet, otherwise NumPy .npz')
+def export(output):
+    """
+    Export the articles as columns, with times as Unix epochs, for analysis elsewhere
+    """
+    import pocketstats_core as core
+    analytics = import_analytics()
+
+    with core.get_db_engine().connect() as connection:
+        columns = analytics.load_columns(connection)
+    if output.endswith('.parquet'):
+        try:
+            analytics.export_parquet(columns, output)
+        except ImportError:
+            print('Exporting to Parquet needs pyarrow: pip install pyarrow')
+            sys.exit(1)
+    else:
+        analytics.export_npz(columns, output)
+    print('Exported ' + str(len(columns['item_id'])) + ' articles to ' + output)
 
 
 @cli.command()
-def showprogressbar():
-    session = get_db_connection()
-    print(get_read_progressbar(session))
+def analyze():
+    """
+    Show how long articles take to get read, when you read, and how old the backlog is
+    """
+    import time
+    from utilkit import printutil
+    import pocketstats_core as core
+    analytics = import_analytics()
+
+    with core.get_db_engine().connect() as connection:
+        columns = analytics.load_columns(connection)
+
+    result = [['time to read', 'days']]
+    latencies = analytics.get_read_latencies(columns)[0] / float(analytics.SECONDS_PER_DAY)
+    for percentile, days in analytics.get_percentiles(latencies):
+        result.append(['p' + str(percentile), '{:.1f}'.format(days)])
+    result.append([])
+
+    result.append(['length (words)', 'read', 'median days to read'])
+    buckets = analytics.WORD_COUNT_BUCKETS
+    for index, (number, median) in enumerate(analytics.get_latency_per_word_count(columns)):
+        label = str(buckets[index]) + '+' if index == len(buckets) - 1 else str(buckets[index]) + '-' + str(buckets[index + 1])
+        result.append([label, str(number), '-' if median is None else '{:.1f}'.format(median)])
+    result.append([])
+
+    result.append(['hour (UTC)', 'read'])
+    for hour, number in enumerate(analytics.get_hour_histogram(columns['time_read'])):
+        result.append([str(hour), str(number)])
+    result.append([])
+
+    result.append(['weekday', 'read'])
+    for weekday, number in zip(analytics.WEEKDAYS, analytics.get_weekday_histogram(columns['time_read'])):
+        result.append([weekday, str(number)])
+    result.append([])
+
+    ages = analytics.get_backlog_ages(columns, int(time.time()))
+    result.append(['backlog age (days)', 'unread'])
+    buckets = analytics.BACKLOG_AGE_BUCKETS
+    for index, number in enumerate(analytics.get_backlog_age_histogram(ages)):
+        label = str(buckets[index]) + '+' if index == len(buckets) - 1 else str(buckets[index]) + '-' + str(buckets[index + 1])
+        result.append([label, str(number)])
+    for percentile, days in analytics.get_percentiles(ages):
+        result.append(['p' + str(percentile), '{:.1f}'.format(days)])
+    print(printutil.to_smart_columns(result))
 
 
 @cli.command()
-def showreadlist():
+@click.option('--bucket', type=click.Choice(['hour', 'day', 'week', 'month', 'quarter']), default='month', help='Period to count per')
+@click.option('--number', default=0, help='Number of most recent periods to show; 0 for all')
+@click.option('--csv', 'as_csv', is_flag=True, help='Write CSV, e.g. for plotting')
+def timeline(bucket, number, as_csv):
+    """
+    Show the number of articles added, read and deleted, and the backlog after that, per period
+    """
+    import csv
+    from utilkit import printutil
+    import pocketstats_core as core
+    analytics = import_analytics()
+
+    with core.get_db_engine().connect() as connection:
+        columns = analytics.load_columns(connection, analytics.TIMELINE_COLUMNS)
+    rows = list(zip(*analytics.get_timeline(columns, bucket)))
+    if number:
+        rows = rows[-number:]
+
+    header = [bucket, 'added', 'read', 'deleted', 'backlog']
+    if as_csv:
+        writer = csv.writer(sys.stdout, lineterminator='\n')
+        writer.writerow(header)
+        writer.writerows([label] + [int(value) for value in values] for label, *values in rows)
+        return
+    result = [header]
+    for label, *values in rows:
+        result.append([label] + [str(value) for value in values])
+    print(printutil.to_smart_columns(result))
+
+
+@cli.command('rebuild-rollups')
+def rebuild_rollups_command():
+    """
+    Recalculate the daily stats rollup from all articles
+    """
+    import pocketstats_core as core
+    with core.get_db_engine().begin() as connection:
+        core.rebuild_rollups(connection)
+    save_snapshot(core.get_db_connection())
+
+
+@cli.command('backfill-tags')
+def backfill_tags_command():
+    """
+    Recreate the tag index from the tags of all articles
+    """
+    import pocketstats_core as core
+    with core.get_db_engine().begin() as connection:
+        core.backfill_tags(connection)
+
+
+@cli.command()
+@click.option('--archive', 'archive_filename', default=None, help='Archive of API responses to replay; by default the one next to the database')
+@click.option('--db-url', default=None, help='Empty database to rebuild, instead of the configured one')
+@click.option('--verify', is_flag=True, help='Replay into a database in memory and compare that with the configured database')
+@click.option('--bulk/--orm', default=True, help='Write the articles with bulk upserts (default) or through the ORM')
+def replay(archive_filename, db_url, verify, bulk):
+    """
+    Rebuild the database from the archive of Pocket API responses, without talking to the API
+    """
+    import pocketstats_core as core
+
+    logger = get_logger()
+    archive_filename = archive_filename or core.get_archive_filename()
+    if not os.path.exists(archive_filename):
+        print('No archive of API responses found at ' + archive_filename)
+        sys.exit(1)
+
+    if verify:
+        url = 'sqlite://'
+    else:
+        url = db_url or core.DATABASE_URL
+    core._create_tables(url)
+    session = core.get_db_connection(url=url)
+    if session.query(core.Report).first():
+        print('The database already has reports; replay into an empty database, e.g. with --db-url')
+        sys.exit(1)
+
+    nr_reports = core.replay_archive(logger, session, core.read_archive(archive_filename), bulk=bulk)
+    print('Replayed ' + str(nr_reports) + ' reports from ' + archive_filename)
+
+    if verify:
+        different_articles, different_reports = core.compare_databases(core.get_db_connection(), session)
+        session.close()
+        # Throws away the database in memory
+        core.get_db_engine(url).dispose()
+        print('Articles that differ: ' + str(len(different_articles)))
+        print('Reports that differ: ' + str(len(different_reports)))
+        if different_articles or different_reports:
+            core.debug_print('item_ids: ' + str(different_articles[:100]))
+            core.debug_print('report ids: ' + str(different_reports[:100]))
+            sys.exit(1)
+    elif url == core.DATABASE_URL:
+        save_snapshot(session)
+
+
+@cli.command()
+@click.argument('item_id', type=int)
+@click.option('--account', 'account_name', default=None, help='Only show the history in this account')
+def history(item_id, account_name):
+    """
+    Show when an item was added, read, favourited etc, according to the updates that saw it happen
+    """
+    from utilkit import datetimeutil, printutil
+    import pocketstats_core as core
+
+    session = core.get_db_connection()
+    account_id = None
+    if account_name:
+        account_id = session.query(core.Account.id).filter(core.Account.name == account_name).scalar()
+        if account_id is None:
+            print('No account named ' + account_name)
+            sys.exit(1)
+
+    events = core.get_item_history(session, item_id, account_id)
+    if not events:
+        print('No history for item ' + str(item_id))
+        return
+    result = []
+    for timestamp, event_type, name, report_id in events:
+        result.append([datetimeutil.datetime_to_string(timestamp), event_type, name, str(report_id)])
+    print(printutil.to_smart_columns(result, headers=['update at', 'event', 'account', 'report']))
+
+
+@cli.command('rebuild-search')
+def rebuild_search_command():
+    """
+    Recreate the full-text search index from all articles
+    """
+    import pocketstats_core as core
+    with core.get_db_engine().begin() as connection:
+        if not core.create_search_index(connection):
+            print('Full-text search needs SQLite with FTS5')
+            sys.exit(1)
+        core.rebuild_search_index(connection)
+
+
+@cli.command()
+@click.argument('terms', nargs=-1, required=True)
+@click.option('--status', type=click.Choice(['unread', 'read', 'deleted']), default=None, help='Only articles with this status')
+@click.option('--favourite/--no-favourite', default=None, help='Only articles that are (not) favourited')
+@click.option('--tag', default=None, help='Only articles with this tag')
+@click.option('--number', default=20, help='Number of results to show')
+@click.option('--raw', is_flag=True, help='Pass the terms as FTS5 query, e.g. for OR, NEAR and prefix* searches')
+def search(terms, status, favourite, tag, number, raw):
+    """
+    Search the titles, excerpts and URLs of the articles, best matches first
+    """
+    from sqlalchemy.exc import OperationalError
+    from utilkit import printutil
+    import pocketstats_core as core
+
+    session = core.get_db_connection()
+    if not core.has_search_index(session.connection()):
+        print('No full-text search index, run `python pocketstats.py migrate` first; it needs SQLite with FTS5')
+        sys.exit(1)
+    if raw:
+        query = ' '.join(terms)
+    else:
+        query = core.get_search_query(terms)
+    if status:
+        status = ['unread', 'read', 'deleted'].index(status)
+
+    try:
+        articles = core.search_articles(session, query, status=status, favourite=favourite, tag=tag, limit=number)
+    except OperationalError as e:
+        print('Invalid search query: ' + str(e.orig))
+        sys.exit(1)
+    result = []
+    for item_id, title, url, item_status, favorite, score in articles:
+        result.append(['{:.2f}'.format(-score), str(item_id), ['unread', 'read', 'deleted'][item_status], '*' if favorite else '', title or '', url or ''])
+    print(printutil.to_smart_columns(result, headers=['score', 'item_id', 'status', 'fav', 'title', 'url']))
+
+
+@cli.command()
+def forecast():
+    """
+    Forecast when the backlog is read, from the net result of all updates
+    """
+    from utilkit import printutil
+    import pocketstats_core as core
+
+    session = core.get_db_connection()
+    backlog_forecast = core.get_backlog_forecast(session)
+
+    def format_rate(rate):
+        return '-' if rate is None else '{:+.2f}'.format(rate)
+
+    def format_date(date):
+        return '-' if date is None else date.strftime('%Y-%m-%d')
+
+    result = [['unread', str(backlog_forecast['unread'])], []]
+    for days, rate in sorted(backlog_forecast['windows'].items()):
+        result.append(['last ' + str(days) + ' days', format_rate(rate) + ' per day'])
+    result.append(['weighted', format_rate(backlog_forecast['rate']) + ' per day'])
+    if backlog_forecast['deviation'] is not None:
+        result.append(['deviation', '{:.2f}'.format(backlog_forecast['deviation'])])
+    result.append([])
+    result.append(['read by', format_date(backlog_forecast['completion'])])
+    result.append(['earliest', format_date(backlog_forecast['earliest'])])
+    result.append(['latest', format_date(backlog_forecast['latest'])])
+    print(printutil.to_smart_columns(result))
+    print(get_forecast_summary(backlog_forecast))
+
+
+@cli.command()
+def showtags():
+    """
+    Show the number of articles per tag, and how many of those are read
+    """
+    from utilkit import printutil
+    import pocketstats_core as core
+
+    session = core.get_db_connection()
+    result = []
+    for tag, total, read, unread in core.get_tag_stats(session):
+        result.append([tag, str(total), str(read), str(unread), '{:.1f}%'.format(read * 100.0 / total)])
+    print(printutil.to_smart_columns(result, headers=['tag', 'total', 'read', 'unread', 'read rate']))
+
+
+@cli.command()
+@click.option('--fresh', is_flag=True, help='Read the numbers from the database instead of the snapshot of the last update')
+def showprogressbar(fresh):
+    totals = get_totals(fresh)
+    print(get_read_progressbar(totals['total'], totals['read']))
+
+
+@cli.command()
+@click.option('--fresh', is_flag=True, help='Read the numbers from the database instead of the snapshot of the last update')
+def showsummary(fresh):
+    """
+    One line summary of the collection, fast enough for shell prompts and status bars
+    """
+    totals = get_totals(fresh)
+    print('{total} items, {read} read, {unread} unread, {favourited} favourited, {deleted} deleted (last sync: {last_sync})'.format(**totals))
+
+
+@cli.command()
+@click.option('--number', default=5, help='Number of items to list')
+@click.option('--weight', type=click.Choice(['uniform', 'older', 'word_count']), default='uniform', help='Favour items that are in the list longer, or longer articles')
+@click.option('--seed', type=int, default=None, help='Seed for reproducible picks')
+def showreadlist(number, weight, seed):
     """
     List some unread items
     """
-    session = get_db_connection()
-    items = get_random_unread(session)
+    from utilkit import datetimeutil
+    import pocketstats_core as core
+
+    session = core.get_db_connection()
+    items = core.get_random_unread(session, number=number, weight=weight, seed=seed)
     for item in items:
         print(item[0])
         print('(in list since ' + datetimeutil.datetime_to_string(item[2]) + ')')
@@ -632,6 +836,52 @@ def showreadlist():
         print()
 
 
+@cli.command()
+@click.option('--number', default=20, help='Number of most recent reports to show')
+@click.option('--timings', is_flag=True, help='Show how long the phases of the updates took instead of what changed')
+def showreports(number, timings):
+    """
+    Show the reports of the most recent updates
+    """
+    from sqlalchemy import desc
+    from utilkit import datetimeutil, printutil
+    import pocketstats_core as core
+    from pocketstats_core import Report, ReportTiming, SyncTimer
+
+    session = core.get_db_connection()
+    reports = session.query(Report, ReportTiming).outerjoin(ReportTiming, ReportTiming.report_id == Report.id).order_by(desc(Report.id)).limit(number).all()
+    # Oldest first, so trends read from top to bottom
+    reports.reverse()
+
+    result = []
+    if not timings:
+        headers = ['update at', 'items', 'added', 'read', 'deleted', 'favourited', 'updated', 'net result']
+        for report, report_timing in reports:
+            result.append([datetimeutil.datetime_to_string(report.time_updated), str(report.total_response), str(report.nr_added), str(report.nr_read), str(report.nr_deleted), str(report.nr_favourited), str(report.nr_updated), str(report.net_result)])
+        print(printutil.to_smart_columns(result, headers=headers))
+        return
+
+    headers = ['update at', 'items', 'fetch', 'decode', 'diff', 'commit', 'total', 'ms/item', 'queries', 'bytes']
+    timed = []
+    for report, report_timing in reports:
+        if not report_timing:
+            result.append([datetimeutil.datetime_to_string(report.time_updated), str(report.total_response)] + ['-'] * 8)
+            continue
+        timed.append((report, report_timing))
+        ms_per_item = report_timing.total * 1000.0 / max(report.total_response, 1)
+        result.append([datetimeutil.datetime_to_string(report.time_updated), str(report.total_response)] + ['{:.3f}'.format(getattr(report_timing, phase)) for phase in SyncTimer.PHASES + ['total']] + ['{:.2f}'.format(ms_per_item), str(report_timing.nr_queries), str(report_timing.response_size)])
+    if timed:
+        result.append([])
+        average_row = ['average', str(sum(report.total_response for report, report_timing in timed) // len(timed))]
+        for phase in SyncTimer.PHASES + ['total']:
+            average_row.append('{:.3f}'.format(sum(getattr(report_timing, phase) for report, report_timing in timed) / len(timed)))
+        average_row.append('{:.2f}'.format(sum(report_timing.total * 1000.0 / max(report.total_response, 1) for report, report_timing in timed) / len(timed)))
+        average_row.append(str(sum(report_timing.nr_queries for report, report_timing in timed) // len(timed)))
+        average_row.append('')
+        result.append(average_row)
+    print(printutil.to_smart_columns(result, headers=headers))
+
+
 if not hasattr(main, '__file__'):
     # Running in interactive mode in the Python shell
     print("Pocket stats running interactively in Python shell")
@@ -0,0 +1,206 @@
+"""
+Analytics of reading habits on the article table as columns: NumPy arrays with times as int64 Unix
+epochs (0 when unknown, like Pocket does) and status and flags as small integers. Needs NumPy, and
+pyarrow for exporting to Parquet; both are optional dependencies of pocketstats
+"""
+import numpy as np
+from sqlalchemy import BigInteger, Integer, cast, extract, func, select
+
+from pocketstats_core import Article
+
+SECONDS_PER_DAY = 86400
+
+# Columns of the export: (Article column, dtype); DateTime columns become epochs
+EXPORT_COLUMNS = [
+    (Article.item_id, np.int64),
+    (Article.account_id, np.int32),
+    (Article.status, np.int8),
+    (Article.favorite, np.int8),
+    (Article.is_article, np.int8),
+    (Article.has_image, np.int8),
+    (Article.has_video, np.int8),
+    (Article.word_count, np.int32),
+    (Article.firstseen_time, np.int64),
+    (Article.firstseen_time_updated, np.int64),
+    (Article.time_updated, np.int64),
+    (Article.time_favorited, np.int64),
+    (Article.time_read, np.int64),
+]
+
+PERCENTILES = [25, 50, 75, 90, 95, 99]
+# Edges in days of the buckets of the backlog age histogram
+BACKLOG_AGE_BUCKETS = [0, 7, 30, 90, 180, 365, 730, 1461]
+# Edges of the word_count buckets of the time to read per article length
+WORD_COUNT_BUCKETS = [0, 500, 1000, 2000, 5000]
+WEEKDAYS = ['Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun']
+# Granularities of the timeline, see get_bucket_indexes
+TIMELINE_BUCKETS = ['hour', 'day', 'week', 'month', 'quarter']
+# Columns that get_timeline needs
+TIMELINE_COLUMNS = ['status', 'firstseen_time_updated', 'time_read', 'time_updated']
+
+
+def epoch(column, dialect_name='sqlite'):
+    """
+    SQL expression for the Unix epoch of a DateTime column (as saved: UTC for the Pocket times), 0 if NULL
+    """
+    if dialect_name == 'postgresql':
+        # The columns are timestamps without time zone, which PostgreSQL takes as UTC for this
+        return func.coalesce(cast(extract('epoch', column), BigInteger), 0)
+    return func.coalesce(cast(func.strftime('%s', column), Integer), 0)
+
+
+def load_columns(connection, keys=None):
+    """
+    Returns a dict of column name => NumPy array of all articles, see EXPORT_COLUMNS; only the columns in keys if given
+    """
+    export_columns = [(column, dtype) for column, dtype in EXPORT_COLUMNS if keys is None or column.key in keys]
+    expressions = []
+    for column, dtype in export_columns:
+        if isinstance(column.type, Integer):
+            expressions.append(func.coalesce(column, 0))
+        else:
+            expressions.append(epoch(column, connection.dialect.name))
+    rows = connection.execute(select(expressions).order_by(Article.id)).fetchall()
+    values = list(zip(*rows)) if rows else [()] * len(export_columns)
+    return dict((column.key, np.array(column_values, dtype=dtype)) for (column, dtype), column_values in zip(export_columns, values))
+
+
+def export_npz(columns, filename):
+    np.savez_compressed(filename, **columns)
+
+
+def export_parquet(columns, filename):
+    import pyarrow
+    import pyarrow.parquet
+
+    pyarrow.parquet.write_table(pyarrow.table(columns), filename)
+
+
+def get_read_latencies(columns):
+    """
+    Returns the seconds between adding and reading of the read articles. As article has no time_added,
+    the time_updated at the first import (firstseen_time_updated) is used for when it was added, like the rollup does
+    """
+    added = columns['firstseen_time_updated']
+    read = columns['time_read']
+    mask = (columns['status'] == 1) & (read > 0) & (added > 0) & (read >= added)
+    return read[mask] - added[mask], mask
+
+
+def get_percentiles(values):
+    """
+    Returns a list of (percentile, value) for PERCENTILES; empty if there are no values
+    """
+    if not len(values):
+        return []
+    return list(zip(PERCENTILES, np.percentile(values, PERCENTILES)))
+
+
+def get_hour_histogram(times):
+    """
+    Number of times per hour of the day (UTC), for the known (non-zero) epochs in times
+    """
+    times = times[times > 0]
+    return np.bincount((times // 3600) % 24, minlength=24)
+
+
+def get_weekday_histogram(times):
+    """
+    Number of times per day of the week, Monday first, for the known (non-zero) epochs in times
+    """
+    times = times[times > 0]
+    # 1970-01-01 was a Thursday
+    return np.bincount((times // SECONDS_PER_DAY + 3) % 7, minlength=7)
+
+
+def get_backlog_ages(columns, now):
+    """
+    Returns the age in days of the unread articles at epoch now
+    """
+    added = columns['firstseen_time_updated']
+    mask = (columns['status'] == 0) & (added > 0)
+    return (now - added[mask]) / float(SECONDS_PER_DAY)
+
+
+def get_backlog_age_histogram(ages):
+    """
+    Number of unread articles per bucket of BACKLOG_AGE_BUCKETS, the last bucket being everything older
+    """
+    return np.bincount(np.digitize(ages, BACKLOG_AGE_BUCKETS[1:]), minlength=len(BACKLOG_AGE_BUCKETS))
+
+
+def get_latency_per_word_count(columns):
+    """
+    Returns (number of articles, median days to read) per bucket of WORD_COUNT_BUCKETS, for the read
+    articles with a known word_count
+    """
+    latencies, mask = get_read_latencies(columns)
+    word_counts = columns['word_count'][mask]
+    known = word_counts > 0
+    buckets = np.digitize(word_counts[known], WORD_COUNT_BUCKETS[1:])
+    latencies = latencies[known] / float(SECONDS_PER_DAY)
+    result = []
+    for bucket in range(len(WORD_COUNT_BUCKETS)):
+        in_bucket = latencies[buckets == bucket]
+        result.append((len(in_bucket), float(np.median(in_bucket)) if len(in_bucket) else None))
+    return result
+
+
+def get_bucket_indexes(times, bucket):
+    """
+    Returns the number of the bucket (one of TIMELINE_BUCKETS) of every epoch in times, counting from the bucket
+    that 1970-01-01 is in. Weeks start on Monday
+    """
+    if bucket == 'hour':
+        return times // 3600
+    days = times // SECONDS_PER_DAY
+    if bucket == 'day':
+        return days
+    if bucket == 'week':
+        # 1970-01-01 was a Thursday
+        return (days + 3) // 7
+    months = times.astype('datetime64[s]').astype('datetime64[M]').astype(np.int64)
+    if bucket == 'month':
+        return months
+    return months // 3
+
+
+def get_bucket_label(index, bucket):
+    """
+    Returns the start of bucket number index, see get_bucket_indexes, e.g. 2020-01-06 for a week or 2020-Q1
+    """
+    index = int(index)
+    if bucket == 'hour':
+        return str(np.datetime64(index, 'h')).replace('T', ' ') + ':00'
+    if bucket == 'day':
+        return str(np.datetime64(index, 'D'))
+    if bucket == 'week':
+        return str(np.datetime64(index * 7 - 3, 'D'))
+    if bucket == 'month':
+        return str(np.datetime64(index, 'M'))
+    return str(np.datetime64(index * 3, 'M'))[:4] + '-Q' + str(index % 4 + 1)
+
+
+def get_timeline(columns, bucket):
+    """
+    Returns (labels, added, read, deleted, backlog) per bucket, from the first to the last bucket in which an article
+    was added, read or deleted. Like the rollup does, articles are added at firstseen_time_updated, read at time_read
+    and deleted at time_updated. The backlog is the number of unread articles at the end of the bucket, starting
+    with those of which the times aren't known
+    """
+    status = columns['status']
+    deleted_times = np.where(columns['time_updated'] > 0, columns['time_updated'], columns['firstseen_time_updated'])
+    series = [columns['firstseen_time_updated'], columns['time_read'][status == 1], deleted_times[status == 2]]
+    known = [times[times > 0] for times in series]
+    unknown = [len(times) - len(known_times) for times, known_times in zip(series, known)]
+    indexes = [get_bucket_indexes(known_times, bucket) for known_times in known]
+
+    all_indexes = np.concatenate(indexes)
+    if not len(all_indexes):
+        empty = np.zeros(0, dtype=np.int64)
+        return [], empty, empty, empty, empty
+    first, last = all_indexes.min(), all_indexes.max()
+    added, read, deleted = [np.bincount(bucket_indexes - first, minlength=last - first + 1) for bucket_indexes in indexes]
+    backlog = unknown[0] - unknown[1] - unknown[2] + np.cumsum(added - read - deleted)
+    labels = [get_bucket_label(index, bucket) for index in range(first, last + 1)]
+    return labels, added, read, deleted, backlog
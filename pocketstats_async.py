@@ -0,0 +1,248 @@
+"""
+Pocket API client on asyncio and aiohttp: one pooled connection per client, gzip compressed responses, a timeout
+on every request, and retries with exponential backoff that respect the X-Limit-* rate limit headers of Pocket.
+SyncPocket wraps it as a drop-in replacement for pocket.Pocket, that fetches the next pages of an import while
+the current one is being saved. Needs aiohttp, an optional dependency of pocketstats
+"""
+import asyncio
+import atexit
+import json
+import random
+import threading
+import time
+
+import aiohttp
+import pocket
+
+try:
+    import settings
+except ImportError:
+    settings = None
+
+# Base URL of the Pocket API; can be overridden in settings.py, e.g. with the one of pocketstats_mock
+try:
+    POCKET_API_URL = settings.POCKET_API_URL
+except AttributeError:
+    POCKET_API_URL = 'https://getpocket.com/v3'
+
+# Seconds before a request is given up on, and the number of times it is retried after a connection error,
+# timeout or server error; can be overridden in settings.py
+try:
+    REQUEST_TIMEOUT = settings.REQUEST_TIMEOUT
+except AttributeError:
+    REQUEST_TIMEOUT = 60
+try:
+    REQUEST_RETRIES = settings.REQUEST_RETRIES
+except AttributeError:
+    REQUEST_RETRIES = 4
+
+# Seconds before the first retry; doubled for every next one
+RETRY_BACKOFF = 1.0
+# Longest a request waits for a rate limit to reset; when it takes longer, RateLimitException is raised, so the
+# caller (e.g. the daemon) can come back later
+RATE_LIMIT_MAX_WAIT = 60
+
+# Number of pages of an import that are fetched at the same time; can be overridden in settings.py
+try:
+    PAGES_IN_FLIGHT = settings.PAGES_IN_FLIGHT
+except AttributeError:
+    PAGES_IN_FLIGHT = 3
+
+RATE_LIMITS = ['User', 'Key']
+
+
+class RetryableError(Exception):
+    """
+    A failed request that is worth trying again; error is what to raise when the retries run out
+    """
+
+    def __init__(self, error, retry_after=None):
+        Exception.__init__(self, str(error))
+        self.error = error
+        self.retry_after = retry_after
+
+
+def get_rate_limit_reset(headers):
+    """
+    Returns the seconds until the exhausted rate limit (of the user or of the consumer key) in the X-Limit-*
+    headers resets; None if there's requests left
+    """
+    resets = []
+    for limit in RATE_LIMITS:
+        remaining = headers.get('X-Limit-' + limit + '-Remaining')
+        if remaining is not None and int(remaining) <= 0:
+            resets.append(int(headers.get('X-Limit-' + limit + '-Reset', 0)))
+    return max(resets) if resets else None
+
+
+def get_pocket_exception(status, headers):
+    # The same exceptions and messages as pocket.Pocket raises
+    error_msg = pocket.Pocket.statuses.get(status)
+    extra_info = headers.get('X-Error')
+    return pocket.EXCEPTIONS.get(status, pocket.PocketException)('%s. %s' % (error_msg, extra_info))
+
+
+class AsyncPocket(object):
+    """
+    Pocket API client for asyncio. get() can be awaited for several pages at the same time; they share the
+    connection pool and the rate limit bookkeeping
+    """
+
+    def __init__(self, consumer_key, access_token, api_url=None, connections=None):
+        self.consumer_key = consumer_key
+        self.access_token = access_token
+        self.api_url = api_url or POCKET_API_URL
+        self.connections = connections or PAGES_IN_FLIGHT
+        self.session = None
+        # time.time() until which the rate limit is used up
+        self.rate_limited_until = 0
+        # Of the last response, like TimedPocket
+        self.last_headers = {}
+        self.last_decode_time = 0
+        self.last_response_size = None
+
+    def get_session(self):
+        # Created on first use, as it belongs to the running event loop
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=REQUEST_TIMEOUT),
+                headers={'Accept-Encoding': 'gzip', 'X-Accept': 'application/json'},
+            )
+        return self.session
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def wait_for_rate_limit(self):
+        wait = self.rate_limited_until - time.time()
+        if wait > RATE_LIMIT_MAX_WAIT:
+            raise pocket.RateLimitException('Rate limited for ' + str(int(wait)) + ' more seconds')
+        if wait > 0:
+            await asyncio.sleep(wait)
+
+    async def request(self, method, payload):
+        """
+        POST payload to the method of the API, retrying what can be retried. Returns (result, headers, size of
+        the decoded response, seconds it took to decode)
+        """
+        payload = dict(payload, consumer_key=self.consumer_key, access_token=self.access_token)
+        attempt = 0
+        while True:
+            await self.wait_for_rate_limit()
+            try:
+                return await self.request_once(method, payload)
+            except (RetryableError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                if attempt >= REQUEST_RETRIES:
+                    if isinstance(e, RetryableError):
+                        raise e.error
+                    raise
+                # Exponential backoff with jitter, so pages that failed together don't retry together
+                delay = RETRY_BACKOFF * 2 ** attempt * random.uniform(0.5, 1.5)
+                retry_after = getattr(e, 'retry_after', None)
+                if retry_after:
+                    delay = max(delay, retry_after)
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    async def request_once(self, method, payload):
+        async with self.get_session().post(self.api_url + '/' + method, json=payload) as response:
+            headers = response.headers
+            self.last_headers = headers
+            reset = get_rate_limit_reset(headers)
+            if reset is not None:
+                # Other requests wait for the reset instead of running into the limit too
+                self.rate_limited_until = max(self.rate_limited_until, time.time() + reset)
+            if response.status in (429, 500, 502, 503, 504):
+                retry_after = headers.get('Retry-After', '')
+                raise RetryableError(get_pocket_exception(response.status, headers), int(retry_after) if retry_after.isdigit() else None)
+            if response.status > 399:
+                if reset is not None and reset <= RATE_LIMIT_MAX_WAIT:
+                    raise RetryableError(get_pocket_exception(response.status, headers), reset)
+                raise get_pocket_exception(response.status, headers)
+            # aiohttp decompresses the gzip'ed body
+            body = await response.read()
+        start = time.time()
+        result = json.loads(body.decode('utf-8'))
+        return result, headers, len(body), time.time() - start
+
+    async def get(self, **kwargs):
+        """
+        Like pocket.Pocket.get: returns (response, headers) of the items of the user, with the same parameters
+        """
+        payload = dict((key, value) for key, value in kwargs.items() if value is not None)
+        result, headers, self.last_response_size, self.last_decode_time = await self.request('get', payload)
+        return result, headers
+
+
+class SyncPocket(object):
+    """
+    Drop-in replacement for pocket.Pocket (and TimedPocket) on top of AsyncPocket, which runs on an event loop in
+    a thread of its own. When a page (count and offset) is requested, the next PAGES_IN_FLIGHT - 1 pages are
+    fetched at the same time, so they are in by the time import_all asks for them. page_overlap is the number of
+    items every page starts before the end of the previous one, like import_all does
+    """
+
+    def __init__(self, consumer_key, access_token, api_url=None, pages_in_flight=None, page_overlap=0):
+        self.pages_in_flight = pages_in_flight or PAGES_IN_FLIGHT
+        self.page_overlap = page_overlap
+        self.client = AsyncPocket(consumer_key, access_token, api_url, self.pages_in_flight)
+        self.loop = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, name='pocket-client', daemon=True)
+        self.thread.start()
+        # offset => future of the page, all for the parameters in prefetch_params
+        self.prefetched = {}
+        self.prefetch_params = None
+        self.last_headers = {}
+        self.last_decode_time = 0
+        self.last_response_size = None
+        atexit.register(self.close)
+
+    def submit(self, payload):
+        return asyncio.run_coroutine_threadsafe(self.client.request('get', payload), self.loop)
+
+    def cancel_prefetched(self):
+        for future in self.prefetched.values():
+            future.cancel()
+        self.prefetched = {}
+
+    def get(self, **kwargs):
+        payload = dict((key, value) for key, value in kwargs.items() if value is not None)
+        offset = payload.get('offset', 0)
+        count = payload.get('count')
+        if not count:
+            future = self.submit(payload)
+        else:
+            params = dict((key, value) for key, value in payload.items() if key != 'offset')
+            if params != self.prefetch_params:
+                self.cancel_prefetched()
+                self.prefetch_params = params
+            # Not there when the previous page had less than count items
+            future = self.prefetched.pop(offset, None) or self.submit(payload)
+            step = max(count - self.page_overlap, 1)
+            for page in range(1, self.pages_in_flight):
+                page_offset = offset + page * step
+                if page_offset not in self.prefetched:
+                    self.prefetched[page_offset] = self.submit(dict(params, offset=page_offset))
+        try:
+            result, headers, self.last_response_size, self.last_decode_time = future.result()
+        except Exception:
+            self.cancel_prefetched()
+            self.last_headers = self.client.last_headers
+            raise
+        self.last_headers = headers
+        if count and len(result['list']) < count:
+            # Most likely the end of the list, so the pages after it are empty; if not, they're fetched when asked for
+            self.cancel_prefetched()
+        return result, headers
+
+    def close(self):
+        if self.loop.is_closed():
+            return
+        self.cancel_prefetched()
+        asyncio.run_coroutine_threadsafe(self.client.close(), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
@@ -0,0 +1,2088 @@
+"""
+Core of pocketstats: the database models and queries, and syncing with the Pocket API.
+Kept apart from the command line interface in pocketstats.py, so commands that don't need
+SQLAlchemy or the Pocket client don't pay for importing them
+"""
+import collections
+import concurrent.futures
+import contextlib
+import datetime
+import hashlib
+import json
+import logging
+import math
+import os
+import random
+import struct
+import sys
+import time
+import zlib
+from time import mktime
+
+from sqlalchemy import (BigInteger, Column, Date, DateTime, Float, ForeignKey,
+                        Index, Integer, LargeBinary, String, Text, bindparam,
+                        case, cast, create_engine, desc, event, extract, func,
+                        inspect, select, text)
+#from sqlalchemy.engine.reflection import Inspector
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import object_session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from utilkit import datetimeutil, stringutil
+
+Base = declarative_base()
+
+try:
+    import settings
+except ImportError:
+    # Only needed to talk to the Pocket API, see get_pocket_instance
+    settings = None
+
+# Debugging can be overridden in settings.py
+try:
+    DEBUG = settings.DEBUG
+except AttributeError:
+    DEBUG = False
+
+# Number of item_id's to look up per query; SQLite has a limit of 999 variables per statement
+LOOKUP_CHUNK_SIZE = 500
+# Number of rows per executemany when saving in bulk
+BULK_BATCH_SIZE = 1000
+
+# Number of items per page when importing the complete archive; can be overridden in settings.py
+try:
+    IMPORT_PAGE_SIZE = settings.IMPORT_PAGE_SIZE
+except AttributeError:
+    IMPORT_PAGE_SIZE = 500
+# Number of items of the previous page that every next page of an import fetches again. The API leaves deleted
+# items out, so when an item on a page that is done gets deleted, the items after it move back one place; the
+# overlap makes sure the item that moves over the page boundary is not skipped
+IMPORT_PAGE_OVERLAP = 10
+
+# Database to use; can be overridden in settings.py, e.g. with an absolute path for running from cron
+try:
+    DATABASE_URL = settings.DATABASE_URL
+except AttributeError:
+    # Relative path:
+    DATABASE_URL = 'sqlite:///pocketstats.db'
+
+# Connections kept open to the database, and how many more can be opened when they're all in use (e.g. by
+# the serve command); can be overridden in settings.py
+try:
+    DATABASE_POOL_SIZE = settings.DATABASE_POOL_SIZE
+except AttributeError:
+    DATABASE_POOL_SIZE = 5
+try:
+    DATABASE_MAX_OVERFLOW = settings.DATABASE_MAX_OVERFLOW
+except AttributeError:
+    DATABASE_MAX_OVERFLOW = 10
+
+# Databases that support INSERT ... ON CONFLICT, see get_upsert_statement; others use the ORM for bulk saves
+UPSERT_DIALECTS = ['sqlite', 'postgresql']
+
+# Every raw Pocket API response is appended to an archive, so the database can be rebuilt offline with
+# replay_archive; both can be overridden in settings.py. By default the archive is next to the database
+try:
+    ARCHIVE_RESPONSES = settings.ARCHIVE_RESPONSES
+except AttributeError:
+    ARCHIVE_RESPONSES = True
+try:
+    ARCHIVE_FILENAME = settings.ARCHIVE_FILENAME
+except AttributeError:
+    ARCHIVE_FILENAME = None
+
+# Every archive record is prefixed by the length of its zlib compressed JSON, as unsigned big-endian int
+ARCHIVE_HEADER = struct.Struct('>I')
+ARCHIVE_TIME_FORMAT = '%Y-%m-%d %H:%M:%S.%f'
+
+# SQLite tuning, see set_sqlite_pragmas
+SQLITE_CACHE_SIZE_KB = 64 * 1024
+SQLITE_MMAP_SIZE = 256 * 1024 * 1024
+SQLITE_BUSY_TIMEOUT_MS = 10000
+
+# Number of accounts whose changes are fetched from the Pocket API at the same time; can be overridden in settings.py
+try:
+    ACCOUNT_WORKERS = settings.ACCOUNT_WORKERS
+except AttributeError:
+    ACCOUNT_WORKERS = 4
+
+# Talk to the Pocket API with the asyncio client of pocketstats_async (needs aiohttp) instead of pocket.Pocket;
+# can be overridden in settings.py
+try:
+    ASYNC_CLIENT = settings.ASYNC_CLIENT
+except AttributeError:
+    ASYNC_CLIENT = False
+
+# Account of the data from before there were multiple accounts, and of settings without an accounts list
+DEFAULT_ACCOUNT_ID = 1
+DEFAULT_ACCOUNT_NAME = 'default'
+
+# Full-text search over the articles: an FTS5 table with article as external content, kept up to date by
+# triggers. Matches in the titles weigh more than in the URL, and those more than in the excerpt
+SEARCH_COLUMNS = ['resolved_title', 'given_title', 'excerpt', 'resolved_url']
+SEARCH_WEIGHTS = [10.0, 5.0, 1.0, 2.0]
+
+# Backlog forecast: rolling windows in days, the time constant in days of the exponentially weighted rate,
+# and the number of standard deviations of the band around the forecast (1.96 for ~95%)
+FORECAST_WINDOWS = [7, 30, 90]
+FORECAST_EWMA_DAYS = 30
+FORECAST_BAND = 1.96
+
+# Number of batches of random id's that get_random_unread tries to hit unread items with; also the number
+# of tries per item for weighted picks
+RANDOM_UNREAD_ATTEMPTS = 20
+
+def debug_print(string):
+    if DEBUG:
+        print(string)
+
+
+class Account(Base):
+    """
+    A Pocket account, as configured in the accounts list of settings.py
+    """
+    __tablename__ = 'account'
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True)
+
+
+class Article(Base):
+    """
+    An item in the Pocket archive; can also be an Image or Video
+    """
+    __tablename__ = 'article'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
+    sort_id = Column(Integer)
+    # Pocket ids don't fit in 32 bits
+    item_id = Column(BigInteger, index=True)
+    resolved_id = Column(BigInteger)
+    given_url = Column(String)
+    resolved_url = Column(String)
+    given_title = Column(String)
+    resolved_title = Column(String)
+
+    # 0 or 1 - 1 If the item is favorited
+    favorite = Column(Integer, index=True)
+
+    # 0, 1, 2 - 1 if the item is archived - 2 if the item should be deleted
+    status = Column(Integer, index=True)
+    firstseen_status = Column(Integer)
+
+    excerpt = Column(Text)
+
+    # 0 or 1 - 1 if the item is an article
+    is_article = Column(Integer)
+
+    # 0, 1, or 2 - 1 if the item has images in it - 2 if the item is an image
+    has_image = Column(Integer)
+
+    # 0, 1, or 2 - 1 if the item has videos in it - 2 if the item is a video
+    has_video = Column(Integer)
+
+    # How many words are in the article
+    word_count = Column(Integer)
+
+    # JSON object; None when the item has no tags
+    tags = Column(Text)
+    # The authors, images and videos JSON objects are in payload_blob, see get_authors, get_images and get_videos
+    authors_blob_id = Column(BigInteger)
+    images_blob_id = Column(BigInteger)
+    videos_blob_id = Column(BigInteger)
+
+    # Hash of the item as Pocket returned it last, see get_content_hash
+    content_hash = Column(String(40))
+
+    # First import of this item
+    firstseen_time = Column(DateTime)
+    # time_updated at time of the first import
+    firstseen_time_updated = Column(DateTime, index=True)
+    #local_updated = Column(DateTime)
+
+    time_updated = Column(DateTime)
+    time_favorited = Column(DateTime)
+    time_read = Column(DateTime, index=True)
+
+    __table_args__ = (
+        # Different accounts can have the same item
+        Index('ix_article_account_id_item_id', 'account_id', 'item_id', unique=True),
+        # For weighted sampling of unread items, see get_random_unread
+        Index('ix_article_status_firstseen_time_updated', 'status', 'firstseen_time_updated'),
+        Index('ix_article_status_word_count', 'status', 'word_count'),
+    )
+
+    def get_tags(self):
+        result = []
+        for tag in json.loads(self.tags):
+            result.append(tag)
+        return result
+
+    def get_authors(self):
+        return get_payload(object_session(self), self.authors_blob_id, self.item_id)
+
+    def get_images(self):
+        return get_payload(object_session(self), self.images_blob_id, self.item_id)
+
+    def get_videos(self):
+        return get_payload(object_session(self), self.videos_blob_id, self.item_id)
+
+    def __str__(self):
+        #return u'[' + str(self.item_id) + '] ' + self.resolved_title + ' - ' + self.resolved_url
+        return u'[' + str(self.item_id) + '] ' + str(self.resolved_url)
+
+
+    def __unicode__(self):
+        return self.__str__()
+
+
+class Report(Base):
+    """
+    Changes since the last report; e.g., how many added, read, deleted, favourited
+    """
+    __tablename__ = 'report'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID, index=True)
+    # Local DateTime of request
+    time_updated = Column(DateTime)
+    # DateTime stamp that Pocket reported for this request
+    time_since = Column(DateTime, index=True)
+    time_since_unix = Column(Integer)
+    # Stats
+    total_response = Column(Integer)
+    nr_added = Column(Integer)
+    nr_read = Column(Integer)
+    nr_deleted = Column(Integer)
+    nr_favourited = Column(Integer)
+    # Has updates according to change in time_updated
+    nr_updated = Column(Integer)
+    # Response metadata
+    status = Column(Integer)
+    complete = Column(Integer)
+    error = Column(Text)
+    # json summary of the changed articles (added, read, deleted, fav'd, updated); replaced by ArticleEvent,
+    # only set for reports from before schema version 9 that have not been migrated
+    changed_articles = Column(Text)
+
+
+    @property
+    def net_result(self):
+        return self.nr_added - self.nr_read - self.nr_deleted
+
+
+    def pretty_print(self):
+        """
+        Return a pretty overview of the report, usable for printing as import result
+        """
+        data = [['update at', datetimeutil.datetime_to_string(self.time_updated)], ['total in response', str(self.total_response)], ['updated', str(self.nr_updated)], ['added', str(self.nr_added)], ['read', str(self.nr_read)], ['favourited', str(self.nr_favourited)], ['deleted', str(self.nr_deleted)], ['net result', str(self.net_result)]]
+        result = ''
+        col_width = max(len(word) for row in data for word in row) + 2  # padding
+        for row in data:
+            result += u''.join(word.ljust(col_width) for word in row) + '\n'
+        return result
+
+
+    def print_changed_articles(self, session):
+        """
+        Return a pretty overview of the articles that were added/read/etc, fetched with their events in one query
+        """
+        articles_per_type = dict((event_type, []) for event_type in EVENT_TYPES)
+        events = session.query(ArticleEvent.event_type, Article).outerjoin(
+            Article, (Article.account_id == ArticleEvent.account_id) & (Article.item_id == ArticleEvent.item_id)
+        ).filter(ArticleEvent.report_id == self.id).order_by(ArticleEvent.id)
+        for event_type, article in events:
+            articles_per_type[event_type].append(article)
+        result = u''
+        for changetype in EVENT_TYPES:
+            result += u'\n== ' + changetype + ' ======\n'
+            for this_item in articles_per_type[changetype]:
+                result += u'' + str(this_item) + '\n'
+        return result
+
+
+    def __str__(self):
+        return u'Update at ' + datetimeutil.datetime_to_string(self.time_updated) + '; total in response: ' + str(self.total_response) + ', nr_updated: ' + str(self.nr_updated) + ', nr_added: ' + str(self.nr_added) + ', nr_read: ' + str(self.nr_read) + ', nr_favourited: ' + str(self.nr_favourited) + ', nr_deleted: ' + str(self.nr_deleted)
+
+
+    def __unicode__(self):
+        return self.__str__()
+
+
+    def __repr__(self):
+        return self.__str__()
+
+
+class ReportTiming(Base):
+    """
+    How long the phases of the update that resulted in a Report took, and how much work it was
+    """
+    __tablename__ = 'report_timing'
+
+    id = Column(Integer, primary_key=True)
+    report_id = Column(Integer, ForeignKey('report.id'), index=True)
+    # Seconds spent on the requests to the Pocket API, decoding their JSON, comparing and saving the items, and committing
+    fetch = Column(Float)
+    decode = Column(Float)
+    diff = Column(Float)
+    commit = Column(Float)
+    total = Column(Float)
+    # Number of SQL statements executed
+    nr_queries = Column(Integer)
+    # Size in bytes of the responses of the Pocket API, if known
+    response_size = Column(Integer)
+
+
+class DailyStats(Base):
+    """
+    Rollup of the articles per day: how many were added, read, deleted and favourited on that day.
+    Kept up to date by updatestats, so the stats don't have to be calculated from all articles
+    """
+    __tablename__ = 'daily_stats'
+
+    # UNKNOWN_DAY for articles that lack the timestamp for that counter
+    day = Column(Date, primary_key=True)
+    added = Column(Integer, default=0)
+    read = Column(Integer, default=0)
+    deleted = Column(Integer, default=0)
+    favourited = Column(Integer, default=0)
+
+
+class ImportCheckpoint(Base):
+    """
+    Progress of an import of the complete archive that has not finished yet
+    """
+    __tablename__ = 'import_checkpoint'
+
+    id = Column(Integer, primary_key=True)
+    account_id = Column(Integer, ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
+    # Local DateTime the import started
+    time_started = Column(DateTime)
+    # 'since' of the first page, to be used for the Report when the import is done
+    since = Column(Integer)
+    # Offset of the next page to fetch
+    offset = Column(Integer)
+    total_response = Column(Integer)
+    # json summary of the changes of the articles that were saved before the import, in the pages done so far;
+    # the articles it added are found by their firstseen_time
+    changed_articles = Column(Text)
+
+
+class ArticleTag(Base):
+    """
+    Tag of an article; Article.tags normalized into rows, so stats per tag don't need to decode every article
+    """
+    __tablename__ = 'article_tag'
+
+    account_id = Column(Integer, primary_key=True)
+    item_id = Column(BigInteger, primary_key=True)
+    tag = Column(String, primary_key=True)
+
+    __table_args__ = (
+        Index('ix_article_tag_tag', 'tag', 'account_id', 'item_id'),
+    )
+
+
+class ArticleEvent(Base):
+    """
+    Change of an article that an update saw: added, read, deleted, favourited or updated
+    """
+    __tablename__ = 'article_event'
+
+    id = Column(Integer, primary_key=True)
+    report_id = Column(Integer, ForeignKey('report.id'), index=True)
+    account_id = Column(Integer, ForeignKey('account.id'), nullable=False, default=DEFAULT_ACCOUNT_ID)
+    item_id = Column(BigInteger)
+    # One of EVENT_TYPES
+    event_type = Column(String)
+    # Local DateTime of the update that saw the change
+    timestamp = Column(DateTime)
+
+    __table_args__ = (
+        # For the history of an item
+        Index('ix_article_event_item', 'item_id', 'account_id', 'timestamp'),
+    )
+
+
+class PayloadBlob(Base):
+    """
+    An authors, images or videos JSON object of Pocket items, stored once, see pack_payload
+    """
+    __tablename__ = 'payload_blob'
+
+    # The first 64 bits of the SHA-1 of the JSON; INTEGER on SQLite, so it is the rowid and needs no index
+    id = Column(BigInteger().with_variant(Integer, 'sqlite'), primary_key=True, autoincrement=False)
+    data = Column(LargeBinary)
+
+
+class SchemaVersion(Base):
+    """
+    Version of the database schema, to know which migrations still have to be run on it
+    """
+    __tablename__ = 'schema_version'
+
+    version = Column(Integer, primary_key=True)
+
+
+# Columns of an article that determine its contribution to the daily_stats rollup
+ROLLUP_COLUMNS = [Article.firstseen_time_updated, Article.status, Article.favorite, Article.time_read, Article.time_favorited, Article.time_updated]
+# In the order of the lists in changed_articles, see new_changed_articles
+EVENT_TYPES = ['added', 'read', 'deleted', 'favourited', 'updated']
+ROLLUP_COUNTERS = ['added', 'read', 'deleted', 'favourited']
+# Keys of the Pocket items that are saved in payload_blob; the Article column is the key with _blob_id
+PAYLOAD_KEYS = ['authors', 'images', 'videos']
+# Keys of the Pocket items that depend on the response instead of the item: sort_id is its position in there
+RESPONSE_KEYS = ['sort_id']
+ArticleState = collections.namedtuple('ArticleState', [column.key for column in ROLLUP_COLUMNS])
+# Day in the rollup for articles that lack the timestamp for that counter
+UNKNOWN_DAY = datetime.date(1970, 1, 1)
+
+
+class SyncTimer(object):
+    """
+    Keeps track of the wall time per phase of an update, the number of SQL statements it ran and the
+    size of the Pocket API responses
+    """
+    PHASES = ['fetch', 'decode', 'diff', 'commit']
+
+    def __init__(self):
+        self.start = time.time()
+        self.durations = dict((phase, 0.0) for phase in self.PHASES)
+        self.nr_queries = 0
+        self.response_size = None
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.durations[name] += time.time() - start
+
+    def count_query(self, *args):
+        self.nr_queries += 1
+
+    @contextlib.contextmanager
+    def counting_queries(self, engine):
+        event.listen(engine, 'before_cursor_execute', self.count_query)
+        try:
+            yield
+        finally:
+            event.remove(engine, 'before_cursor_execute', self.count_query)
+
+    def fetch(self, pocket_instance, **kwargs):
+        """
+        Returns the response of pocket_instance.get(**kwargs), timing the request and the decoding of its JSON
+        """
+        with self.phase('fetch'):
+            response, headers = pocket_instance.get(**kwargs)
+        # Only a TimedPocket can tell the decoding apart from the request itself
+        decode_time = getattr(pocket_instance, 'last_decode_time', 0)
+        self.durations['fetch'] -= decode_time
+        self.durations['decode'] += decode_time
+        response_size = getattr(pocket_instance, 'last_response_size', None) or headers.get('Content-Length')
+        if response_size is not None:
+            self.response_size = (self.response_size or 0) + int(response_size)
+        return response
+
+    def get_report_timing(self, report):
+        return ReportTiming(report_id=report.id, total=time.time() - self.start, nr_queries=self.nr_queries, response_size=self.response_size, **self.durations)
+
+
+def get_accounts():
+    """
+    Returns the accounts from settings.py, as list of dicts with name, consumer_key and access_token.
+    Without an accounts list, consumer_key and access_token of settings.py are the default account
+    """
+    if settings is None:
+        print('Copy settings_example.py to settings.py and set the configuration to your own preferences')
+        sys.exit(1)
+    try:
+        return settings.accounts
+    except AttributeError:
+        return [{'name': DEFAULT_ACCOUNT_NAME, 'consumer_key': settings.consumer_key, 'access_token': settings.access_token}]
+
+
+# Asyncio Pocket clients per (consumer_key, access_token), so their connections and threads are reused
+_async_clients = {}
+# Subclass of pocket.Pocket, see get_timed_pocket_class
+_timed_pocket_class = None
+
+
+def get_timed_pocket_class():
+    """
+    Returns the TimedPocket class: a Pocket client that keeps track of how long decoding the last response took,
+    and how large it was. Defined on first use, so only the commands that talk to the Pocket API import pocket
+    (and requests)
+    """
+    global _timed_pocket_class
+    if _timed_pocket_class is not None:
+        return _timed_pocket_class
+    import pocket
+
+    class TimedPocket(pocket.Pocket):
+        last_decode_time = 0
+        last_response_size = None
+        # Headers of the last response, also when it was an error; has the X-Limit-* rate limit headers
+        last_headers = {}
+
+        def make_request(self, url, payload, headers=None):
+            response = self._post_request(url, payload, headers)
+            self.last_headers = response.headers
+            if response.status_code > 399:
+                error_msg = self.statuses.get(response.status_code)
+                extra_info = response.headers.get('X-Error')
+                raise pocket.EXCEPTIONS.get(response.status_code, pocket.PocketException)(
+                    '%s. %s' % (error_msg, extra_info)
+                )
+
+            self.last_response_size = len(response.content)
+            start = time.time()
+            result = response.json() or response.text
+            self.last_decode_time = time.time() - start
+            return result, response.headers
+
+    _timed_pocket_class = TimedPocket
+    return _timed_pocket_class
+
+
+def get_pocket_instance(account=None):
+    """
+    Connect to Pocket API, for account (see get_accounts) or the first configured account
+    """
+    if account is None:
+        account = get_accounts()[0]
+    consumer_key = account['consumer_key']
+    access_token = account['access_token']
+
+    if ASYNC_CLIENT:
+        import pocketstats_async
+        key = (consumer_key, access_token)
+        if key not in _async_clients:
+            _async_clients[key] = pocketstats_async.SyncPocket(consumer_key, access_token, page_overlap=IMPORT_PAGE_OVERLAP)
+        return _async_clients[key]
+    pocket_instance = get_timed_pocket_class()(consumer_key, access_token)
+    return pocket_instance
+
+
+def set_sqlite_pragmas(dbapi_connection, connection_record):
+    """
+    Tune every new SQLite connection: WAL, so reading the stats doesn't block on (and isn't blocked by) an
+    update that is writing, with less fsync'ing, and a bigger page cache and memory mapped I/O
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute('PRAGMA journal_mode=WAL')
+    cursor.execute('PRAGMA synchronous=NORMAL')
+    cursor.execute('PRAGMA cache_size=-' + str(SQLITE_CACHE_SIZE_KB))
+    cursor.execute('PRAGMA mmap_size=' + str(SQLITE_MMAP_SIZE))
+    cursor.execute('PRAGMA busy_timeout=' + str(SQLITE_BUSY_TIMEOUT_MS))
+    cursor.close()
+
+
+# Engines and their session factories per database URL, so they are only set up once per process
+_engines = {}
+_sessionmakers = {}
+
+
+def get_db_engine(url=None):
+    """
+    Returns the (cached) SQLAlchemy engine for url, DATABASE_URL by default
+    """
+    url = url or DATABASE_URL
+    if url not in _engines:
+        #engine = create_engine('sqlite:///:memory:', echo=True)
+        if url.startswith('sqlite:///'):
+            # Keep the connections to the database file open instead of reconnecting for every session
+            engine = create_engine(url, poolclass=QueuePool, pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW, connect_args={'check_same_thread': False})
+        elif url.startswith('sqlite:'):
+            # In-memory database, which only lives as long as its one connection
+            engine = create_engine(url)
+        else:
+            # Database server; check connections before use, as the server may have closed idle ones
+            engine = create_engine(url, pool_size=DATABASE_POOL_SIZE, max_overflow=DATABASE_MAX_OVERFLOW, pool_pre_ping=True)
+        if engine.dialect.name == 'sqlite':
+            event.listen(engine, 'connect', set_sqlite_pragmas)
+        _engines[url] = engine
+        _sessionmakers[url] = sessionmaker(bind=engine)
+    return _engines[url]
+
+
+def get_db_connection(get_engine=False, url=None):
+    """
+    Create a SQLAlchemy session
+    """
+    engine = get_db_engine(url)
+    session = _sessionmakers[url or DATABASE_URL]()
+    if get_engine:
+        return session, engine
+    else:
+        return session
+
+
+def reset_id_sequence(connection, table):
+    """
+    After inserting rows with explicit ids into table: PostgreSQL doesn't advance the sequence of the id
+    column for those, so set it to the highest id. Other databases take the next id from the table itself
+    """
+    if connection.dialect.name == 'postgresql':
+        connection.execute(text("SELECT setval(pg_get_serial_sequence(:table, 'id'), (SELECT MAX(id) FROM " + table.name + '))'), table=table.name)
+
+
+def date_part(part, column):
+    """
+    Integer year, month, day, hour, ... of a Date or DateTime column; extract() gives a float on PostgreSQL
+    """
+    return cast(extract(part, column), Integer)
+
+
+def _create_tables(url=None):
+    engine = get_db_engine(url)
+
+    with engine.connect() as connection:
+        tables_exist = engine.dialect.has_table(connection, Article.__tablename__) and engine.dialect.has_table(connection, Report.__tablename__)
+    if not tables_exist:
+        # TODO: If Article and Report don't exist yet, create:
+        Base.metadata.create_all(engine)
+        with engine.begin() as connection:
+            connection.execute(Account.__table__.insert(), id=DEFAULT_ACCOUNT_ID, name=DEFAULT_ACCOUNT_NAME)
+            reset_id_sequence(connection, Account.__table__)
+            create_search_index(connection)
+        # Fresh database, so it's already in the shape of the latest migration
+        set_schema_version(engine, SCHEMA_VERSION)
+
+
+def migration_add_indexes(connection):
+    """
+    Unique index on article.item_id and indexes for the stats queries.
+    As SQLite indexes include the rowid, these cover the count(id) queries too
+    """
+    # Before the unique index, an item could in theory be saved twice; keep the one get_existing_item used
+    connection.execute('DELETE FROM article WHERE id NOT IN (SELECT MIN(id) FROM article GROUP BY item_id)')
+    connection.execute('CREATE UNIQUE INDEX IF NOT EXISTS ix_article_item_id ON article (item_id)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_status ON article (status)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_favorite ON article (favorite)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_time_read ON article (time_read)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_firstseen_time_updated ON article (firstseen_time_updated)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_report_time_since ON report (time_since)')
+
+
+def migration_add_daily_stats(connection):
+    """
+    Rollup table for showstats, filled from the existing articles
+    """
+    DailyStats.__table__.create(connection, checkfirst=True)
+    rebuild_rollups(connection)
+
+
+def migration_add_import_checkpoint(connection):
+    # Created in its current shape, with an account_id that refers to the account table, which PostgreSQL needs to
+    # exist already; migration_add_accounts fills it
+    Account.__table__.create(connection, checkfirst=True)
+    ImportCheckpoint.__table__.create(connection, checkfirst=True)
+
+
+def migration_add_report_timing(connection):
+    ReportTiming.__table__.create(connection, checkfirst=True)
+
+
+def migration_add_sampling_indexes(connection):
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_status_firstseen_time_updated ON article (status, firstseen_time_updated)')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_status_word_count ON article (status, word_count)')
+
+
+def migration_add_article_tag(connection):
+    """
+    Normalized tags, filled from the tags of the existing articles. Created in its shape of this version,
+    as the article table doesn't have account_id yet; migration_add_accounts adds it
+    """
+    connection.execute('CREATE TABLE IF NOT EXISTS article_tag (item_id INTEGER NOT NULL, tag VARCHAR NOT NULL, PRIMARY KEY (item_id, tag))')
+    connection.execute('CREATE INDEX IF NOT EXISTS ix_article_tag_tag ON article_tag (tag, item_id)')
+    insert = text('INSERT INTO article_tag (item_id, tag) VALUES (:item_id, :tag)')
+    rows = []
+    for item_id, tags in connection.execute('SELECT item_id, tags FROM article WHERE tags IS NOT NULL'):
+        rows.extend({'item_id': item_id, 'tag': tag} for tag in json.loads(tags))
+        if len(rows) >= BULK_BATCH_SIZE:
+            connection.execute(insert, rows)
+            rows = []
+    if rows:
+        connection.execute(insert, rows)
+
+
+def migration_add_accounts(connection):
+    """
+    Account table, with the existing data belonging to the default account; an item is unique per account
+    """
+    Account.__table__.create(connection, checkfirst=True)
+    connection.execute(Account.__table__.insert(), id=DEFAULT_ACCOUNT_ID, name=DEFAULT_ACCOUNT_NAME)
+    reset_id_sequence(connection, Account.__table__)
+    for table in ('article', 'report', 'import_checkpoint'):
+        if 'account_id' in [column['name'] for column in inspect(connection).get_columns(table)]:
+            # Tables created by earlier migrations from the current model already have it
+            continue
+        connection.execute('ALTER TABLE ' + table + ' ADD COLUMN account_id INTEGER NOT NULL DEFAULT ' + str(DEFAULT_ACCOUNT_ID))
+    connection.execute('DROP INDEX IF EXISTS ix_article_item_id')
+    connection.execute('CREATE INDEX ix_article_item_id ON article (item_id)')
+    connection.execute('CREATE UNIQUE INDEX ix_article_account_id_item_id ON article (account_id, item_id)')
+    connection.execute('CREATE INDEX ix_report_account_id ON report (account_id)')
+    # The account becomes part of the primary key of article_tag, which SQLite can only do by recreating the table
+    connection.execute('DROP INDEX IF EXISTS ix_article_tag_tag')
+    connection.execute('ALTER TABLE article_tag RENAME TO article_tag_old')
+    ArticleTag.__table__.create(connection)
+    connection.execute('INSERT INTO article_tag (account_id, item_id, tag) SELECT ' + str(DEFAULT_ACCOUNT_ID) + ', item_id, tag FROM article_tag_old')
+    connection.execute('DROP TABLE article_tag_old')
+
+
+def migration_add_content_hash(connection):
+    # Existing articles get their hash on their next change
+    connection.execute('ALTER TABLE article ADD COLUMN content_hash VARCHAR(40)')
+
+
+def migration_add_article_event(connection):
+    """
+    Events table, filled from the changed_articles of the existing reports, which are cleared after that
+    """
+    ArticleEvent.__table__.create(connection, checkfirst=True)
+    report_table = Report.__table__
+    query = select([report_table.c.id, report_table.c.account_id, report_table.c.time_updated, report_table.c.changed_articles]).where(report_table.c.changed_articles.isnot(None))
+    rows = []
+    for report_id, account_id, time_updated, changed_articles in connection.execute(query):
+        rows.extend(get_event_rows(report_id, account_id, time_updated, json.loads(changed_articles)))
+        if len(rows) >= BULK_BATCH_SIZE:
+            connection.execute(ArticleEvent.__table__.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(ArticleEvent.__table__.insert(), rows)
+    connection.execute(report_table.update().values(changed_articles=None))
+
+
+def migration_add_search_index(connection):
+    if create_search_index(connection):
+        rebuild_search_index(connection)
+
+
+def migration_add_payload_blob(connection):
+    """
+    Move the authors, images and videos JSON of the articles to payload_blob, with only the ids of the blobs
+    left in article. migrate_db vacuums afterwards, so the database file shrinks
+    """
+    PayloadBlob.__table__.create(connection, checkfirst=True)
+    existing_columns = [column['name'] for column in inspect(connection).get_columns('article')]
+    for key in PAYLOAD_KEYS:
+        if key + '_blob_id' not in existing_columns:
+            connection.execute('ALTER TABLE article ADD COLUMN ' + key + '_blob_id BIGINT')
+    if 'authors' not in existing_columns:
+        return
+
+    # Page by id, so the articles being updated aren't read at the same time
+    query = text('SELECT id, item_id, authors, images, videos FROM article WHERE id > :last_id AND (authors IS NOT NULL OR images IS NOT NULL OR videos IS NOT NULL) ORDER BY id LIMIT ' + str(BULK_BATCH_SIZE))
+    update = text('UPDATE article SET authors_blob_id = :authors_blob_id, images_blob_id = :images_blob_id, videos_blob_id = :videos_blob_id WHERE id = :article_id')
+    last_id = 0
+    while True:
+        rows = []
+        payloads = {}
+        for article_id, item_id, authors, images, videos in connection.execute(query, last_id=last_id).fetchall():
+            row = {'article_id': article_id}
+            for key, payload in zip(PAYLOAD_KEYS, (authors, images, videos)):
+                row[key + '_blob_id'] = None
+                if payload is not None:
+                    row[key + '_blob_id'], payloads[row[key + '_blob_id']] = pack_payload(json.loads(payload), item_id)
+            rows.append(row)
+            last_id = article_id
+        if not rows:
+            break
+        save_payloads(connection, payloads)
+        connection.execute(update, rows)
+
+    if connection.dialect.name == 'sqlite' and connection.dialect.dbapi.sqlite_version_info < (3, 35, 0):
+        # Too old for DROP COLUMN
+        connection.execute('UPDATE article SET authors = NULL, images = NULL, videos = NULL')
+    else:
+        for key in PAYLOAD_KEYS:
+            connection.execute('ALTER TABLE article DROP COLUMN ' + key)
+
+
+def migration_clear_content_hash(connection):
+    """
+    The hashes included sort_id, which changes with the position of the item in the response. Without a hash,
+    an article is compared by its time_updated, until its next change gives it a hash without sort_id
+    """
+    connection.execute('UPDATE article SET content_hash = NULL')
+
+
+# Schema migrations, in order: (version, description, function that gets a Connection)
+MIGRATIONS = [
+    (1, 'Add indexes on article and report', migration_add_indexes),
+    (2, 'Add daily_stats rollup table', migration_add_daily_stats),
+    (3, 'Add import_checkpoint table for resumable imports', migration_add_import_checkpoint),
+    (4, 'Add report_timing table', migration_add_report_timing),
+    (5, 'Add indexes for sampling unread items', migration_add_sampling_indexes),
+    (6, 'Add article_tag table', migration_add_article_tag),
+    (7, 'Add account table and account_id columns', migration_add_accounts),
+    (8, 'Add content_hash to article', migration_add_content_hash),
+    (9, 'Add article_event table, replacing report.changed_articles', migration_add_article_event),
+    (10, 'Add article_fts full-text search index', migration_add_search_index),
+    (11, 'Move authors, images and videos of article to payload_blob', migration_add_payload_blob),
+    (12, 'Clear content hashes of articles that include their sort_id', migration_clear_content_hash),
+]
+SCHEMA_VERSION = MIGRATIONS[-1][0]
+
+
+def get_schema_version(engine):
+    """
+    Returns the schema version of the database; 0 for databases from before versioning was introduced
+    """
+    connection = engine.connect()
+    try:
+        if not engine.dialect.has_table(connection, SchemaVersion.__tablename__):
+            return 0
+        return connection.execute(func.max(SchemaVersion.__table__.c.version)).scalar() or 0
+    finally:
+        connection.close()
+
+
+def set_schema_version(engine, version):
+    SchemaVersion.__table__.create(engine, checkfirst=True)
+    with engine.begin() as connection:
+        connection.execute(SchemaVersion.__table__.delete())
+        connection.execute(SchemaVersion.__table__.insert(), version=version)
+
+
+def vacuum_db(engine):
+    """
+    Give the space that deleted data took back: to the file system for SQLite, for reuse on PostgreSQL
+    """
+    # VACUUM can't run inside a transaction
+    with engine.connect() as connection:
+        connection.execution_options(isolation_level='AUTOCOMMIT').execute('VACUUM')
+
+
+def migrate_db(engine, logger=None):
+    """
+    Run the migrations that have not been applied to the database yet, each in its own transaction, and vacuum
+    the database if there were any. Returns the list of (version, description) that were applied
+    """
+    applied = []
+    current_version = get_schema_version(engine)
+    SchemaVersion.__table__.create(engine, checkfirst=True)
+    for version, description, migration in MIGRATIONS:
+        if version <= current_version:
+            continue
+        with engine.begin() as connection:
+            migration(connection)
+            connection.execute(SchemaVersion.__table__.delete())
+            connection.execute(SchemaVersion.__table__.insert(), version=version)
+        if logger:
+            logger.info('Migrated database to version ' + str(version) + ': ' + description)
+        applied.append((version, description))
+    if applied:
+        vacuum_db(engine)
+    return applied
+
+
+def get_account_id(session, name):
+    """
+    Returns the id of the account with name, adding it to the database if it's new
+    """
+    account = session.query(Account).filter(Account.name == name).first()
+    if not account:
+        account = Account(name=name)
+        session.add(account)
+        session.commit()
+        # Replaying the archive needs to know which account the responses belong to
+        archive_response('account', datetime.datetime.now(), {'id': account.id, 'name': name})
+    return account.id
+
+
+def get_last_update(session=None, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Return the timestamp of the last update from Pocket for the account.
+    This will be used to filter the request of updates.
+    """
+    if not session:
+        session = get_db_connection()
+    try:
+        time_since_unix, report_id = session.query(Report.time_since_unix, Report.id).filter(Report.account_id == account_id).order_by(desc(Report.time_since))[0]
+        #return mktime(time_since.timetuple())
+        return time_since_unix
+    except IndexError:
+        return None
+
+
+def get_existing_item(session, item_id, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Returns the item with item_id of the account if already in DB, otherwise None
+    """
+    try:
+        return session.query(Article).filter(Article.account_id == account_id, Article.item_id == item_id)[0]
+    except IndexError:
+        return None
+
+
+def get_existing_items(session, item_ids, columns=None, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Returns a dict of item_id => Article for the items in item_ids of the account that are already in the DB.
+    Looked up in chunks, to stay under the maximum number of SQL variables of SQLite.
+    If columns is given, only those columns are fetched (as rows) instead of full Article objects
+    """
+    item_ids = list(item_ids)
+    if columns:
+        query = session.query(Article.item_id, *columns)
+    else:
+        query = session.query(Article)
+    query = query.filter(Article.account_id == account_id)
+    result = {}
+    for start in range(0, len(item_ids), LOOKUP_CHUNK_SIZE):
+        chunk = item_ids[start:start + LOOKUP_CHUNK_SIZE]
+        for article in query.filter(Article.item_id.in_(chunk)):
+            result[str(article.item_id)] = article
+    return result
+
+
+def get_item_history(session, item_id, account_id=None):
+    """
+    Returns (timestamp, event_type, account name, report_id) of the events of the item, oldest first,
+    for all accounts or only account_id
+    """
+    query = session.query(ArticleEvent.timestamp, ArticleEvent.event_type, Account.name, ArticleEvent.report_id).join(
+        Account, Account.id == ArticleEvent.account_id
+    ).filter(ArticleEvent.item_id == item_id)
+    if account_id is not None:
+        query = query.filter(ArticleEvent.account_id == account_id)
+    return query.order_by(ArticleEvent.timestamp, ArticleEvent.id).all()
+
+
+def get_random_unread(session, number=5, weight=None, seed=None):
+    """
+    Get a (small) list of random items that have not been read yet. Instead of sorting or counting all unread
+    items, batches of random id's between the lowest and highest unread id are looked up through the primary key,
+    for at most RANDOM_UNREAD_ATTEMPTS batches. weight can be 'older' to favour items that have been in the list
+    longer, or 'word_count' to favour longer articles; when too many picks are turned down for their weight, the
+    rest is picked without. seed makes the picks reproducible
+    """
+    rng = random.Random(seed)
+    unread = session.query(Article.resolved_title, Article.resolved_url, Article.firstseen_time_updated, Article.word_count, Article.id).filter(Article.status == 0)
+    items = unread.order_by(Article.id).limit(number + 1).all()
+    if len(items) <= number:
+        rng.shuffle(items)
+        return items
+    first_id = items[0].id
+    last_id = unread.with_entities(Article.id).order_by(desc(Article.id)).limit(1).scalar()
+
+    now = datetime.datetime.utcnow()
+    if weight == 'older':
+        oldest = unread.filter(Article.firstseen_time_updated.isnot(None)).order_by(Article.firstseen_time_updated).first()
+        max_weight = (now - oldest.firstseen_time_updated).total_seconds() if oldest else 0
+    elif weight == 'word_count':
+        longest = unread.order_by(desc(Article.word_count)).first()
+        max_weight = longest.word_count or 0
+    else:
+        max_weight = 0
+
+    def get_weight(item):
+        if weight == 'older':
+            if not item.firstseen_time_updated:
+                return max_weight
+            return (now - item.firstseen_time_updated).total_seconds()
+        return item.word_count or 0
+
+    picked = collections.OrderedDict()
+    attempts = 0
+    max_attempts = number * RANDOM_UNREAD_ATTEMPTS
+    batch_size = max_attempts
+    for _ in range(RANDOM_UNREAD_ATTEMPTS):
+        # Every unread item is as likely to be hit by a random id, however large the gaps between them
+        article_ids = [rng.randint(first_id, last_id) for i in range(batch_size)]
+        hits = dict((item.id, item) for item in unread.filter(Article.id.in_(set(article_ids))))
+        for article_id in article_ids:
+            item = hits.get(article_id)
+            if item is None or item.id in picked:
+                continue
+            attempts += 1
+            if max_weight > 0 and attempts <= max_attempts and rng.random() * max_weight > get_weight(item):
+                # Rejection sampling: the higher the weight, the more likely the item is kept
+                continue
+            picked[item.id] = item
+            if len(picked) == number:
+                return list(picked.values())
+        # Few unread items between the lowest and highest id, so try more id's at once
+        batch_size = min(batch_size * 2, LOOKUP_CHUNK_SIZE)
+    # Only when the unread items are very sparse
+    return list(picked.values())
+
+
+def get_count(q):
+    """
+    Fast count for column, avoiding a subquery
+    """
+    count_q = q.statement.with_only_columns([func.count()]).order_by(None)
+    count = q.session.execute(count_q).scalar()
+    return count
+
+
+def nr_total(session):
+    return get_count(session.query(Article.id))
+
+
+def nr_unread(session):
+    return get_count(session.query(Article).filter(Article.status == 0))
+
+
+def nr_read(session):
+    return get_count(session.query(Article).filter(Article.status == 1))
+
+
+def nr_deleted(session):
+    return get_count(session.query(Article).filter(Article.status == 2))
+
+
+def nr_favourited(session):
+    return get_count(session.query(Article).filter(Article.favorite == 1))
+
+
+def get_rollup_contributions(article):
+    """
+    Returns the (day, counter) pairs that the article adds to the daily_stats rollup in its current state.
+    article can be an Article or anything else with the ROLLUP_COLUMNS as attributes; None adds nothing
+    """
+    if article is None:
+        return []
+
+    def get_day(timestamp):
+        if timestamp:
+            return timestamp.date()
+        return UNKNOWN_DAY
+
+    # firstseen_time_updated comes as close to 'time added' as we can get from the Pocket API
+    contributions = [(get_day(article.firstseen_time_updated), 'added')]
+    status = int(article.status)
+    if status == 1:
+        contributions.append((get_day(article.time_read), 'read'))
+    elif status == 2:
+        # Pocket has no time of deletion, but the item was last updated when it got deleted
+        contributions.append((get_day(article.time_updated or article.firstseen_time_updated), 'deleted'))
+    if article.favorite is not None and int(article.favorite) == 1:
+        contributions.append((get_day(article.time_favorited), 'favourited'))
+    return contributions
+
+
+def add_rollup_delta(rollup_deltas, previous_state, new_state):
+    """
+    Register the transition of an article from previous_state to new_state in rollup_deltas (day => counter => delta)
+    """
+    for day, counter in get_rollup_contributions(previous_state):
+        rollup_deltas[day][counter] -= 1
+    for day, counter in get_rollup_contributions(new_state):
+        rollup_deltas[day][counter] += 1
+
+
+def new_rollup_deltas():
+    return collections.defaultdict(lambda: dict((counter, 0) for counter in ROLLUP_COUNTERS))
+
+
+def apply_rollup_deltas(session, rollup_deltas):
+    """
+    Add the deltas to the daily_stats rows of their days, in the transaction of session
+    """
+    # In order of day, so concurrent updates lock the rows in the same order
+    days = sorted(rollup_deltas)
+    if session.bind.dialect.name in UPSERT_DIALECTS:
+        # Adds to the counters in the database, so concurrent updates don't lose each other's deltas
+        sql = 'INSERT INTO daily_stats (day, {columns}) VALUES (:day, {values}) ON CONFLICT (day) DO UPDATE SET {updates}'.format(
+            columns=', '.join(ROLLUP_COUNTERS),
+            values=', '.join(':' + counter for counter in ROLLUP_COUNTERS),
+            updates=', '.join(counter + ' = daily_stats.' + counter + ' + excluded.' + counter for counter in ROLLUP_COUNTERS),
+        )
+        upsert = text(sql).bindparams(bindparam('day', type_=Date))
+        rows = [dict(rollup_deltas[day], day=day) for day in days]
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            session.execute(upsert, rows[start:start + BULK_BATCH_SIZE])
+        return
+    existing_days = {}
+    for start in range(0, len(days), LOOKUP_CHUNK_SIZE):
+        for daily_stats in session.query(DailyStats).filter(DailyStats.day.in_(days[start:start + LOOKUP_CHUNK_SIZE])):
+            existing_days[daily_stats.day] = daily_stats
+    for day in days:
+        daily_stats = existing_days.get(day)
+        if not daily_stats:
+            daily_stats = DailyStats(day=day, added=0, read=0, deleted=0, favourited=0)
+            session.add(daily_stats)
+        for counter, delta in rollup_deltas[day].items():
+            setattr(daily_stats, counter, getattr(daily_stats, counter) + delta)
+
+
+def rebuild_rollups(connection):
+    """
+    Recalculate the daily_stats rollup from scratch from all articles
+    """
+    rollup_deltas = new_rollup_deltas()
+    for article in connection.execute(select(ROLLUP_COLUMNS)):
+        add_rollup_delta(rollup_deltas, None, article)
+    connection.execute(DailyStats.__table__.delete())
+    if rollup_deltas:
+        connection.execute(DailyStats.__table__.insert(), [dict(day=day, **counters) for day, counters in rollup_deltas.items()])
+
+
+def replace_tags(connection, tags_per_item, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Replace the article_tag rows of the items of the account in tags_per_item (item_id => list of tags)
+    """
+    item_ids = list(tags_per_item)
+    table = ArticleTag.__table__
+    for start in range(0, len(item_ids), LOOKUP_CHUNK_SIZE):
+        connection.execute(table.delete().where(table.c.account_id == account_id).where(table.c.item_id.in_(item_ids[start:start + LOOKUP_CHUNK_SIZE])))
+    rows = [{'account_id': account_id, 'item_id': item_id, 'tag': tag} for item_id in item_ids for tag in tags_per_item[item_id]]
+    for start in range(0, len(rows), BULK_BATCH_SIZE):
+        connection.execute(table.insert(), rows[start:start + BULK_BATCH_SIZE])
+
+
+def backfill_tags(connection):
+    """
+    Recreate the article_tag table from the tags of all articles
+    """
+    table = ArticleTag.__table__
+    connection.execute(table.delete())
+    rows = []
+    for account_id, item_id, tags in connection.execute(select([Article.account_id, Article.item_id, Article.tags]).where(Article.tags.isnot(None))):
+        rows.extend({'account_id': account_id, 'item_id': item_id, 'tag': tag} for tag in json.loads(tags))
+        if len(rows) >= BULK_BATCH_SIZE:
+            connection.execute(table.insert(), rows)
+            rows = []
+    if rows:
+        connection.execute(table.insert(), rows)
+
+
+def create_search_index(connection):
+    """
+    Create the article_fts table and the triggers that keep it in sync with article. Returns False when
+    the database is not SQLite, or its SQLite lacks FTS5
+    """
+    if connection.dialect.name != 'sqlite':
+        return False
+    columns = ', '.join(SEARCH_COLUMNS)
+    try:
+        connection.execute('CREATE VIRTUAL TABLE IF NOT EXISTS article_fts USING fts5({columns}, content=article, content_rowid=id)'.format(columns=columns))
+    except OperationalError:
+        # no such module: fts5
+        return False
+    new_values = ', '.join('new.' + column for column in SEARCH_COLUMNS)
+    old_values = ', '.join('old.' + column for column in SEARCH_COLUMNS)
+    insert = 'INSERT INTO article_fts (rowid, {columns}) VALUES (new.id, {new_values});'.format(columns=columns, new_values=new_values)
+    delete = "INSERT INTO article_fts (article_fts, rowid, {columns}) VALUES ('delete', old.id, {old_values});".format(columns=columns, old_values=old_values)
+    connection.execute('CREATE TRIGGER IF NOT EXISTS article_fts_insert AFTER INSERT ON article BEGIN ' + insert + ' END')
+    connection.execute('CREATE TRIGGER IF NOT EXISTS article_fts_delete AFTER DELETE ON article BEGIN ' + delete + ' END')
+    connection.execute('CREATE TRIGGER IF NOT EXISTS article_fts_update AFTER UPDATE OF {columns} ON article BEGIN {delete} {insert} END'.format(columns=columns, delete=delete, insert=insert))
+    return True
+
+
+def has_search_index(connection):
+    return connection.dialect.has_table(connection, 'article_fts')
+
+
+def rebuild_search_index(connection):
+    """
+    Recreate the contents of article_fts from all articles
+    """
+    connection.execute("INSERT INTO article_fts (article_fts) VALUES ('rebuild')")
+
+
+def get_search_query(terms):
+    """
+    Returns an FTS5 query that matches articles with all terms, quoted so characters like - and : are just text
+    """
+    return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+
+def search_articles(session, query, status=None, favourite=None, tag=None, limit=20):
+    """
+    Returns (item_id, resolved_title, resolved_url, status, favorite, score) of the articles that match the FTS5
+    query, best matches (lowest bm25 score) first. Optionally only articles with status, that are (not)
+    favourited, or that have tag
+    """
+    sql = 'SELECT article.item_id, article.resolved_title, article.resolved_url, article.status, article.favorite, bm25(article_fts, {weights}) AS score ' \
+          'FROM article_fts JOIN article ON article.id = article_fts.rowid WHERE article_fts MATCH :query'.format(weights=', '.join(str(weight) for weight in SEARCH_WEIGHTS))
+    params = {'query': query, 'limit': limit}
+    if status is not None:
+        sql += ' AND article.status = :status'
+        params['status'] = status
+    if favourite is not None:
+        sql += ' AND article.favorite = :favourite'
+        params['favourite'] = int(favourite)
+    if tag:
+        sql += ' AND EXISTS (SELECT 1 FROM article_tag WHERE article_tag.account_id = article.account_id AND article_tag.item_id = article.item_id AND article_tag.tag = :tag)'
+        params['tag'] = tag
+    sql += ' ORDER BY score LIMIT :limit'
+    return session.execute(text(sql), params).fetchall()
+
+
+def get_tag_stats(session):
+    """
+    Returns (tag, total, read, unread) per tag, most used tags first, in one grouped query
+    """
+    total = func.count(Article.id).label('total')
+    return session.query(
+        ArticleTag.tag,
+        total,
+        func.sum(case([(Article.status == 1, 1)], else_=0)),
+        func.sum(case([(Article.status == 0, 1)], else_=0)),
+    ).join(Article, (Article.account_id == ArticleTag.account_id) & (Article.item_id == ArticleTag.item_id)).group_by(ArticleTag.tag).order_by(desc(total), ArticleTag.tag).all()
+
+
+def get_rollup_totals(session):
+    """
+    Returns a dict with the total, read, unread, deleted and favourited number of articles, from the rollup
+    """
+    added, read, deleted, favourited = session.query(func.sum(DailyStats.added), func.sum(DailyStats.read), func.sum(DailyStats.deleted), func.sum(DailyStats.favourited)).one()
+    totals = {'total': added or 0, 'read': read or 0, 'deleted': deleted or 0, 'favourited': favourited or 0}
+    # Every article has exactly one status: unread, read or deleted
+    totals['unread'] = totals['total'] - totals['read'] - totals['deleted']
+    return totals
+
+
+def get_content_hash(item):
+    """
+    Returns the SHA-1 of the Pocket item, normalized by sorting its keys and leaving out the RESPONSE_KEYS, to
+    tell whether it changed
+    """
+    item = dict((key, value) for key, value in item.items() if key not in RESPONSE_KEYS)
+    return hashlib.sha1(json.dumps(item, sort_keys=True, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def pack_payload(payload, item_id):
+    """
+    Returns (id, data) of the authors, images or videos of the Pocket item item_id for payload_blob. Every entry
+    repeats the item_id, which is replaced by null, so the same author or image of different items is stored once.
+    The id is the first 64 bits of the SHA-1 of the JSON, and the data is the JSON, zlib compressed if that's smaller
+    """
+    item_id = str(item_id)
+
+    def strip(entry):
+        if isinstance(entry, dict) and entry.get('item_id') == item_id:
+            return dict(entry, item_id=None)
+        return entry
+
+    # A copy, as the item is archived as Pocket returned it
+    if isinstance(payload, dict):
+        payload = dict((key, strip(entry)) for key, entry in payload.items())
+    else:
+        payload = [strip(entry) for entry in payload]
+    data = json.dumps(payload, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    blob_id = struct.unpack('>q', hashlib.sha1(data).digest()[:8])[0]
+    compressed = zlib.compress(data)
+    return blob_id, compressed if len(compressed) < len(data) else data
+
+
+def unpack_payload(data, item_id):
+    """
+    Returns the authors, images or videos JSON object of item_id from its pack_payload data
+    """
+    # JSON starts with { or [, zlib data with x
+    if data[:1] == b'x':
+        data = zlib.decompress(data)
+    payload = json.loads(data.decode('utf-8'))
+    entries = payload.values() if isinstance(payload, dict) else payload
+    for entry in entries:
+        if isinstance(entry, dict) and 'item_id' in entry and entry['item_id'] is None:
+            entry['item_id'] = str(item_id)
+    return payload
+
+
+def get_payload(session, blob_id, item_id):
+    """
+    Returns the authors, images or videos JSON object of item_id that is saved as blob_id; None if there is none
+    """
+    if blob_id is None:
+        return None
+    data = session.query(PayloadBlob.data).filter(PayloadBlob.id == blob_id).scalar()
+    return unpack_payload(data, item_id)
+
+
+def save_payloads(connection, payloads):
+    """
+    Save the payloads (id => data, see pack_payload) that are not in payload_blob yet
+    """
+    table = PayloadBlob.__table__
+    if connection.dialect.name in UPSERT_DIALECTS:
+        # Leaves the existing ones alone, also when another update saves the same payload at the same time
+        insert = text('INSERT INTO payload_blob (id, data) VALUES (:id, :data) ON CONFLICT (id) DO NOTHING').bindparams(bindparam('data', type_=LargeBinary))
+    else:
+        insert = table.insert()
+        blob_ids = list(payloads)
+        for start in range(0, len(blob_ids), LOOKUP_CHUNK_SIZE):
+            for row in connection.execute(select([table.c.id]).where(table.c.id.in_(blob_ids[start:start + LOOKUP_CHUNK_SIZE]))):
+                del payloads[row[0]]
+    rows = [{'id': blob_id, 'data': data} for blob_id, data in payloads.items()]
+    for start in range(0, len(rows), BULK_BATCH_SIZE):
+        connection.execute(insert, rows[start:start + BULK_BATCH_SIZE])
+
+
+class BacklogForecast(object):
+    """
+    How fast the backlog shrinks (negative rate) or grows, in items per day, from the net result (added - read
+    - deleted) of the Reports, added in time order. Every report takes constant (amortized) time: rolling sums
+    over the FORECAST_WINDOWS, and per account exponentially decaying sums of the intervals between its reports,
+    for the rate per interval weighted by the length of the interval, and its variance
+    """
+
+    def __init__(self):
+        self.start = None
+        self.windows = dict((days, collections.deque()) for days in FORECAST_WINDOWS)
+        self.sums = dict((days, 0) for days in FORECAST_WINDOWS)
+        # account_id => [time of the last report, net result not in the sums yet, and the decaying sums of
+        # the weights (days), weights squared, net results and net results squared per day]
+        self.accounts = {}
+        self.nr_intervals = 0
+
+    def add(self, account_id, time_updated, net_result):
+        if account_id not in self.accounts:
+            # The first report of an account is the import of its archive: its net result is the backlog, not a rate
+            self.accounts[account_id] = [time_updated, 0, 0.0, 0.0, 0.0, 0.0]
+            if self.start is None:
+                self.start = time_updated
+            return
+        for days in FORECAST_WINDOWS:
+            self.windows[days].append((time_updated, net_result))
+            self.sums[days] += net_result
+            self._evict(days, time_updated)
+
+        state = self.accounts[account_id]
+        state[1] += net_result
+        elapsed = (time_updated - state[0]).total_seconds() / 86400.0
+        if elapsed <= 0:
+            # No time passed since the last report, so its net result counts towards the next interval
+            return
+        # The rate of this interval is state[1] / elapsed, with elapsed as weight
+        decay = math.exp(-elapsed / FORECAST_EWMA_DAYS)
+        state[2] = state[2] * decay + elapsed
+        state[3] = state[3] * decay * decay + elapsed * elapsed
+        state[4] = state[4] * decay + state[1]
+        state[5] = state[5] * decay + state[1] * state[1] / elapsed
+        state[0] = time_updated
+        state[1] = 0
+        self.nr_intervals += 1
+
+    def _evict(self, days, now):
+        window = self.windows[days]
+        while window and window[0][0] <= now - datetime.timedelta(days=days):
+            self.sums[days] -= window.popleft()[1]
+
+    def get_window_rates(self, now):
+        """
+        Returns a dict of window (days) => net result per day over that window up to now; None without history
+        """
+        rates = {}
+        for days in FORECAST_WINDOWS:
+            self._evict(days, now)
+            span = min(float(days), (now - self.start).total_seconds() / 86400.0) if self.start else 0
+            rates[days] = self.sums[days] / span if span > 0 and self.nr_intervals else None
+        return rates
+
+    def get_rate(self):
+        """
+        Returns (rate, standard deviation) of the exponentially weighted rate of all accounts together;
+        (None, None) without intervals
+        """
+        rate = None
+        variance = 0.0
+        for last_time, pending, weights, squared_weights, net_results, squared_rates in self.accounts.values():
+            if not weights:
+                continue
+            mean = net_results / weights
+            rate = (rate or 0) + mean
+            # Variance of the weighted mean, with the effective number of intervals
+            variance += max(squared_rates / weights - mean * mean, 0) * squared_weights / (weights * weights)
+        if rate is None:
+            return None, None
+        return rate, math.sqrt(variance)
+
+    def forecast(self, unread, now):
+        """
+        Returns a dict with the window rates, the weighted rate and its standard deviation, and the date the
+        unread items are done at that rate, with the earliest and latest date of the band around it.
+        Dates are None when the backlog doesn't shrink at that rate
+        """
+        rate, deviation = self.get_rate()
+        result = {'unread': unread, 'windows': self.get_window_rates(now), 'rate': rate, 'deviation': deviation}
+        for key, band_rate in (('completion', rate), ('earliest', None if rate is None else rate - FORECAST_BAND * deviation), ('latest', None if rate is None else rate + FORECAST_BAND * deviation)):
+            if band_rate is not None and band_rate < 0:
+                result[key] = now + datetime.timedelta(days=unread / -band_rate)
+            else:
+                result[key] = None
+        return result
+
+
+def get_backlog_forecast(session, now=None):
+    """
+    Forecast of when the backlog is read, from all Reports in one pass (see BacklogForecast)
+    """
+    now = now or datetime.datetime.now()
+    backlog_forecast = BacklogForecast()
+    query = session.query(Report.account_id, Report.time_updated, Report.nr_added, Report.nr_read, Report.nr_deleted).order_by(Report.time_updated, Report.id)
+    for account_id, time_updated, nr_added, nr_read, nr_deleted in query.yield_per(BULK_BATCH_SIZE):
+        backlog_forecast.add(account_id, time_updated, nr_added - nr_read - nr_deleted)
+    return backlog_forecast.forecast(get_rollup_totals(session)['unread'], now)
+
+
+def register_changes(item, existing_item, changed_articles, content_hash=None):
+    """
+    Add the item_id of item to the lists in changed_articles it belongs in (added, read, etc), compared
+    to existing_item (an Article or a row with its status, favorite, time_updated and content_hash; None if new).
+    An item counts as updated when its content_hash differs, or for articles saved without a hash, its time_updated
+    """
+    # 0, 1, 2 - 1 if the item is archived - 2 if the item should be deleted
+    status = item['status']
+    if status == '0' and not existing_item:
+        changed_articles['added'].append(item['item_id'])
+    elif status == '1' and not existing_item:
+        changed_articles['added'].append(item['item_id'])
+        changed_articles['read'].append(item['item_id'])
+    elif status == '1':
+        changed_articles['read'].append(item['item_id'])
+    elif status == '2' and not existing_item:
+        changed_articles['added'].append(item['item_id'])
+        changed_articles['deleted'].append(item['item_id'])
+    elif status == '2':
+        changed_articles['deleted'].append(item['item_id'])
+
+    if 'resolved_id' not in item:
+        # Item was added and immediately deleted, so no more info to compare
+        return
+
+    if existing_item and existing_item.favorite == 0 and item['favorite'] == '1':
+        changed_articles['favourited'].append(item['item_id'])
+    elif not existing_item and item['favorite'] == '1':
+        changed_articles['favourited'].append(item['item_id'])
+    if existing_item:
+        if existing_item.content_hash is not None and content_hash is not None:
+            updated = existing_item.content_hash != content_hash
+        else:
+            updated = existing_item.time_updated != datetimeutil.unix_to_python(item['time_updated'])
+        if updated:
+            changed_articles['updated'].append(item['item_id'])
+
+
+def get_article_values(item, existing_item, now, payloads):
+    """
+    Returns a dict of Article column => value for the Pocket item, containing only the columns
+    that need to be set for it (e.g., firstseen_* only for new items). The authors, images and videos
+    of the item are added to payloads, see save_payloads
+    """
+    values = {'status': item['status']}
+    if 'resolved_id' not in item:
+        # Item was added and immediately deleted, or at least before we saw it
+        values['item_id'] = item['item_id']
+        values['firstseen_status'] = item['status']
+        values['firstseen_time'] = now
+        if 'time_updated' in item:
+            values['firstseen_time_updated'] = datetimeutil.unix_to_python(item['time_updated'])
+        return values
+
+    values['resolved_id'] = item['resolved_id']
+    values['sort_id'] = item['sort_id']
+    values['given_url'] = item['given_url']
+    values['resolved_url'] = item['resolved_url']
+    values['given_title'] = item['given_title']
+    values['resolved_title'] = item['resolved_title']
+    values['favorite'] = item['favorite']
+    values['excerpt'] = item['excerpt']
+    values['is_article'] = item['is_article']
+    values['has_image'] = item['has_image']
+    values['has_video'] = item['has_video']
+    values['word_count'] = item['word_count']
+    # Pocket leaves tags out when the item has none (anymore)
+    values['tags'] = json.dumps(item['tags']) if 'tags' in item else None
+    for key in PAYLOAD_KEYS:
+        if key in item:
+            blob_id, payloads[blob_id] = pack_payload(item[key], item['item_id'])
+            values[key + '_blob_id'] = blob_id
+    values['time_updated'] = datetimeutil.unix_to_python(item['time_updated'])
+    values['time_favorited'] = datetimeutil.unix_to_python(item['time_favorited'])
+    values['time_read'] = datetimeutil.unix_to_python(item['time_read'])
+    if not existing_item:
+        values['firstseen_status'] = item['status']
+        values['firstseen_time'] = now
+        values['firstseen_time_updated'] = datetimeutil.unix_to_python(item['time_updated'])
+    return values
+
+
+def log_item(logger, item):
+    # Called for every item, so only format when debug logging is on
+    if not logger.isEnabledFor(logging.DEBUG):
+        return
+    if 'resolved_id' not in item:
+        logger.debug('%s %s deleted', stringutil.safe_unicode(item['status']), stringutil.safe_unicode(item['item_id']))
+    else:
+        logger.debug('%s %s %s %s %s %s', stringutil.safe_unicode(item['status']), stringutil.safe_unicode(item['item_id']), stringutil.safe_unicode(item['resolved_id']), datetimeutil.unix_to_string(item['time_added']), datetimeutil.unix_to_string(item['time_updated']), stringutil.safe_unicode(item['resolved_url']))
+
+
+def save_items(logger, session, item_list, now, changed_articles, rollup_deltas, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Save the Pocket items of the account to the DB through the ORM, registering what changed in changed_articles and rollup_deltas.
+    Items that are the same as when they were saved last are skipped. Returns the item_id's of the saved items
+    """
+    # Fetch all articles we already know about in one go, instead of one query per item
+    existing_items = get_existing_items(session, item_list, account_id=account_id)
+
+    saved_item_ids = []
+    payloads = {}
+    for item_id in item_list:
+        item = item_list[item_id]
+        existing_item = existing_items.get(str(item_id))
+        content_hash = get_content_hash(item)
+        register_changes(item, existing_item, changed_articles, content_hash)
+        if existing_item and existing_item.content_hash == content_hash:
+            logger.debug('Existing item unchanged for %s', item_id)
+            continue
+
+        if not existing_item:
+            #article = Article(sort_id=item['sort_id'], item_id=item['item_id'])
+            article = Article(account_id=account_id, item_id=item['item_id'])
+            logger.debug('Existing item NOT found for %s', item_id)
+        else:
+            article = existing_item
+            logger.debug('Existing item found for %s', item_id)
+
+        log_item(logger, item)
+        previous_state = get_article_state(existing_item)
+        for key, value in get_article_values(item, existing_item, now, payloads).items():
+            setattr(article, key, value)
+        article.content_hash = content_hash
+        add_rollup_delta(rollup_deltas, previous_state, article)
+        saved_item_ids.append(item_id)
+
+        if not existing_item:
+            # If item didn't exist yet, add it (otherwise it's updated automagically)
+            session.add(article)
+    save_payloads(session.connection(), payloads)
+    return saved_item_ids
+
+
+def get_article_state(article, values=None):
+    """
+    Snapshot of the ROLLUP_COLUMNS of article (an Article, a row or None), optionally updated with values
+    """
+    if article is None and not values:
+        return None
+    state = dict((column.key, getattr(article, column.key, None)) for column in ROLLUP_COLUMNS)
+    if values:
+        state.update((key, value) for key, value in values.items() if key in state)
+    return ArticleState(**state)
+
+
+def get_upsert_statement(columns):
+    """
+    INSERT ... ON CONFLICT(account_id, item_id) DO UPDATE statement for the Article columns, usable for executemany.
+    SQLite (3.24 and later) and PostgreSQL share this syntax, see UPSERT_DIALECTS
+    """
+    table = Article.__table__
+    columns = sorted(columns)
+    sql = 'INSERT INTO {table} ({columns}) VALUES ({values}) ON CONFLICT(account_id, item_id) DO UPDATE SET {updates}'.format(
+        table=table.name,
+        columns=', '.join(columns),
+        values=', '.join(':' + column for column in columns),
+        updates=', '.join(column + ' = excluded.' + column for column in columns if column not in ('account_id', 'item_id')),
+    )
+    return text(sql).bindparams(*[bindparam(column, type_=table.c[column].type) for column in columns])
+
+
+def bulk_save_items(logger, session, item_list, now, changed_articles, rollup_deltas, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Save the Pocket items of the account to the DB with executemany upserts, bypassing the ORM unit of work.
+    Results in the same rows, changed_articles, rollup_deltas and return value as save_items
+    """
+    existing_items = get_existing_items(session, item_list, columns=ROLLUP_COLUMNS + [Article.content_hash], account_id=account_id)
+
+    # Items only get the columns that the ORM path would set on them, so group them by that set of columns
+    batches = {}
+    saved_item_ids = []
+    payloads = {}
+    for item_id in item_list:
+        item = item_list[item_id]
+        existing_item = existing_items.get(str(item_id))
+        content_hash = get_content_hash(item)
+        register_changes(item, existing_item, changed_articles, content_hash)
+        if existing_item and existing_item.content_hash == content_hash:
+            continue
+        log_item(logger, item)
+        values = get_article_values(item, existing_item, now, payloads)
+        values['item_id'] = item['item_id']
+        values['account_id'] = account_id
+        values['content_hash'] = content_hash
+        previous_state = get_article_state(existing_item)
+        add_rollup_delta(rollup_deltas, previous_state, get_article_state(existing_item, values))
+        batches.setdefault(tuple(sorted(values)), []).append(values)
+        saved_item_ids.append(item_id)
+
+    save_payloads(session.connection(), payloads)
+    for columns, rows in batches.items():
+        statement = get_upsert_statement(columns)
+        for start in range(0, len(rows), BULK_BATCH_SIZE):
+            session.execute(statement, rows[start:start + BULK_BATCH_SIZE])
+    logger.debug('Bulk saved %d of %d items in %d batch types', len(saved_item_ids), len(item_list), len(batches))
+    return saved_item_ids
+
+
+def get_item_list(response):
+    """
+    Returns the items of a Pocket API response as dict of item_id => item
+    """
+    # An empty response has an empty list instead of an empty dict
+    return response['list'] or {}
+
+
+def save_response_items(logger, session, item_list, now, changed_articles, bulk=False, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Save the Pocket items of the account through the ORM or in bulk, and update the daily_stats rollup
+    (of all accounts together) and the tags accordingly
+    """
+    rollup_deltas = new_rollup_deltas()
+    if bulk and session.bind.dialect.name in UPSERT_DIALECTS:
+        saved_item_ids = bulk_save_items(logger, session, item_list, now, changed_articles, rollup_deltas, account_id)
+    else:
+        saved_item_ids = save_items(logger, session, item_list, now, changed_articles, rollup_deltas, account_id)
+    apply_rollup_deltas(session, rollup_deltas)
+    # Like Article.tags, items without tags get their tags cleared; deleted items only come with their status, so
+    # they keep theirs
+    saved_items = [item_list[item_id] for item_id in saved_item_ids]
+    tags_per_item = dict((item['item_id'], list(item.get('tags', []))) for item in saved_items if 'resolved_id' in item)
+    replace_tags(session.connection(), tags_per_item, account_id)
+
+
+def fill_report(report, response, changed_articles, total_response):
+    """
+    Set the response metadata and the stats of the changed articles on the report
+    """
+    report.time_since = datetimeutil.unix_to_python(response['since'])
+    report.time_since_unix = response['since']
+    report.status = response['status']
+    report.complete = response['complete']
+    report.error = response['error']
+    report.total_response = total_response
+    report.nr_added = len(changed_articles['added'])
+    report.nr_read = len(changed_articles['read'])
+    report.nr_favourited = len(changed_articles['favourited'])
+    report.nr_deleted = len(changed_articles['deleted'])
+    report.nr_updated = len(changed_articles['updated'])
+
+
+def get_event_rows(report_id, account_id, timestamp, changed_articles):
+    """
+    Returns the article_event rows for the lists of item_id's in changed_articles
+    """
+    rows = []
+    for event_type in EVENT_TYPES:
+        for item_id in changed_articles.get(event_type, []):
+            rows.append({'report_id': report_id, 'account_id': account_id, 'item_id': item_id, 'event_type': event_type, 'timestamp': timestamp})
+    return rows
+
+
+def save_report(session, report, changed_articles):
+    """
+    Add the report to the session, and insert the events of the articles in changed_articles with executemany
+    """
+    session.add(report)
+    # The events need the id of the report
+    session.flush()
+    rows = get_event_rows(report.id, report.account_id, report.time_updated, changed_articles)
+    for start in range(0, len(rows), BULK_BATCH_SIZE):
+        session.execute(ArticleEvent.__table__.insert(), rows[start:start + BULK_BATCH_SIZE])
+
+
+def save_import_page(logger, session, item_list, now, changed_articles, bulk=False, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Save a page of the import that started at now. Only the changes of the items that were saved before the import
+    are added to changed_articles, so an import checkpoint stays small; get_import_changes adds the items it added
+    """
+    existing_items = get_existing_items(session, item_list, columns=[Article.firstseen_time], account_id=account_id)
+    earlier_item_ids = set(item_id for item_id, row in existing_items.items() if row.firstseen_time != now)
+    page_changes = new_changed_articles()
+    save_response_items(logger, session, item_list, now, page_changes, bulk, account_id)
+    for event_type, item_ids in page_changes.items():
+        changed_articles[event_type].extend(item_id for item_id in item_ids if str(item_id) in earlier_item_ids)
+
+
+def get_import_changes(session, account_id, time_started, changed_articles):
+    """
+    Returns the changes of the import that started at time_started: the items it added, from the articles first
+    seen by it, with the changes of the items that were saved before it in changed_articles (see save_import_page)
+    """
+    import_changes = new_changed_articles()
+    query = session.query(Article.item_id, Article.firstseen_status, Article.favorite).filter(Article.account_id == account_id, Article.firstseen_time == time_started).order_by(Article.item_id)
+    # The same changes as register_changes gives new items
+    for item_id, status, favorite in query.yield_per(BULK_BATCH_SIZE):
+        import_changes['added'].append(item_id)
+        if status == 1:
+            import_changes['read'].append(item_id)
+        elif status == 2:
+            import_changes['deleted'].append(item_id)
+        if favorite == 1:
+            import_changes['favourited'].append(item_id)
+    for event_type, item_ids in changed_articles.items():
+        import_changes[event_type].extend(item_ids)
+    return import_changes
+
+
+def new_changed_articles():
+    return {'added': [], 'read': [], 'deleted': [], 'favourited': [], 'updated': []}
+
+
+def get_database_filename(url=None):
+    """
+    Returns the path of the SQLite database file of url (DATABASE_URL by default); None for other databases
+    """
+    url = make_url(url or DATABASE_URL)
+    if url.drivername.startswith('sqlite') and url.database:
+        return url.database
+    return None
+
+
+def get_archive_filename(url=None):
+    """
+    Returns the path of the response archive: ARCHIVE_FILENAME, or the SQLite database file with .archive
+    as extension
+    """
+    if ARCHIVE_FILENAME:
+        return ARCHIVE_FILENAME
+    database_filename = get_database_filename(url)
+    if database_filename:
+        return os.path.splitext(database_filename)[0] + '.archive'
+    return 'pocketstats.archive'
+
+
+def archive_response(kind, now, response, since=None, offset=None, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Append a raw Pocket API response to the archive. kind is 'update' for the response of an update,
+    'import' for a page of the complete archive and 'import_end' for the end of an import; 'account'
+    records a new account instead
+    """
+    if not ARCHIVE_RESPONSES:
+        return
+    record = {
+        'kind': kind,
+        'now': now.strftime(ARCHIVE_TIME_FORMAT),
+        'account_id': account_id,
+        'since': since,
+        'offset': offset,
+        'response': response,
+    }
+    data = zlib.compress(json.dumps(record).encode('utf-8'))
+    with open(get_archive_filename(), 'ab') as archive:
+        archive.write(ARCHIVE_HEADER.pack(len(data)) + data)
+
+
+def read_archive(filename=None):
+    """
+    Yields the records of the response archive in the order they were written. A record that was cut off
+    while writing ends the archive
+    """
+    with open(filename or get_archive_filename(), 'rb') as archive:
+        while True:
+            header = archive.read(ARCHIVE_HEADER.size)
+            if len(header) < ARCHIVE_HEADER.size:
+                return
+            length = ARCHIVE_HEADER.unpack(header)[0]
+            data = archive.read(length)
+            if len(data) < length:
+                return
+            record = json.loads(zlib.decompress(data).decode('utf-8'))
+            record['now'] = datetime.datetime.strptime(record['now'], ARCHIVE_TIME_FORMAT)
+            yield record
+
+
+def replay_archive(logger, session, records, bulk=True):
+    """
+    Save the archived responses in records with the same diff logic as an update, recreating the Reports.
+    Meant for an empty database; returns the number of Reports replayed
+    """
+    nr_reports = 0
+    # account_id => (changed_articles, total_response) of the import in progress
+    imports = {}
+    for record in records:
+        now = record['now']
+        response = record['response']
+        # Archives from before there were accounts only have the default account
+        account_id = record.get('account_id', DEFAULT_ACCOUNT_ID)
+        if record['kind'] == 'account':
+            if not session.query(Account).get(response['id']):
+                session.add(Account(id=response['id'], name=response['name']))
+                session.flush()
+                reset_id_sequence(session.connection(), Account.__table__)
+            session.commit()
+            continue
+        item_list = get_item_list(response)
+        if record['kind'] == 'update':
+            changed_articles = new_changed_articles()
+            save_response_items(logger, session, item_list, now, changed_articles, bulk, account_id)
+            report = Report(account_id=account_id, time_updated=now)
+            fill_report(report, response, changed_articles, len(item_list))
+            save_report(session, report, changed_articles)
+            nr_reports += 1
+        elif record['kind'] == 'import':
+            changed_articles, total_response = imports.get(account_id, (new_changed_articles(), 0))
+            save_import_page(logger, session, item_list, now, changed_articles, bulk, account_id)
+            imports[account_id] = (changed_articles, total_response + len(item_list))
+        elif record['kind'] == 'import_end':
+            changed_articles, total_response = imports.pop(account_id, (new_changed_articles(), 0))
+            changed_articles = get_import_changes(session, account_id, now, changed_articles)
+            report = Report(account_id=account_id, time_updated=now)
+            response['since'] = record['since']
+            fill_report(report, response, changed_articles, total_response)
+            save_report(session, report, changed_articles)
+            nr_reports += 1
+        session.commit()
+        session.expunge_all()
+        debug_print('Replayed ' + record['kind'] + ' of ' + str(now) + ' with ' + str(len(item_list)) + ' items')
+    return nr_reports
+
+
+def compare_databases(session, other_session):
+    """
+    Returns the (account_id, item_id)'s of the Articles and the ids of the Reports that differ between the
+    two databases, ignoring the id's of the articles
+    """
+    article_columns = [column for column in Article.__table__.columns if column.name != 'id']
+    query = select(article_columns).order_by(Article.account_id, Article.item_id)
+    articles = dict(((row['account_id'], row['item_id']), tuple(row)) for row in session.execute(query))
+    different_articles = []
+    for row in other_session.execute(query):
+        key = (row['account_id'], row['item_id'])
+        if articles.pop(key, None) != tuple(row):
+            different_articles.append(key)
+    different_articles.extend(articles)
+
+    # A report is different when its events are too
+    query = select([Report.__table__]).order_by(Report.id)
+    event_query = select([ArticleEvent.report_id, ArticleEvent.account_id, ArticleEvent.item_id, ArticleEvent.event_type, ArticleEvent.timestamp]).order_by(ArticleEvent.id)
+    events = collections.defaultdict(list)
+    for row in session.execute(event_query):
+        events[row['report_id']].append(tuple(row))
+    other_events = collections.defaultdict(list)
+    for row in other_session.execute(event_query):
+        other_events[row['report_id']].append(tuple(row))
+    reports = dict((row['id'], (tuple(row), events[row['id']])) for row in session.execute(query))
+    different_reports = []
+    for row in other_session.execute(query):
+        if reports.pop(row['id'], None) != (tuple(row), other_events[row['id']]):
+            different_reports.append(row['id'])
+    different_reports.extend(reports)
+    return sorted(different_articles), sorted(different_reports)
+
+
+def import_all(logger, session, pocket_instance, bulk=False, page_size=None, timer=None, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Import the complete Pocket archive of the account page by page, committing every page together with a
+    checkpoint, so an interrupted import continues where it stopped. The Report is only saved when all pages are in.
+    Every page starts IMPORT_PAGE_OVERLAP items before the end of the previous one; the items this import already
+    saved are left out of it. A page without any of those might come after more deleted items than the overlap
+    covers, so the import steps back a page, once per offset. The import is done at a page with less than
+    page_size items
+    """
+    if not timer:
+        timer = SyncTimer()
+    if not page_size:
+        page_size = IMPORT_PAGE_SIZE
+    page_overlap = min(IMPORT_PAGE_OVERLAP, page_size // 2)
+    checkpoints = session.query(ImportCheckpoint).filter(ImportCheckpoint.account_id == account_id)
+    checkpoint = checkpoints.first()
+    if checkpoint:
+        logger.info('Resuming import from offset ' + str(checkpoint.offset))
+        debug_print('Resuming import from offset ' + str(checkpoint.offset))
+        now = checkpoint.time_started
+        offset = checkpoint.offset
+        since = checkpoint.since
+        total_response = checkpoint.total_response
+        changed_articles = json.loads(checkpoint.changed_articles)
+        # The items the import added before it was interrupted
+        imported_articles = session.query(Article.item_id).filter(Article.account_id == account_id, Article.firstseen_time == now)
+        imported_item_ids = set(str(item_id) for item_id, in imported_articles)
+    else:
+        now = datetime.datetime.now()
+        offset = 0
+        since = None
+        total_response = 0
+        changed_articles = new_changed_articles()
+        imported_item_ids = set()
+    # Offsets the import stepped back from, so it doesn't go back and forth between the same pages
+    stepped_back = set()
+
+    while True:
+        # Oldest first, so items that get added during the import end up on the last pages
+        response = timer.fetch(pocket_instance, state='all', detailType='complete', sort='oldest', count=page_size, offset=offset)
+        item_list = get_item_list(response)
+        logger.debug('Number of items in page at offset %s: %d', offset, len(item_list))
+        if since is None:
+            # Changes made during the import are picked up by the next update, which starts from here
+            since = response['since']
+        if offset > 0 and page_overlap and offset not in stepped_back and imported_item_ids.isdisjoint(str(item_id) for item_id in item_list):
+            # As many items before the page were deleted as the overlap covers, or more, in which case the items
+            # in between would be skipped; fetch from a page further back to be sure
+            logger.debug('Page at offset %s has none of the imported items, stepping back', offset)
+            stepped_back.add(offset)
+            offset = max(offset - page_size, 0)
+            continue
+        new_item_list = dict((item_id, item) for item_id, item in item_list.items() if str(item_id) not in imported_item_ids)
+        if new_item_list:
+            with timer.phase('diff'):
+                save_import_page(logger, session, new_item_list, now, changed_articles, bulk, account_id)
+            imported_item_ids.update(str(item_id) for item_id in new_item_list)
+            total_response += len(new_item_list)
+        page_offset = offset
+        offset += max(len(item_list) - page_overlap, 1)
+
+        checkpoint = checkpoints.first() or ImportCheckpoint(account_id=account_id, time_started=now)
+        checkpoint.offset = offset
+        checkpoint.since = since
+        checkpoint.total_response = total_response
+        checkpoint.changed_articles = json.dumps(changed_articles)
+        session.add(checkpoint)
+        with timer.phase('commit'):
+            session.commit()
+        if new_item_list:
+            # Only archived once committed, so a page that gets fetched again after resuming is in there once
+            archive_response('import', now, dict(response, list=new_item_list), offset=page_offset, account_id=account_id)
+        # Don't keep the articles of the pages that are done around
+        session.expunge_all()
+        debug_print('Imported ' + str(total_response) + ' items')
+
+        if len(item_list) < page_size or DEBUG:
+            # The end of the list; when debugging, limit to one page
+            break
+
+    changed_articles = get_import_changes(session, account_id, now, changed_articles)
+    report = Report(account_id=account_id, time_updated=now)
+    response['since'] = since
+    fill_report(report, response, changed_articles, total_response)
+    checkpoints.delete()
+    with timer.phase('diff'):
+        save_report(session, report, changed_articles)
+    with timer.phase('commit'):
+        session.commit()
+    # The items are already archived per page
+    archive_response('import_end', now, dict(response, list=[]), since=since, account_id=account_id)
+    return report
+
+
+def updatestats_since_last(logger, session, last_time, bulk=False, pocket_instance=None, account_id=DEFAULT_ACCOUNT_ID):
+    """
+    Get the changes of the account since last time from the Pocket API. Without last_time, the complete archive
+    is imported. How long the phases of the update took is saved as ReportTiming of the Report
+    """
+    if not pocket_instance:
+        pocket_instance = get_pocket_instance()
+    timer = SyncTimer()
+    with timer.counting_queries(session.get_bind()):
+        if last_time:
+            report = update_since(logger, session, pocket_instance, last_time, bulk=bulk, timer=timer, account_id=account_id)
+        else:
+            page_size = IMPORT_PAGE_SIZE
+            if DEBUG:
+                # When debugging, limit to 20 items
+                page_size = 20
+            report = import_all(logger, session, pocket_instance, bulk=bulk, page_size=page_size, timer=timer, account_id=account_id)
+    session.add(timer.get_report_timing(report))
+    session.commit()
+    return report
+
+
+def get_rate_limit_reset(pocket_instance):
+    """
+    Returns the seconds until the rate limit of the user or the consumer key resets, from the X-Limit-* headers
+    of the last response of pocket_instance; 0 when it doesn't tell
+    """
+    headers = getattr(pocket_instance, 'last_headers', None) or {}
+    return max(int(headers.get('X-Limit-' + limit + '-Reset', 0)) for limit in ('User', 'Key'))
+
+
+def updatestats_accounts(logger, session, accounts, bulk=False, pocket_instances=None):
+    """
+    Get the changes of all accounts (see get_accounts) since their last update. The Pocket API is queried for
+    the accounts at the same time by a pool of ACCOUNT_WORKERS threads, while the responses are saved one by
+    one in this thread as they come in. Accounts that still need their complete archive imported are done
+    after that, one by one, as an import commits per page. Returns the Reports.
+    pocket_instances is a dict of account name => Pocket client, to keep using the same clients (see the daemon);
+    by default new ones are created. When the API rate limited an account, the others are saved first, and then
+    its RateLimitException is raised, with as retry_after the seconds until the rate limits reset
+    """
+    import pocket
+
+    jobs = []
+    for account in accounts:
+        account_id = get_account_id(session, account['name'])
+        pocket_instance = pocket_instances[account['name']] if pocket_instances else get_pocket_instance(account)
+        jobs.append((account, account_id, pocket_instance, get_last_update(session, account_id), SyncTimer()))
+
+    reports = []
+    rate_limited = []
+    with concurrent.futures.ThreadPoolExecutor(max_workers=ACCOUNT_WORKERS) as executor:
+        futures = {}
+        for job in jobs:
+            account, account_id, pocket_instance, last_time, timer = job
+            if last_time:
+                futures[executor.submit(timer.fetch, pocket_instance, since=last_time, state='all', detailType='complete')] = job
+        for future in concurrent.futures.as_completed(futures):
+            account, account_id, pocket_instance, last_time, timer = futures[future]
+            try:
+                response = future.result()
+            except pocket.RateLimitException as e:
+                logger.warning('Fetching the changes of account ' + account['name'] + ' was rate limited')
+                rate_limited.append((e, pocket_instance))
+                continue
+            except Exception:
+                # Don't let one account keep the others from being saved
+                logger.exception('Fetching the changes of account ' + account['name'] + ' failed')
+                continue
+            with timer.counting_queries(session.get_bind()):
+                report = update_since(logger, session, pocket_instance, last_time, bulk=bulk, timer=timer, account_id=account_id, response=response)
+            session.add(timer.get_report_timing(report))
+            session.commit()
+            reports.append(report)
+
+    for account, account_id, pocket_instance, last_time, timer in jobs:
+        if not last_time:
+            reports.append(updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=pocket_instance, account_id=account_id))
+    # An import expunges everything from the session after every page, the Reports of the other accounts too
+    for report in reports:
+        session.add(report)
+    if rate_limited:
+        error = rate_limited[0][0]
+        error.retry_after = max(get_rate_limit_reset(pocket_instance) for e, pocket_instance in rate_limited)
+        raise error
+    return reports
+
+
+def update_since(logger, session, pocket_instance, last_time, bulk=False, timer=None, account_id=DEFAULT_ACCOUNT_ID, response=None):
+    """
+    Get the items of the account that changed since last_time from the Pocket API and save them, with their
+    Report. response can be the already fetched response of the API
+    """
+    if not timer:
+        timer = SyncTimer()
+    if response is None:
+        response = timer.fetch(pocket_instance, since=last_time, state='all', detailType='complete')
+    item_list = get_item_list(response)
+    debug_print('Number of items in reponse: ' + str(len(item_list)))
+    logger.debug('Number of items in response: %d', len(item_list))
+
+    now = datetime.datetime.now()
+    report = Report(account_id=account_id, time_updated=now)
+    changed_articles = new_changed_articles()
+
+    with timer.phase('diff'):
+        save_response_items(logger, session, item_list, now, changed_articles, bulk, account_id)
+
+    fill_report(report, response, changed_articles, len(item_list))
+    #debug_print(report.changed_articles)
+    with timer.phase('diff'):
+        save_report(session, report, changed_articles)
+
+    # Check what's pending
+    #logger.debug('About to commit to DB:')
+    #logger.debug(session.new)
+
+    # Save to DB
+    with timer.phase('commit'):
+        session.commit()
+    archive_response('update', now, response, since=last_time, account_id=account_id)
+
+    return report
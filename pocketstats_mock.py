@@ -0,0 +1,148 @@
+"""
+Local stand-in for the Pocket API, to try and test the Pocket clients offline. Serves /v3/get from a pocket
+instance like benchmark.FakePocket, gzip compressed, with X-Limit-* rate limit headers, and optionally failing
+or slow requests. Point POCKET_API_URL in settings.py (and ASYNC_CLIENT = True) at it:
+
+    python pocketstats_mock.py --size=1000 --port=8080
+    POCKET_API_URL = 'http://127.0.0.1:8080/v3'
+"""
+import gzip
+import json
+import math
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import click
+
+# Parameters of pocket.Pocket.get that are passed on to the pocket instance
+GET_PARAMETERS = ['state', 'favorite', 'tag', 'contentType', 'sort', 'detailType', 'search', 'domain', 'since', 'count', 'offset']
+
+
+class MockPocketHandler(BaseHTTPRequestHandler):
+    """
+    Answers POST /v3/get like the Pocket API does
+    """
+
+    def do_POST(self):
+        server = self.server
+        length = int(self.headers.get('Content-Length', 0))
+        payload = json.loads(self.rfile.read(length).decode('utf-8') or '{}')
+        if self.path != '/v3/get':
+            self.send_error(404)
+            return
+        if not payload.get('consumer_key') or not payload.get('access_token'):
+            self.send_pocket_error(401, 'Missing consumer key or access token')
+            return
+
+        with server.lock:
+            server.nr_requests += 1
+            failure = server.failures.pop(0) if server.failures else None
+            rate_limited = False
+            if server.rate_limit is not None:
+                now = time.time()
+                if now >= server.window_start + server.reset:
+                    # The rate limit resets: a new window with all requests available again
+                    server.window_start = now
+                    server.remaining = server.rate_limit
+                rate_limited = server.remaining <= 0
+                server.remaining = max(server.remaining - 1, 0)
+        if server.delay:
+            time.sleep(server.delay)
+        if rate_limited:
+            self.send_pocket_error(403, 'User was rate limited')
+            return
+        if failure:
+            self.send_pocket_error(failure, 'Failing on purpose')
+            return
+
+        with server.lock:
+            response = server.pocket.get(**dict((key, payload[key]) for key in GET_PARAMETERS if key in payload))[0]
+        body = json.dumps(response).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        if 'gzip' in self.headers.get('Accept-Encoding', ''):
+            body = gzip.compress(body)
+            self.send_header('Content-Encoding', 'gzip')
+        self.send_header('Content-Length', str(len(body)))
+        self.send_limit_headers()
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            # The client gave up on the request, e.g. a page it fetched ahead that turned out not to be needed
+            pass
+
+    def send_pocket_error(self, status, error):
+        self.send_response(status)
+        self.send_header('X-Error', error)
+        self.send_header('Content-Length', '0')
+        self.send_limit_headers()
+        self.end_headers()
+
+    def send_limit_headers(self):
+        server = self.server
+        if server.rate_limit is None:
+            return
+        self.send_header('X-Limit-User-Limit', str(server.rate_limit))
+        self.send_header('X-Limit-User-Remaining', str(server.remaining))
+        # Seconds until the current window ends
+        self.send_header('X-Limit-User-Reset', str(max(int(math.ceil(server.window_start + server.reset - time.time())), 0)))
+
+    def log_message(self, format, *args):
+        pass
+
+
+def make_server(pocket_instance, host='127.0.0.1', port=0, failures=None, rate_limit=None, reset=3600, delay=0):
+    """
+    Returns a ThreadingHTTPServer for the mock API of pocket_instance; port 0 picks a free one, see
+    server.server_address. failures is a list of HTTP statuses to answer the first requests with, rate_limit the
+    number of requests per window of reset seconds, after which every request is rate limited until the window
+    ends, and delay the seconds every request takes
+    """
+    server = ThreadingHTTPServer((host, port), MockPocketHandler)
+    server.pocket = pocket_instance
+    server.lock = threading.Lock()
+    server.nr_requests = 0
+    server.failures = list(failures or [])
+    server.rate_limit = rate_limit
+    server.remaining = rate_limit
+    server.reset = reset
+    server.window_start = time.time()
+    server.delay = delay
+    return server
+
+
+def start_server(pocket_instance, **kwargs):
+    """
+    Start make_server(pocket_instance, **kwargs) in a thread; returns the server and the API URL to use
+    """
+    server = make_server(pocket_instance, **kwargs)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    host, port = server.server_address[:2]
+    return server, 'http://' + host + ':' + str(port) + '/v3'
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', help='Address to listen on')
+@click.option('--port', default=8080, help='Port to listen on')
+@click.option('--size', default=1000, help='Number of items in the synthetic archive')
+@click.option('--delay', default=0.0, help='Seconds every request takes')
+@click.option('--rate-limit', type=int, default=None, help='Number of requests per hour before being rate limited')
+def mock(host, port, size, delay, rate_limit):
+    """
+    Serve a synthetic Pocket archive (see benchmark.FakePocket) as the Pocket API
+    """
+    from benchmark import FakePocket
+
+    server = make_server(FakePocket(size), host, port, rate_limit=rate_limit, delay=delay)
+    click.echo('Pocket API for ' + str(size) + ' items on http://' + host + ':' + str(port) + '/v3')
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+if __name__ == '__main__':
+    mock()
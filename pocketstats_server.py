@@ -0,0 +1,143 @@
+"""
+Read-only HTTP endpoint with the stats of pocketstats, as JSON and as Prometheus metrics, for dashboards.
+The stats come from the rollup and the reports, and are cached until a new Report appears
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from sqlalchemy import func
+
+import pocketstats_core as core
+from pocketstats_core import Account, DailyStats, Report, date_part
+
+# Every article has exactly one of these statuses
+ARTICLE_STATUSES = ['unread', 'read', 'deleted']
+REPORT_COUNTERS = ['total_response', 'nr_added', 'nr_read', 'nr_deleted', 'nr_favourited', 'nr_updated']
+
+
+def get_stats(session):
+    """
+    Returns a dict with the totals, the articles added and read per month, and the latest Report
+    """
+    stats = {'totals': core.get_rollup_totals(session), 'per_month': [], 'last_report': None}
+
+    known_days = session.query(DailyStats).filter(DailyStats.day != core.UNKNOWN_DAY)
+    year = date_part('year', DailyStats.day).label('year')
+    month = date_part('month', DailyStats.day).label('month')
+    per_month = known_days.with_entities(year, month, func.sum(DailyStats.added), func.sum(DailyStats.read)).group_by('year', 'month').order_by('year', 'month')
+    for year, month, added, read in per_month:
+        stats['per_month'].append({'month': '{:04d}-{:02d}'.format(int(year), int(month)), 'added': added or 0, 'read': read or 0})
+
+    last_report = session.query(Report, Account.name).outerjoin(Account, Account.id == Report.account_id).order_by(Report.id.desc()).first()
+    if last_report:
+        report, account_name = last_report
+        stats['last_report'] = dict((counter, getattr(report, counter)) for counter in REPORT_COUNTERS)
+        stats['last_report'].update({
+            'id': report.id,
+            'account': account_name,
+            'time_updated': report.time_updated.strftime('%Y-%m-%d %H:%M:%S'),
+            'timestamp': time.mktime(report.time_updated.timetuple()),
+            'net_result': report.net_result,
+        })
+    return stats
+
+
+def get_metrics(stats):
+    """
+    Returns the stats in the Prometheus text format. The articles per month are left to the JSON, as a label per
+    month would be a new time series every month
+    """
+    totals = stats['totals']
+    lines = [
+        '# HELP pocketstats_articles Number of articles per status',
+        '# TYPE pocketstats_articles gauge',
+    ]
+    # The statuses partition the articles, so the series sum up to pocketstats_articles_all
+    for status in ARTICLE_STATUSES:
+        lines.append('pocketstats_articles{status="' + status + '"} ' + str(totals[status]))
+    lines.append('# HELP pocketstats_articles_all Number of articles, of any status')
+    lines.append('# TYPE pocketstats_articles_all gauge')
+    lines.append('pocketstats_articles_all ' + str(totals['total']))
+    lines.append('# HELP pocketstats_articles_favourited Number of favourited articles, of any status')
+    lines.append('# TYPE pocketstats_articles_favourited gauge')
+    lines.append('pocketstats_articles_favourited ' + str(totals['favourited']))
+    report = stats['last_report']
+    if report:
+        lines.append('# HELP pocketstats_last_report_timestamp_seconds Time of the last update')
+        lines.append('# TYPE pocketstats_last_report_timestamp_seconds gauge')
+        lines.append('pocketstats_last_report_timestamp_seconds ' + str(report['timestamp']))
+        lines.append('# HELP pocketstats_last_report_items Number of items in the last update, per kind of change')
+        lines.append('# TYPE pocketstats_last_report_items gauge')
+        for counter in REPORT_COUNTERS:
+            lines.append('pocketstats_last_report_items{counter="' + counter + '"} ' + str(report[counter]))
+    return '\n'.join(lines) + '\n'
+
+
+class StatsCache(object):
+    """
+    Keeps the stats, and their JSON and Prometheus renderings, until the id of the latest Report changes
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.report_id = None
+        self.rendered = None
+
+    def get(self):
+        """
+        Returns (JSON, Prometheus text) of the current stats; only queries the latest report id when cached
+        """
+        session = core.get_db_connection()
+        try:
+            report_id = session.query(func.max(Report.id)).scalar()
+            with self.lock:
+                if self.rendered is None or report_id != self.report_id:
+                    stats = get_stats(session)
+                    self.rendered = (json.dumps(stats), get_metrics(stats))
+                    self.report_id = report_id
+                return self.rendered
+        finally:
+            session.close()
+
+
+class StatsHandler(BaseHTTPRequestHandler):
+    """
+    Serves /stats.json (also on /) and /metrics from the StatsCache of the server
+    """
+
+    def do_GET(self):
+        path = self.path.split('?')[0]
+        if path in ('/', '/stats.json'):
+            content_type = 'application/json'
+            body = self.server.cache.get()[0]
+        elif path == '/metrics':
+            content_type = 'text/plain; version=0.0.4'
+            body = self.server.cache.get()[1]
+        else:
+            self.send_error(404)
+            return
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.logger:
+            self.server.logger.debug(self.address_string() + ' - ' + format % args)
+
+
+def serve(host, port, logger=None):
+    """
+    Serve the stats on host:port until interrupted
+    """
+    server = ThreadingHTTPServer((host, port), StatsHandler)
+    server.cache = StatsCache()
+    server.logger = logger
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
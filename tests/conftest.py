@@ -0,0 +1,83 @@
+"""
+Fixtures for the tests: a fresh database per test, and the synthetic Pocket archive of benchmark.FakePocket.
+Every test that uses the database runs on SQLite and on PostgreSQL. For PostgreSQL, set
+POCKETSTATS_TEST_POSTGRESQL_URL to a database the tests may empty, or have initdb and pg_ctl on the PATH for a
+throwaway server; without either (or psycopg2), those tests are skipped
+"""
+import logging
+import os
+import shutil
+import socket
+import subprocess
+
+import pytest
+
+import pocketstats_core as core
+
+DATABASES = ['sqlite', 'postgresql']
+
+
+def get_free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope='session')
+def postgresql_url(tmp_path_factory):
+    """
+    URL of the PostgreSQL database of the tests: POCKETSTATS_TEST_POSTGRESQL_URL, or a server of its own
+    """
+    pytest.importorskip('psycopg2')
+    url = os.environ.get('POCKETSTATS_TEST_POSTGRESQL_URL')
+    if url:
+        yield url
+        return
+    initdb = shutil.which('initdb')
+    if not initdb:
+        pytest.skip('No PostgreSQL: set POCKETSTATS_TEST_POSTGRESQL_URL, or put initdb and pg_ctl on the PATH')
+    if hasattr(os, 'geteuid') and os.geteuid() == 0:
+        pytest.skip('No PostgreSQL: initdb does not run as root, set POCKETSTATS_TEST_POSTGRESQL_URL')
+    pg_ctl = os.path.join(os.path.dirname(initdb), 'pg_ctl')
+    data_dir = str(tmp_path_factory.mktemp('postgresql'))
+    port = get_free_port()
+    subprocess.run([initdb, '-D', data_dir, '-A', 'trust', '-U', 'pocketstats'], check=True, stdout=subprocess.DEVNULL)
+    options = '-p {} -k {} -c listen_addresses=127.0.0.1 -c fsync=off'.format(port, data_dir)
+    subprocess.run([pg_ctl, '-D', data_dir, '-o', options, '-l', os.path.join(data_dir, 'server.log'), '-w', 'start'], check=True, stdout=subprocess.DEVNULL)
+    try:
+        yield 'postgresql://pocketstats@127.0.0.1:{}/postgres'.format(port)
+    finally:
+        subprocess.run([pg_ctl, '-D', data_dir, '-m', 'fast', '-w', 'stop'], stdout=subprocess.DEVNULL)
+
+
+@pytest.fixture(params=DATABASES)
+def db_url(request, tmp_path, monkeypatch):
+    """
+    URL of a fresh database, which is the configured one (core.DATABASE_URL) during the test
+    """
+    if request.param == 'sqlite':
+        url = 'sqlite:///' + str(tmp_path / 'pocketstats.db')
+    else:
+        url = request.getfixturevalue('postgresql_url')
+        # Empty what the previous test left behind
+        core.Base.metadata.drop_all(core.get_db_engine(url))
+    monkeypatch.setattr(core, 'DATABASE_URL', url)
+    # Next to the SQLite file anyway, but not in the working directory for a database server
+    monkeypatch.setattr(core, 'ARCHIVE_FILENAME', str(tmp_path / 'pocketstats.archive'))
+    core._create_tables(url)
+    yield url
+    core.get_db_engine(url).dispose()
+    del core._engines[url]
+    del core._sessionmakers[url]
+
+
+@pytest.fixture
+def session(db_url):
+    session = core.get_db_connection(url=db_url)
+    yield session
+    session.close()
+
+
+@pytest.fixture
+def logger():
+    return logging.getLogger('pocketstats.tests')
@@ -0,0 +1,85 @@
+"""
+Updating several accounts at once, as the daemon does with --all
+"""
+import pocket
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats import get_next_interval, get_selected_accounts
+from pocketstats_core import Report
+
+ACCOUNTS = [{'name': 'alice'}, {'name': 'bob'}]
+
+
+class RateLimitedPocket(FakePocket):
+    """
+    FakePocket whose requests are rate limited while rate_limited is set, with reset as X-Limit-User-Reset
+    """
+
+    def __init__(self, nr_items, reset=1800):
+        FakePocket.__init__(self, nr_items)
+        self.rate_limited = False
+        self.reset = reset
+        self.last_headers = {}
+
+    def get(self, **kwargs):
+        if self.rate_limited:
+            self.last_headers = {'X-Limit-User-Remaining': '0', 'X-Limit-User-Reset': str(self.reset)}
+            raise pocket.RateLimitException('User was rate limited')
+        self.last_headers = {'X-Limit-User-Remaining': '9999', 'X-Limit-User-Reset': '3600'}
+        return FakePocket.get(self, **kwargs)
+
+
+def fail_get_pocket_instance(account):
+    raise AssertionError('A Pocket client was created for ' + account['name'])
+
+
+def test_updatestats_accounts_rate_limited(session, logger, monkeypatch):
+    pocket_instances = {'alice': RateLimitedPocket(200), 'bob': RateLimitedPocket(300)}
+    # The clients that are passed in are used, instead of new ones every update
+    monkeypatch.setattr(core, 'get_pocket_instance', fail_get_pocket_instance)
+
+    reports = core.updatestats_accounts(logger, session, ACCOUNTS, pocket_instances=pocket_instances)
+    assert [report.nr_added for report in reports] == [200, 300]
+
+    for fake_pocket in pocket_instances.values():
+        fake_pocket.advance()
+    pocket_instances['alice'].rate_limited = True
+    with pytest.raises(pocket.RateLimitException) as excinfo:
+        core.updatestats_accounts(logger, session, ACCOUNTS, pocket_instances=pocket_instances)
+    assert excinfo.value.retry_after == 1800
+
+    # The account that wasn't rate limited is saved all the same
+    bob_id = core.get_account_id(session, 'bob')
+    alice_id = core.get_account_id(session, 'alice')
+    session.commit()
+    assert session.query(Report).filter(Report.account_id == bob_id).count() == 2
+    assert session.query(Report).filter(Report.account_id == alice_id).count() == 1
+    assert core.get_last_update(session, bob_id) == pocket_instances['bob'].since
+
+    # The daemon waits for the reset instead of its regular interval
+    assert get_next_interval(300, 0, excinfo.value.retry_after) >= 1800
+
+
+def test_get_rate_limit_reset():
+    assert core.get_rate_limit_reset(object()) == 0
+    fake_pocket = RateLimitedPocket(10, reset=42)
+    fake_pocket.rate_limited = True
+    with pytest.raises(pocket.RateLimitException):
+        fake_pocket.get()
+    assert core.get_rate_limit_reset(fake_pocket) == 42
+
+
+def test_get_selected_accounts(session, monkeypatch):
+    engine = session.get_bind()
+    monkeypatch.setattr(core, 'get_accounts', lambda: ACCOUNTS)
+    assert get_selected_accounts(engine, None, False) == ACCOUNTS[:1]
+    assert get_selected_accounts(engine, None, True) == ACCOUNTS
+    assert get_selected_accounts(engine, 'bob', False) == ACCOUNTS[1:]
+    with pytest.raises(SystemExit):
+        get_selected_accounts(engine, 'carol', True)
+
+    core.set_schema_version(engine, core.SCHEMA_VERSION - 1)
+    with pytest.raises(SystemExit):
+        get_selected_accounts(engine, None, True)
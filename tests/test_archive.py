@@ -0,0 +1,78 @@
+"""
+The archive of Pocket API responses, and rebuilding the database from it with replay
+"""
+import pytest
+from click.testing import CliRunner
+
+import pocketstats
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_core import Article
+
+MEMORY_URL = 'sqlite://'
+
+
+@pytest.fixture
+def other_session(tmp_path):
+    """
+    Session on a second, empty SQLite database
+    """
+    url = 'sqlite:///' + str(tmp_path / 'replayed.db')
+    core._create_tables(url)
+    session = core.get_db_connection(url=url)
+    yield session
+    session.close()
+    core.get_db_engine(url).dispose()
+    del core._engines[url]
+    del core._sessionmakers[url]
+
+
+def run_updates(logger, session, bulk=False):
+    fake_pocket = FakePocket(250)
+    core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+    for _ in range(2):
+        fake_pocket.advance(read_ratio=0.1, delete_ratio=0.02, favourite_ratio=0.05, add_ratio=0.05)
+        core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_replay_archive(session, other_session, logger, monkeypatch, bulk):
+    monkeypatch.setattr(core, 'IMPORT_PAGE_SIZE', 100)
+    run_updates(logger, session, bulk=bulk)
+
+    records = list(core.read_archive())
+    assert [record['kind'] for record in records] == ['import'] * 3 + ['import_end', 'update', 'update']
+
+    assert core.replay_archive(logger, other_session, records, bulk=not bulk) == 3
+    assert core.compare_databases(session, other_session) == ([], [])
+
+
+def test_read_archive_cut_off(session, logger):
+    run_updates(logger, session)
+    nr_records = len(list(core.read_archive()))
+    with open(core.get_archive_filename(), 'ab') as archive:
+        # The start of a record that didn't get written completely
+        archive.write(core.ARCHIVE_HEADER.pack(1000) + b'x' * 10)
+    assert len(list(core.read_archive())) == nr_records
+
+
+def test_replay_verify(session, logger, tmp_path, monkeypatch):
+    # The log file goes to the working directory
+    monkeypatch.chdir(tmp_path)
+    run_updates(logger, session)
+    runner = CliRunner()
+    try:
+        result = runner.invoke(pocketstats.cli, ['replay', '--verify'])
+        assert result.exit_code == 0, result.output
+        assert 'Articles that differ: 0' in result.output
+        assert 'Reports that differ: 0' in result.output
+
+        article = session.query(Article).filter(Article.status == 0).first()
+        article.word_count += 1
+        session.commit()
+        result = runner.invoke(pocketstats.cli, ['replay', '--verify'])
+        assert result.exit_code == 1
+        assert 'Articles that differ: 1' in result.output
+    finally:
+        core._engines.pop(MEMORY_URL, None)
+        core._sessionmakers.pop(MEMORY_URL, None)
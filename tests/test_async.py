@@ -0,0 +1,135 @@
+"""
+The asyncio Pocket client against the mock Pocket API of pocketstats_mock
+"""
+import datetime
+import time
+import types
+
+import pocket
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_mock import start_server
+
+# Needs aiohttp
+pocketstats_async = pytest.importorskip('pocketstats_async')
+
+
+@pytest.fixture
+def mock_api():
+    """
+    Returns a function that starts the mock API for a pocket instance and returns (server, SyncPocket client)
+    """
+    servers = []
+    clients = []
+
+    def start(pocket_instance, page_overlap=0, **kwargs):
+        server, url = start_server(pocket_instance, **kwargs)
+        servers.append(server)
+        clients.append(pocketstats_async.SyncPocket('consumer_key', 'access_token', api_url=url, page_overlap=page_overlap))
+        return server, clients[-1]
+
+    yield start
+    for client in clients:
+        client.close()
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def test_retry_server_errors(mock_api, monkeypatch):
+    monkeypatch.setattr(pocketstats_async, 'RETRY_BACKOFF', 0.01)
+    server, client = mock_api(FakePocket(10), failures=[502, 503])
+    response, headers = client.get(state='all')
+    assert len(response['list']) == 10
+    assert server.nr_requests == 3
+
+
+def test_retries_run_out(mock_api, monkeypatch):
+    monkeypatch.setattr(pocketstats_async, 'RETRY_BACKOFF', 0.01)
+    server, client = mock_api(FakePocket(10), failures=[503] * (pocketstats_async.REQUEST_RETRIES + 1))
+    with pytest.raises(pocket.ServerMaintenanceException):
+        client.get(state='all')
+    assert server.nr_requests == pocketstats_async.REQUEST_RETRIES + 1
+
+
+@pytest.mark.parametrize('reset', [1, 2])
+def test_rate_limit(mock_api, monkeypatch, reset):
+    # Waits for a rate limit that resets within RATE_LIMIT_MAX_WAIT, and raises right away when it takes longer
+    monkeypatch.setattr(pocketstats_async, 'RATE_LIMIT_MAX_WAIT', 1)
+    server, client = mock_api(FakePocket(10), rate_limit=1, reset=reset)
+    client.get(state='all')
+
+    start = time.time()
+    if reset <= pocketstats_async.RATE_LIMIT_MAX_WAIT:
+        response, headers = client.get(state='all')
+        assert len(response['list']) == 10
+        assert time.time() - start > 0.5
+        assert server.nr_requests == 2
+    else:
+        with pytest.raises(pocket.RateLimitException):
+            client.get(state='all')
+        assert time.time() - start < 0.5
+        # The client knew from the headers of the first response that there was no use in trying
+        assert server.nr_requests == 1
+
+
+@pytest.mark.parametrize('reset', [1, 2])
+def test_rate_limited_response(mock_api, monkeypatch, reset):
+    # Another client used up the rate limit, so this one only finds out from the 403 response
+    monkeypatch.setattr(pocketstats_async, 'RATE_LIMIT_MAX_WAIT', 1)
+    server, client = mock_api(FakePocket(10), rate_limit=1, reset=reset)
+    client.get(state='all')
+    other_client = pocketstats_async.SyncPocket('consumer_key', 'access_token', api_url=client.client.api_url)
+    try:
+        if reset <= pocketstats_async.RATE_LIMIT_MAX_WAIT:
+            response, headers = other_client.get(state='all')
+            assert len(response['list']) == 10
+            assert server.nr_requests == 3
+        else:
+            with pytest.raises(pocket.RateLimitException):
+                other_client.get(state='all')
+            assert server.nr_requests == 2
+            assert core.get_rate_limit_reset(other_client) == reset
+    finally:
+        other_client.close()
+
+
+class FrozenDatetime(datetime.datetime):
+    """
+    datetime whose now() is always the same, so two databases get the same firstseen_time and Report times
+    """
+
+    @classmethod
+    def now(cls, tz=None):
+        return datetime.datetime(2020, 1, 1, 12)
+
+
+def test_import_same_as_fake_pocket(mock_api, session, logger, tmp_path, monkeypatch):
+    monkeypatch.setattr(core, 'datetime', types.SimpleNamespace(datetime=FrozenDatetime, date=datetime.date, timedelta=datetime.timedelta))
+    monkeypatch.setattr(core, 'IMPORT_PAGE_SIZE', 100)
+    # The same synthetic archive twice: one behind the mock API, the other used directly
+    served_pocket = FakePocket(1050)
+    fake_pocket = FakePocket(1050)
+    server, client = mock_api(served_pocket, page_overlap=core.IMPORT_PAGE_OVERLAP)
+
+    other_url = 'sqlite:///' + str(tmp_path / 'other.db')
+    core._create_tables(other_url)
+    other_session = core.get_db_connection(url=other_url)
+    try:
+        for pocket_instance, db_session in ((client, session), (fake_pocket, other_session)):
+            report = core.updatestats_since_last(logger, db_session, None, pocket_instance=pocket_instance)
+            assert report.nr_added == 1050
+        for pocket_instance in (served_pocket, fake_pocket):
+            pocket_instance.advance(read_ratio=0.1, delete_ratio=0.02, favourite_ratio=0.05, add_ratio=0.03)
+        for pocket_instance, db_session in ((client, session), (fake_pocket, other_session)):
+            core.updatestats_since_last(logger, db_session, core.get_last_update(db_session), pocket_instance=pocket_instance)
+
+        assert core.compare_databases(session, other_session) == ([], [])
+        assert session.query(core.Article).count() == 1050 + 31
+    finally:
+        other_session.close()
+        core.get_db_engine(other_url).dispose()
+        del core._engines[other_url]
+        del core._sessionmakers[other_url]
@@ -0,0 +1,55 @@
+"""
+Skipping articles that didn't change, by the hash of their Pocket item
+"""
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_core import Article
+
+
+def get_response(fake_pocket, item_list):
+    return {'status': 1, 'complete': 1, 'error': None, 'since': fake_pocket.since, 'list': item_list}
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_same_item_at_other_position_is_skipped(session, logger, bulk):
+    fake_pocket = FakePocket(50)
+    core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+    item_id = '10'
+    item = fake_pocket.get(state='all', detailType='complete')[0]['list'][item_id]
+    saved = session.query(Article.sort_id, Article.content_hash).filter(Article.item_id == item_id).one()
+
+    # The same item as the first one in a response
+    response = get_response(fake_pocket, {item_id: dict(item, sort_id=0)})
+    report = core.update_since(logger, session, fake_pocket, core.get_last_update(session), bulk=bulk, response=response)
+    assert report.nr_updated == 0
+    assert session.query(Article.sort_id, Article.content_hash).filter(Article.item_id == item_id).one() == saved
+
+    # An actual change
+    response = get_response(fake_pocket, {item_id: dict(item, sort_id=0, resolved_title='Changed')})
+    report = core.update_since(logger, session, fake_pocket, core.get_last_update(session), bulk=bulk, response=response)
+    assert report.nr_updated == 1
+    assert session.query(Article.resolved_title).filter(Article.item_id == item_id).scalar() == 'Changed'
+
+
+def test_content_hash_leaves_out_response_keys():
+    item = {'item_id': '1', 'sort_id': 3, 'resolved_title': 'Title', 'status': '0'}
+    assert core.get_content_hash(item) == core.get_content_hash(dict(item, sort_id=0))
+    assert core.get_content_hash(item) != core.get_content_hash(dict(item, status='1'))
+
+
+def test_migration_clears_content_hash(session, logger):
+    fake_pocket = FakePocket(20)
+    core.updatestats_since_last(logger, session, None, pocket_instance=fake_pocket)
+    session.close()
+    engine = core.get_db_engine()
+    core.set_schema_version(engine, 11)
+
+    assert core.migrate_db(engine) == [(12, core.MIGRATIONS[-1][1])]
+    assert session.query(Article).filter(Article.content_hash.isnot(None)).count() == 0
+    # Without a hash, the articles are compared by their time_updated
+    item_list = fake_pocket.get(state='all', detailType='complete', sort='newest')[0]['list']
+    report = core.update_since(logger, session, fake_pocket, core.get_last_update(session), response=get_response(fake_pocket, item_list))
+    assert report.nr_updated == 0
+    assert session.query(Article).filter(Article.content_hash.is_(None)).count() == 0
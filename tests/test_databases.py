@@ -0,0 +1,224 @@
+"""
+The SQL that differs between SQLite and PostgreSQL; these run on both, see conftest
+"""
+import datetime
+import json
+import threading
+import time
+
+import pytest
+from sqlalchemy import Column, DateTime, Integer, MetaData, String, Table, Text, inspect
+
+import pocketstats_core as core
+import pocketstats_server as server
+from benchmark import FakePocket
+from pocketstats_core import Account, Article, ArticleEvent, ArticleTag, DailyStats, Report
+
+
+def test_bulk_upserts(session, logger):
+    # The Pocket API gives every value as a string, which the upsert binds to the Integer and BigInteger columns
+    fake_pocket = FakePocket(300)
+    core.updatestats_since_last(logger, session, None, bulk=True, pocket_instance=fake_pocket)
+    fake_pocket.advance(read_ratio=0.2, delete_ratio=0.05, favourite_ratio=0.1, add_ratio=0.05)
+    report = core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=True, pocket_instance=fake_pocket)
+    assert report.nr_read > 0 and report.nr_added > 0
+
+    rows = dict((str(row.item_id), row) for row in session.query(Article.item_id, Article.resolved_id, Article.status, Article.favorite, Article.word_count))
+    assert set(rows) == set(fake_pocket.items)
+    for item_id, item in fake_pocket.items.items():
+        row = rows[item_id]
+        assert row.status == int(item['status'])
+        if 'resolved_id' in item:
+            assert (row.resolved_id, row.favorite, row.word_count) == (int(item['resolved_id']), int(item['favorite']), int(item['word_count']))
+
+
+def test_reset_id_sequence(session, logger, monkeypatch):
+    # The default account is inserted with its id by _create_tables, and replayed accounts keep theirs, so new
+    # accounts can only get the next id when the sequence was set past them
+    assert core.get_account_id(session, 'alice') == core.DEFAULT_ACCOUNT_ID + 1
+    now = datetime.datetime(2020, 1, 1)
+    core.replay_archive(logger, session, [{'kind': 'account', 'now': now, 'response': {'id': 7, 'name': 'bob'}}])
+    assert core.get_account_id(session, 'carol') == 8
+    assert [name for name, in session.query(Account.name).order_by(Account.id)] == [core.DEFAULT_ACCOUNT_NAME, 'alice', 'bob', 'carol']
+
+
+def test_date_part(session, logger):
+    fake_pocket = FakePocket(500)
+    core.updatestats_since_last(logger, session, None, pocket_instance=fake_pocket)
+
+    expected = {}
+    for day, added in session.query(DailyStats.day, DailyStats.added).filter(DailyStats.day != core.UNKNOWN_DAY):
+        month = day.strftime('%Y-%m')
+        expected[month] = expected.get(month, 0) + added
+    per_month = server.get_stats(session)['per_month']
+    assert [month['month'] for month in per_month] == sorted(expected)
+    assert dict((month['month'], month['added']) for month in per_month) == expected
+
+
+def test_epoch(session, logger):
+    analytics = pytest.importorskip('pocketstats_analytics')
+    fake_pocket = FakePocket(200)
+    core.updatestats_since_last(logger, session, None, pocket_instance=fake_pocket)
+
+    with session.get_bind().connect() as connection:
+        columns = analytics.load_columns(connection, keys=['item_id', 'time_updated', 'time_read'])
+    for item_id, time_updated, time_read in zip(columns['item_id'], columns['time_updated'], columns['time_read']):
+        item = fake_pocket.items[str(item_id)]
+        assert time_updated == int(item['time_updated'])
+        assert time_read == int(item.get('time_read', 0))
+
+
+def test_migrate_db_vacuums(session, logger):
+    engine = session.get_bind()
+    core.updatestats_since_last(logger, session, None, pocket_instance=FakePocket(100))
+    session.close()
+
+    core.set_schema_version(engine, core.SCHEMA_VERSION - 1)
+    applied = core.migrate_db(engine)
+    assert [version for version, description in applied] == [core.SCHEMA_VERSION]
+    assert core.get_schema_version(engine) == core.SCHEMA_VERSION
+    # Nothing left to apply, so no VACUUM either
+    assert core.migrate_db(engine) == []
+    core.vacuum_db(engine)
+
+
+def test_concurrent_rollup_updates(db_url):
+    # Two updates that add to the same days at the same time, the first of which adds the day
+    day = datetime.date(2020, 1, 1)
+    rollup_deltas = core.new_rollup_deltas()
+    rollup_deltas[day]['added'] = 1
+    rollup_deltas[day]['read'] = 2
+    errors = []
+
+    def apply_other():
+        other_session = core.get_db_connection(url=db_url)
+        try:
+            core.apply_rollup_deltas(other_session, rollup_deltas)
+            other_session.commit()
+        except Exception as e:
+            errors.append(e)
+        finally:
+            other_session.close()
+
+    session = core.get_db_connection(url=db_url)
+    for _ in range(2):
+        core.apply_rollup_deltas(session, rollup_deltas)
+        session.flush()
+        thread = threading.Thread(target=apply_other)
+        thread.start()
+        # The other update waits for this one
+        time.sleep(0.3)
+        session.commit()
+        thread.join()
+    assert errors == []
+    daily_stats = session.query(DailyStats).filter(DailyStats.day == day).one()
+    assert (daily_stats.added, daily_stats.read, daily_stats.deleted) == (4, 8, 0)
+    session.close()
+
+
+def get_daily_stats(session):
+    return sorted((row.day, row.added, row.read, row.deleted, row.favourited) for row in session.query(DailyStats))
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_rollups_match_rebuild(session, logger, bulk):
+    fake_pocket = FakePocket(400)
+    core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+    for _ in range(3):
+        fake_pocket.advance(read_ratio=0.1, delete_ratio=0.05, favourite_ratio=0.05, add_ratio=0.05)
+        core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+    # Read articles that are deleted afterwards
+    fake_pocket.since += 60
+    for item_id in [item_id for item_id, item in fake_pocket.items.items() if item['status'] == '1'][:10]:
+        fake_pocket.items[item_id] = {'item_id': item_id, 'status': '2'}
+        fake_pocket.changed_at[item_id] = fake_pocket.since
+    core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+    maintained = get_daily_stats(session)
+    assert sum(row[3] for row in maintained) > 0
+
+    core.rebuild_rollups(session.connection())
+    session.commit()
+    # The days that dropped to zero stay in the rollup, rebuild_rollups leaves them out
+    assert [row for row in maintained if row[1:] != (0, 0, 0, 0)] == get_daily_stats(session)
+
+
+def create_baseline_tables(engine):
+    """
+    The article and report tables of the first version of pocketstats, before there were migrations
+    """
+    metadata = MetaData()
+    Table(
+        'article', metadata,
+        Column('id', Integer, primary_key=True),
+        *[Column(name, Integer) for name in ('sort_id', 'item_id', 'resolved_id', 'favorite', 'status', 'firstseen_status', 'is_article', 'has_image', 'has_video', 'word_count')]
+        + [Column(name, String) for name in ('given_url', 'resolved_url', 'given_title', 'resolved_title')]
+        + [Column(name, Text) for name in ('excerpt', 'tags', 'authors', 'images', 'videos')]
+        + [Column(name, DateTime) for name in ('firstseen_time', 'firstseen_time_updated', 'time_updated', 'time_favorited', 'time_read')]
+    )
+    Table(
+        'report', metadata,
+        Column('id', Integer, primary_key=True),
+        *[Column(name, DateTime) for name in ('time_updated', 'time_since')]
+        + [Column(name, Integer) for name in ('time_since_unix', 'total_response', 'nr_added', 'nr_read', 'nr_deleted', 'nr_favourited', 'nr_updated', 'status', 'complete')]
+        + [Column(name, Text) for name in ('error', 'changed_articles')]
+    )
+    metadata.create_all(engine)
+    return metadata.tables
+
+
+def get_schema(engine):
+    """
+    Returns {table: (column names, index names)} of the database, without the full-text search tables
+    """
+    inspector = inspect(engine)
+    schema = {}
+    for table in inspector.get_table_names():
+        if not table.startswith('article_fts'):
+            schema[table] = (sorted(column['name'] for column in inspector.get_columns(table)), sorted(index['name'] for index in inspector.get_indexes(table)))
+    return schema
+
+
+def test_migrate_from_baseline(db_url, tmp_path):
+    engine = core.get_db_engine(db_url)
+    expected_schema = get_schema(engine)
+    core.Base.metadata.drop_all(engine)
+    if engine.dialect.name == 'sqlite':
+        engine.execute('DROP TABLE IF EXISTS article_fts')
+    tables = create_baseline_tables(engine)
+    time_read = datetime.datetime(2016, 3, 4, 5, 6, 7)
+    authors = {'1': {'author_id': '1', 'item_id': '11', 'name': 'Ada'}}
+    engine.execute(tables['article'].insert(), [
+        {'item_id': 11, 'resolved_id': 11, 'resolved_title': 'Read one', 'status': 1, 'firstseen_status': 0, 'favorite': 1,
+         'word_count': 900, 'tags': json.dumps({'python': {}, 'sql': {}}), 'authors': json.dumps(authors),
+         'firstseen_time_updated': datetime.datetime(2016, 1, 2), 'time_updated': time_read, 'time_favorited': time_read, 'time_read': time_read},
+        {'item_id': 12, 'resolved_id': 12, 'resolved_title': 'Unread one', 'status': 0, 'firstseen_status': 0, 'favorite': 0,
+         'word_count': 300, 'tags': None, 'authors': None, 'firstseen_time_updated': datetime.datetime(2016, 2, 3),
+         'time_updated': datetime.datetime(2016, 2, 3), 'time_favorited': None, 'time_read': None},
+    ])
+    engine.execute(tables['report'].insert(), {
+        'time_updated': time_read, 'time_since_unix': 1457067967, 'total_response': 2, 'nr_added': 2, 'nr_read': 1, 'nr_deleted': 0,
+        'nr_favourited': 1, 'nr_updated': 0, 'changed_articles': json.dumps({'added': ['11', '12'], 'read': ['11'], 'favourited': ['11']}),
+    })
+
+    applied = core.migrate_db(engine)
+
+    assert [version for version, description in applied] == [version for version, description, migration in core.MIGRATIONS]
+    assert get_schema(engine) == expected_schema
+    session = core.get_db_connection(url=db_url)
+    try:
+        articles = session.query(Article).order_by(Article.item_id).all()
+        assert [(article.item_id, article.account_id, article.resolved_title, article.status) for article in articles] == [
+            (11, core.DEFAULT_ACCOUNT_ID, 'Read one', 1), (12, core.DEFAULT_ACCOUNT_ID, 'Unread one', 0)]
+        assert articles[0].get_authors() == authors
+        assert sorted(session.query(ArticleTag.item_id, ArticleTag.tag)) == [(11, 'python'), (11, 'sql')]
+        assert core.get_rollup_totals(session) == {'total': 2, 'read': 1, 'deleted': 0, 'favourited': 1, 'unread': 1}
+        report = session.query(Report).one()
+        assert report.changed_articles is None
+        events = session.query(ArticleEvent.item_id, ArticleEvent.event_type).filter(ArticleEvent.report_id == report.id)
+        assert sorted(events) == [(11, 'added'), (11, 'favourited'), (11, 'read'), (12, 'added')]
+        # A new account gets the id after the default one
+        assert core.get_account_id(session, 'alice') == core.DEFAULT_ACCOUNT_ID + 1
+        if engine.dialect.name == 'sqlite':
+            assert [article.item_id for article in core.search_articles(session, 'read')] == [11]
+    finally:
+        session.close()
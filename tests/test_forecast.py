@@ -0,0 +1,76 @@
+"""
+Forecast of when the backlog is read, from the net results of the Reports
+"""
+import datetime
+
+import pytest
+
+import pocketstats_core as core
+from pocketstats import get_forecast_summary
+from pocketstats_core import Report
+
+START = datetime.datetime(2020, 1, 1, 8)
+
+
+def add_reports(forecast, net_results, account_id=core.DEFAULT_ACCOUNT_ID):
+    """
+    The import, then a report per day with the net results; returns the time of the last one
+    """
+    forecast.add(account_id, START, 1000)
+    for day, net_result in enumerate(net_results, 1):
+        forecast.add(account_id, START + datetime.timedelta(days=day), net_result)
+    return START + datetime.timedelta(days=len(net_results))
+
+
+def test_forecast_known_rate():
+    forecast = core.BacklogForecast()
+    now = add_reports(forecast, [-5] * 40)
+
+    result = forecast.forecast(200, now)
+
+    assert result['rate'] == pytest.approx(-5)
+    assert result['deviation'] == pytest.approx(0, abs=1e-6)
+    assert result['windows'] == dict((days, pytest.approx(-5)) for days in core.FORECAST_WINDOWS)
+    assert result['completion'] == now + datetime.timedelta(days=40)
+    assert result['earliest'] == result['latest'] == result['completion']
+
+
+def test_forecast_accounts_add_up():
+    forecast = core.BacklogForecast()
+    add_reports(forecast, [-5] * 10, account_id=1)
+    now = add_reports(forecast, [2] * 10, account_id=2)
+
+    result = forecast.forecast(300, now)
+
+    assert result['rate'] == pytest.approx(-3)
+    assert result['completion'] == now + datetime.timedelta(days=100)
+
+
+def test_forecast_never():
+    # A growing backlog is never read
+    forecast = core.BacklogForecast()
+    now = add_reports(forecast, [3] * 20)
+    result = forecast.forecast(200, now)
+    assert result['rate'] == pytest.approx(3)
+    assert result['completion'] is None
+    assert 'will not be read' in get_forecast_summary(result)
+
+    # Neither without anything but the import to go on
+    forecast = core.BacklogForecast()
+    now = add_reports(forecast, [])
+    result = forecast.forecast(200, now)
+    assert result['rate'] is None
+    assert result['completion'] is None
+    assert result['windows'] == dict((days, None) for days in core.FORECAST_WINDOWS)
+
+
+def test_backlog_forecast_from_reports(session):
+    for day in range(15):
+        net_result = 500 if day == 0 else -4
+        session.add(Report(time_updated=START + datetime.timedelta(days=day), nr_added=max(net_result, 0), nr_read=max(-net_result, 0), nr_deleted=0))
+    session.commit()
+
+    result = core.get_backlog_forecast(session, now=START + datetime.timedelta(days=14))
+
+    assert result['rate'] == pytest.approx(-4)
+    assert result['unread'] == core.get_rollup_totals(session)['unread']
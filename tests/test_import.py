@@ -0,0 +1,169 @@
+"""
+Import of the complete archive in pages, against the synthetic archive of benchmark.FakePocket
+"""
+import json
+
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_core import Article, ArticleEvent, ImportCheckpoint, Report, ReportTiming
+
+PAGE_SIZE = 100
+
+
+class InterruptedPocket(FakePocket):
+    """
+    FakePocket that fails every request after the first fail_after, and that can delete items after a number of requests
+    """
+
+    def __init__(self, nr_items, fail_after=None, delete_after=None, delete_item_ids=()):
+        FakePocket.__init__(self, nr_items)
+        self.nr_requests = 0
+        self.fail_after = fail_after
+        self.delete_after = delete_after
+        self.delete_item_ids = delete_item_ids
+
+    def get(self, **kwargs):
+        if self.fail_after is not None and self.nr_requests >= self.fail_after:
+            raise ConnectionError('Connection reset by peer')
+        self.nr_requests += 1
+        if self.nr_requests == self.delete_after:
+            for item_id in self.delete_item_ids:
+                self.items[item_id] = {'item_id': item_id, 'status': '2'}
+                self.changed_at[item_id] = self.since + 1
+        return FakePocket.get(self, **kwargs)
+
+
+def get_item_ids(session):
+    return set(str(row[0]) for row in session.query(Article.item_id))
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_import_pages(session, logger, monkeypatch, bulk):
+    monkeypatch.setattr(core, 'IMPORT_PAGE_SIZE', PAGE_SIZE)
+    fake_pocket = FakePocket(1050)
+
+    report = core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+
+    assert get_item_ids(session) == set(fake_pocket.items)
+    assert report.total_response == 1050
+    assert report.nr_added == 1050
+    assert report.time_since_unix == fake_pocket.since
+    assert session.query(ImportCheckpoint).count() == 0
+    assert session.query(ReportTiming).filter(ReportTiming.report_id == report.id).count() == 1
+    assert core.get_last_update(session) == fake_pocket.since
+
+
+def test_import_report(session, logger):
+    fake_pocket = FakePocket(500)
+    fake_pocket.advance(read_ratio=0.1, delete_ratio=0, favourite_ratio=0.05, add_ratio=0.02)
+    items = fake_pocket.items.values()
+
+    report = core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+
+    assert report.total_response == len(items)
+    assert report.nr_added == len(items)
+    assert report.nr_read == len([item for item in items if item['status'] == '1'])
+    assert report.nr_favourited == len([item for item in items if item['favorite'] == '1'])
+    assert report.nr_deleted == 0
+    assert report.nr_updated == 0
+    events = session.query(ArticleEvent.event_type).filter(ArticleEvent.report_id == report.id)
+    assert events.filter(ArticleEvent.event_type == 'read').count() == report.nr_read
+    assert core.get_rollup_totals(session)['read'] == report.nr_read
+
+
+def test_import_resumes_from_checkpoint(session, logger):
+    fake_pocket = InterruptedPocket(1050, fail_after=3)
+    with pytest.raises(ConnectionError):
+        core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+    session.rollback()
+
+    # Every page after the first starts IMPORT_PAGE_OVERLAP items before the end of the one before
+    step = PAGE_SIZE - core.IMPORT_PAGE_OVERLAP
+    checkpoint = session.query(ImportCheckpoint).one()
+    assert checkpoint.offset == 3 * step
+    assert checkpoint.total_response == PAGE_SIZE + 2 * step
+    assert len(get_item_ids(session)) == PAGE_SIZE + 2 * step
+    assert session.query(Report).count() == 0
+    assert core.get_last_update(session) is None
+    time_started = checkpoint.time_started
+
+    fake_pocket.fail_after = None
+    report = core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+
+    assert get_item_ids(session) == set(fake_pocket.items)
+    assert report.time_updated == time_started
+    assert report.total_response == 1050
+    assert report.nr_added == 1050
+    assert session.query(ArticleEvent).filter(ArticleEvent.event_type == 'added').count() == 1050
+    assert session.query(ImportCheckpoint).count() == 0
+
+
+@pytest.mark.parametrize('nr_deleted', [1, core.IMPORT_PAGE_OVERLAP, core.IMPORT_PAGE_OVERLAP + 15])
+def test_import_items_deleted_during_import(session, logger, nr_deleted):
+    # The items on the first page get deleted after the second page, so the items after them move back
+    fake_pocket = InterruptedPocket(450, delete_after=2, delete_item_ids=[str(item_id) for item_id in range(1, nr_deleted + 1)])
+
+    report = core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+
+    assert get_item_ids(session) == set(fake_pocket.items)
+    assert report.total_response == 450
+    assert report.nr_added == 450
+
+
+@pytest.mark.parametrize('nr_deleted', [core.IMPORT_PAGE_OVERLAP - 1, core.IMPORT_PAGE_OVERLAP, core.IMPORT_PAGE_OVERLAP + 1])
+def test_import_overlap_deleted_before_third_page(session, logger, nr_deleted):
+    # With exactly the overlap deleted, the third page starts right at the next item, so it has none of the imported
+    # items while nothing was skipped
+    fake_pocket = InterruptedPocket(450, delete_after=3, delete_item_ids=[str(item_id) for item_id in range(1, nr_deleted + 1)])
+
+    report = core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+
+    assert get_item_ids(session) == set(fake_pocket.items)
+    assert report.total_response == 450
+    assert report.nr_added == 450
+
+
+def test_import_existing_articles(session, logger):
+    # Articles without a Report or checkpoint, like after replaying the archive of an interrupted import: an
+    # import leaves the unchanged ones alone, but still goes through all pages once
+    fake_pocket = InterruptedPocket(450)
+    core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+    session.query(ArticleEvent).delete()
+    session.query(Report).delete()
+    session.commit()
+    fake_pocket.advance(read_ratio=0.1, delete_ratio=0, favourite_ratio=0, add_ratio=0.1)
+    fake_pocket.nr_requests = 0
+
+    report = core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+
+    assert get_item_ids(session) == set(fake_pocket.items)
+    assert fake_pocket.nr_requests <= 6
+    assert report.total_response == 495
+    assert report.nr_added == 45
+    assert report.nr_read == 45
+    assert report.nr_updated == 45
+    assert session.query(ArticleEvent).filter(ArticleEvent.report_id == report.id).count() == 135
+
+
+def test_import_checkpoint_only_keeps_counts(session, logger):
+    # The events of the articles the import adds are taken from the articles when it's done, not kept in the
+    # checkpoint of every page
+    fake_pocket = InterruptedPocket(450, fail_after=3)
+    fake_pocket.advance(read_ratio=0.1, delete_ratio=0, favourite_ratio=0.05, add_ratio=0)
+    with pytest.raises(ConnectionError):
+        core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+    session.rollback()
+    checkpoint = session.query(ImportCheckpoint).one()
+    assert checkpoint.changed_articles == json.dumps(core.new_changed_articles())
+
+    fake_pocket.fail_after = None
+    report = core.import_all(logger, session, fake_pocket, page_size=PAGE_SIZE)
+
+    items = fake_pocket.items.values()
+    assert report.nr_added == 450
+    assert report.nr_read == len([item for item in items if item['status'] == '1'])
+    assert report.nr_favourited == len([item for item in items if item['favorite'] == '1'])
+    events = session.query(ArticleEvent).filter(ArticleEvent.report_id == report.id)
+    assert events.filter(ArticleEvent.event_type == 'favourited').count() == report.nr_favourited
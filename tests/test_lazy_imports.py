@@ -0,0 +1,27 @@
+"""
+The commands only import the heavy modules they need
+"""
+import os
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def get_imported(code, modules):
+    """
+    Returns which of modules are imported after running code in a fresh interpreter
+    """
+    script = code + '\nimport sys\nprint(" ".join(module for module in ' + repr(modules) + ' if module in sys.modules))'
+    output = subprocess.check_output([sys.executable, '-c', script], cwd=ROOT).decode()
+    # pocketstats prints a line of its own when it's not run as script
+    return output.splitlines()[-1].split()
+
+
+def test_cli_imports_nothing_heavy():
+    assert get_imported('import pocketstats', ['sqlalchemy', 'pocket', 'requests', 'utilkit']) == []
+
+
+def test_core_does_not_import_pocket():
+    # The database commands (showstats, search, history, ...) don't talk to the Pocket API
+    assert get_imported('import pocketstats_core', ['pocket', 'requests']) == []
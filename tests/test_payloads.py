@@ -0,0 +1,58 @@
+"""
+The authors, images and videos of the articles, stored once per distinct JSON in payload_blob
+"""
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_core import Article, PayloadBlob
+
+
+def get_authors(item_id, name):
+    return {'1': {'author_id': '1', 'item_id': item_id, 'name': name}}
+
+
+def test_pack_payload():
+    blob_id, data = core.pack_payload(get_authors('11', 'Ada'), '11')
+    # The same author of another item is the same blob
+    assert core.pack_payload(get_authors('12', 'Ada'), '12') == (blob_id, data)
+    assert core.pack_payload(get_authors('12', 'Grace'), '12')[0] != blob_id
+    assert core.unpack_payload(data, 12) == get_authors('12', 'Ada')
+
+    # Lists, and large payloads that are compressed
+    images = [{'image_id': str(image_id), 'item_id': '11', 'src': 'https://example.com/' + str(image_id) + '.jpg'} for image_id in range(50)]
+    blob_id, data = core.pack_payload(images, 11)
+    assert data[:1] == b'x'
+    assert core.unpack_payload(data, '11') == images
+    assert -2 ** 63 <= blob_id < 2 ** 63
+
+
+def test_save_payloads(session):
+    connection = session.connection()
+    payloads = dict(core.pack_payload(get_authors(item_id, name), item_id) for item_id, name in (('11', 'Ada'), ('12', 'Ada'), ('13', 'Grace')))
+    assert len(payloads) == 2
+    core.save_payloads(connection, dict(payloads))
+    # Saved again, e.g. by the next update, they are left alone
+    core.save_payloads(connection, dict(payloads))
+    session.commit()
+
+    assert session.query(PayloadBlob).count() == 2
+    blob_id = core.pack_payload(get_authors('12', 'Ada'), '12')[0]
+    assert core.get_payload(session, blob_id, 12) == get_authors('12', 'Ada')
+    assert core.get_payload(session, blob_id, 11) == get_authors('11', 'Ada')
+    assert core.get_payload(session, None, 11) is None
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_payloads_of_articles(session, logger, bulk):
+    fake_pocket = FakePocket(300)
+    core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+
+    for article in session.query(Article):
+        item = fake_pocket.items[str(article.item_id)]
+        assert article.get_authors() == item['authors']
+        assert article.get_images() == item['images']
+        assert article.get_videos() is None
+    # FakePocket has 50 authors, and an image per item
+    nr_authors = len(set(author['name'] for item in fake_pocket.items.values() for author in item['authors'].values()))
+    assert session.query(PayloadBlob).count() == nr_authors + 300
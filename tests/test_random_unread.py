@@ -0,0 +1,92 @@
+"""
+Sampling of random unread items for showreadlist
+"""
+import collections
+import datetime
+import random
+
+import sqlalchemy
+
+import pocketstats_core as core
+from pocketstats_core import Article
+
+
+def add_articles(session, nr_articles, unread_ids, word_counts=None):
+    """
+    Save nr_articles articles with id's from 1, of which only those in unread_ids are unread
+    """
+    word_counts = word_counts or {}
+    start = datetime.datetime(2014, 1, 1)
+    rows = []
+    for article_id in range(1, nr_articles + 1):
+        rows.append({
+            'id': article_id,
+            'account_id': core.DEFAULT_ACCOUNT_ID,
+            'item_id': article_id,
+            'resolved_url': 'https://example.com/' + str(article_id),
+            'status': 0 if article_id in unread_ids else 1,
+            'word_count': word_counts.get(article_id, 1000),
+            'firstseen_time_updated': start + datetime.timedelta(hours=article_id),
+        })
+    session.execute(Article.__table__.insert(), rows)
+    session.commit()
+
+
+def test_random_unread(session):
+    add_articles(session, 1000, set(range(1, 1001, 2)))
+    items = core.get_random_unread(session, number=5, seed=1)
+    assert len(items) == 5
+    assert len(set(item.id for item in items)) == 5
+    assert all(item.id % 2 == 1 for item in items)
+    # The same seed gives the same picks
+    assert [item.id for item in core.get_random_unread(session, number=5, seed=1)] == [item.id for item in items]
+
+
+def test_random_unread_less_than_number(session):
+    add_articles(session, 100, set([10, 20, 30]))
+    assert sorted(item.id for item in core.get_random_unread(session, number=5, seed=1)) == [10, 20, 30]
+    assert core.get_random_unread(session, number=0) == []
+
+
+def test_random_unread_weighted_outlier(session):
+    # One article is so much longer than the others that nearly every other pick is turned down for its weight
+    add_articles(session, 3000, set(range(1, 3001)), word_counts={1500: 500000})
+    for seed in range(10):
+        for weight in ('word_count', 'older'):
+            assert len(core.get_random_unread(session, number=5, weight=weight, seed=seed)) == 5
+
+
+def test_random_unread_sparse_is_uniform(session):
+    # So few unread items that the random id's keep missing, and items are taken by their rank in the index
+    unread_ids = set(random.Random(0).sample(range(1, 3301), 47))
+    add_articles(session, 3300, unread_ids)
+    counts = collections.Counter()
+    for seed in range(200):
+        counts.update(item.id for item in core.get_random_unread(session, number=5, seed=seed))
+    assert set(counts) == unread_ids
+    # 1000 picks of 47 items: about 21 each. Taking the next unread item after a random id would pick the items
+    # after long gaps far more often
+    expected = 1000.0 / len(unread_ids)
+    assert max(counts.values()) < expected * 1.8
+    assert min(counts.values()) > expected * 0.4
+
+
+def test_random_unread_bounded(session):
+    # Almost every random id between the first and last unread item misses, yet it gives up after a fixed number of queries
+    add_articles(session, 6, set(range(1, 7)))
+    session.execute(Article.__table__.insert(), [{'id': 10 ** 9, 'account_id': core.DEFAULT_ACCOUNT_ID, 'item_id': 10 ** 9, 'status': 0}])
+    session.commit()
+    queries = []
+
+    def before_cursor_execute(connection, cursor, statement, *args):
+        queries.append(statement)
+
+    sqlalchemy.event.listen(session.get_bind(), 'before_cursor_execute', before_cursor_execute)
+    try:
+        items = core.get_random_unread(session, number=5, seed=1)
+    finally:
+        sqlalchemy.event.remove(session.get_bind(), 'before_cursor_execute', before_cursor_execute)
+    assert len(items) <= 5
+    assert len(set(item.id for item in items)) == len(items)
+    assert len(queries) <= core.RANDOM_UNREAD_ATTEMPTS + 2
+    assert not any('count(' in query.lower() for query in queries)
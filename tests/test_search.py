@@ -0,0 +1,43 @@
+"""
+Full-text search, kept in sync with the articles by the triggers on article
+"""
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_core import Article
+from tests.test_tags import change_item
+
+
+def search(session, terms, **kwargs):
+    return sorted(str(row.item_id) for row in core.search_articles(session, core.get_search_query(terms), **kwargs))
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_search_follows_updates(session, logger, bulk):
+    if session.get_bind().dialect.name != 'sqlite':
+        pytest.skip('Full-text search needs SQLite')
+    fake_pocket = FakePocket(200)
+    change_item(fake_pocket, '7', resolved_title='Quokka facts')
+    core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+    assert search(session, ['quokka']) == ['7']
+
+    # A new title replaces the old one in the index
+    change_item(fake_pocket, '7', resolved_title='Zeppelin chronicles', excerpt='About airships')
+    core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+    assert search(session, ['quokka']) == []
+    assert search(session, ['zeppelin']) == ['7']
+    assert search(session, ['airships']) == ['7']
+
+    # Deleted in Pocket: Pocket only sends the status, so the article keeps its text and can be filtered out
+    fake_pocket.since += 60
+    fake_pocket.items['7'] = {'item_id': '7', 'status': '2'}
+    fake_pocket.changed_at['7'] = fake_pocket.since
+    core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+    assert search(session, ['zeppelin']) == ['7']
+    assert search(session, ['zeppelin'], status=0) == []
+
+    # Gone from the database
+    session.query(Article).filter(Article.item_id == 7).delete()
+    session.commit()
+    assert search(session, ['zeppelin']) == []
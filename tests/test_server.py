@@ -0,0 +1,41 @@
+"""
+Stats of the serve command, as JSON and as Prometheus metrics
+"""
+import pocketstats_core as core
+import pocketstats_server as server
+from benchmark import FakePocket
+
+
+def get_samples(metrics):
+    """
+    Returns {(name, labels): value} of the samples in the Prometheus text format
+    """
+    samples = {}
+    for line in metrics.splitlines():
+        if line.startswith('#'):
+            continue
+        series, value = line.rsplit(' ', 1)
+        name, _, labels = series.partition('{')
+        samples[(name, labels.rstrip('}'))] = float(value)
+    return samples
+
+
+def test_stats_and_metrics(session, logger):
+    fake_pocket = FakePocket(500)
+    core.updatestats_since_last(logger, session, None, pocket_instance=fake_pocket)
+    fake_pocket.advance(read_ratio=0.2, delete_ratio=0.05, favourite_ratio=0.1, add_ratio=0)
+    core.updatestats_since_last(logger, session, core.get_last_update(session), pocket_instance=fake_pocket)
+
+    stats = server.get_stats(session)
+    totals = stats['totals']
+    assert totals['total'] == 500
+    assert sum(month['added'] for month in stats['per_month']) == 500
+    assert stats['last_report']['nr_read'] > 0
+
+    samples = get_samples(server.get_metrics(stats))
+    statuses = dict((labels, value) for (name, labels), value in samples.items() if name == 'pocketstats_articles')
+    assert set(statuses) == set('status="' + status + '"' for status in server.ARTICLE_STATUSES)
+    assert sum(statuses.values()) == samples[('pocketstats_articles_all', '')] == totals['total']
+    assert samples[('pocketstats_articles_favourited', '')] == totals['favourited']
+    # No series per month, which would grow without bounds
+    assert not [labels for name, labels in samples if 'month' in labels]
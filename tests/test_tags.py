@@ -0,0 +1,63 @@
+"""
+The article_tag index, kept in sync by the updates
+"""
+import pytest
+
+import pocketstats_core as core
+from benchmark import FakePocket
+from pocketstats_core import Article, ArticleTag
+
+
+def change_item(fake_pocket, item_id, **values):
+    # Like a change in Pocket, returned by the next update
+    fake_pocket.since += 60
+    item = fake_pocket.items[item_id]
+    item.update(values)
+    item['time_updated'] = str(fake_pocket.since)
+    fake_pocket.changed_at[item_id] = fake_pocket.since
+    return item
+
+
+def get_tags(session, item_id):
+    return sorted(row[0] for row in session.query(ArticleTag.tag).filter(ArticleTag.item_id == item_id))
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_tags_follow_updates(session, logger, bulk):
+    fake_pocket = FakePocket(200)
+    core.updatestats_since_last(logger, session, None, bulk=bulk, pocket_instance=fake_pocket)
+    tagged = [item for item in fake_pocket.items.values() if 'tags' in item]
+    item_id = tagged[0]['item_id']
+    original_tags = sorted(tagged[0]['tags'])
+    assert get_tags(session, item_id) == original_tags
+    nr_tagged = dict((tag, total) for tag, total, read, unread in core.get_tag_stats(session))
+
+    # Another tag
+    item = change_item(fake_pocket, item_id)
+    item['tags'] = dict((tag, {'item_id': item_id, 'tag': tag}) for tag in ['fresh'])
+    core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+    assert get_tags(session, item_id) == ['fresh']
+
+    # The last tag removed: Pocket leaves tags out of the item
+    item = change_item(fake_pocket, item_id)
+    del item['tags']
+    core.updatestats_since_last(logger, session, core.get_last_update(session), bulk=bulk, pocket_instance=fake_pocket)
+    assert get_tags(session, item_id) == []
+    assert session.query(Article.tags).filter(Article.item_id == item_id).scalar() is None
+    tag_stats = dict((tag, total) for tag, total, read, unread in core.get_tag_stats(session))
+    assert 'fresh' not in tag_stats
+    for tag in original_tags:
+        assert tag_stats[tag] == nr_tagged[tag] - 1
+
+
+def test_deleted_items_keep_tags(session, logger):
+    fake_pocket = FakePocket(100)
+    core.updatestats_since_last(logger, session, None, pocket_instance=fake_pocket)
+    item = [item for item in fake_pocket.items.values() if 'tags' in item][0]
+
+    # Pocket only returns the status of deleted items
+    fake_pocket.since += 60
+    fake_pocket.items[item['item_id']] = {'item_id': item['item_id'], 'status': '2'}
+    fake_pocket.changed_at[item['item_id']] = fake_pocket.since
+    core.updatestats_since_last(logger, session, core.get_last_update(session), pocket_instance=fake_pocket)
+    assert get_tags(session, item['item_id']) == sorted(item['tags'])
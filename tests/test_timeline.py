@@ -0,0 +1,92 @@
+"""
+The timeline of articles added, read and deleted per period, with the backlog after each
+"""
+import calendar
+import datetime
+
+import pytest
+from click.testing import CliRunner
+
+import pocketstats
+import pocketstats_core as core
+from benchmark import FakePocket
+
+np = pytest.importorskip('numpy')
+analytics = pytest.importorskip('pocketstats_analytics')
+
+
+def epoch(*args):
+    return calendar.timegm(datetime.datetime(*args).timetuple()) if args else 0
+
+
+def get_columns(articles):
+    """
+    Timeline columns of (status, firstseen_time_updated, time_read, time_updated) per article
+    """
+    return dict((key, np.array(values, dtype=np.int64)) for key, values in zip(analytics.TIMELINE_COLUMNS, zip(*articles)))
+
+
+ARTICLES = [
+    # Added on Monday 2020-01-06 and read that week
+    (1, epoch(2020, 1, 6, 10), epoch(2020, 1, 8, 21), epoch(2020, 1, 8, 21)),
+    # Added the day after, deleted in February
+    (2, epoch(2020, 1, 7, 9), epoch(), epoch(2020, 2, 3, 12)),
+    # Still unread
+    (0, epoch(2020, 2, 10, 8), epoch(), epoch(2020, 2, 10, 8)),
+    # Added before its time was known, read in February
+    (1, epoch(), epoch(2020, 2, 11, 23), epoch(2020, 2, 11, 23)),
+]
+
+
+def test_timeline_weeks():
+    labels, added, read, deleted, backlog = analytics.get_timeline(get_columns(ARTICLES), 'week')
+    assert labels == ['2020-01-06', '2020-01-13', '2020-01-20', '2020-01-27', '2020-02-03', '2020-02-10']
+    assert list(added) == [2, 0, 0, 0, 0, 1]
+    assert list(read) == [1, 0, 0, 0, 0, 1]
+    assert list(deleted) == [0, 0, 0, 0, 1, 0]
+    # The article added at an unknown time is in the backlog from the start
+    assert list(backlog) == [2, 2, 2, 2, 1, 1]
+
+
+@pytest.mark.parametrize('bucket, labels', [
+    ('month', ['2020-01', '2020-02']),
+    ('quarter', ['2020-Q1']),
+])
+def test_timeline_months(bucket, labels):
+    timeline = analytics.get_timeline(get_columns(ARTICLES), bucket)
+    assert timeline[0] == labels
+    assert [list(values) for values in timeline[1:]] == {
+        'month': [[2, 1], [1, 1], [0, 1], [2, 1]],
+        'quarter': [[3], [2], [1], [1]],
+    }[bucket]
+
+
+def test_timeline_days_and_hours():
+    labels, added, read, deleted, backlog = analytics.get_timeline(get_columns(ARTICLES[:1]), 'day')
+    assert labels == ['2020-01-06', '2020-01-07', '2020-01-08']
+    assert (list(added), list(read), list(backlog)) == ([1, 0, 0], [0, 0, 1], [1, 1, 0])
+    labels, added, read, deleted, backlog = analytics.get_timeline(get_columns(ARTICLES[:1]), 'hour')
+    assert (labels[0], labels[-1], len(labels)) == ('2020-01-06 10:00', '2020-01-08 21:00', 60)
+
+
+def test_timeline_empty():
+    labels, added, read, deleted, backlog = analytics.get_timeline(get_columns([(0, 0, 0, 0)]), 'month')
+    assert labels == [] and len(backlog) == 0
+
+
+def test_timeline_command(session, logger, tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fake_pocket = FakePocket(300)
+    core.updatestats_since_last(logger, session, None, pocket_instance=fake_pocket)
+    fake_pocket.advance(read_ratio=0.1, delete_ratio=0.05, favourite_ratio=0, add_ratio=0.05)
+    core.updatestats_since_last(logger, session, core.get_last_update(session), pocket_instance=fake_pocket)
+
+    result = CliRunner().invoke(pocketstats.cli, ['timeline', '--bucket=day', '--csv'])
+    assert result.exit_code == 0, result.output
+    lines = result.output.splitlines()
+    assert lines[0] == 'day,added,read,deleted,backlog'
+    rows = [[int(value) for value in line.split(',')[1:]] for line in lines[1:]]
+    # The same totals as the rollup
+    totals = core.get_rollup_totals(session)
+    assert [sum(row[column] for row in rows) for column in range(3)] == [totals['total'], totals['read'], totals['deleted']]
+    assert rows[-1][3] == totals['unread']